@@ -0,0 +1,258 @@
+"""
+Trajectory filters of pose estimation results.
+
+Filters operate on whole (frames, body parts, coords) arrays at once, with
+likelihood in the last coordinate, which is passed through unfiltered. Frames
+below p-cutoff are masked, and gaps of up to max_gap frames are linearly
+interpolated before the filters are applied in order.
+
+Params:
+    pcutoff (float): Likelihood threshold of the masked frames.
+    max_gap (int): Optional. Longest interpolated gap, in frames. Default 10.
+    filters (list): Optional. Filters applied in order, as dicts with "type" and
+        its arguments:
+            {"type": "median", "window": 5}
+            {"type": "savgol", "window": 7, "polyorder": 2}
+            {"type": "kalman", "process_noise": 1.0, "measurement_noise": 4.0,
+             "halo": 200}
+
+`filter_chunks` filters a stream of chunks with overlapping halos. Results are
+identical to filtering the whole array, except for the Kalman smoother, which is
+restarted at the beginning of each halo ("halo" frames of warm-up).
+"""
+
+import warnings
+import numpy as np
+from numpy.lib.stride_tricks import sliding_window_view
+
+
+def interpolate_gaps(values: np.ndarray, valid: np.ndarray, max_gap: int):
+    """Linearly interpolate gaps of up to max_gap frames, NaN elsewhere if invalid.
+
+    Args:
+        values (np.ndarray): Array (frames, series).
+        valid (np.ndarray): Boolean array (frames, series) of the usable values.
+        max_gap (int): Longest interpolated gap, in frames.
+
+    Returns:
+        Array (frames, series) of floats
+    """
+    nframes = len(values)
+    frame_index = np.arange(nframes)[:, None]
+    previous = np.maximum.accumulate(np.where(valid, frame_index, -1), axis=0)
+    following = np.minimum.accumulate(
+        np.where(valid, frame_index, nframes)[::-1], axis=0
+    )[::-1]
+    fill = (
+        ~valid
+        & (previous >= 0)
+        & (following < nframes)
+        & (following - previous - 1 <= max_gap)
+    )
+
+    result = np.where(valid, values, np.nan).astype(float)
+    if fill.any():
+        previous_value = np.take_along_axis(values, np.clip(previous, 0, None), axis=0)
+        following_value = np.take_along_axis(
+            values, np.clip(following, None, nframes - 1), axis=0
+        )
+        with np.errstate(invalid="ignore", divide="ignore"):
+            weight = (frame_index - previous) / (following - previous)
+        interpolated = previous_value + weight * (following_value - previous_value)
+        result[fill] = interpolated[fill]
+    return result
+
+
+def _pad_edges(values: np.ndarray, half_window: int) -> np.ndarray:
+    return np.pad(values, [(half_window, half_window), (0, 0)], mode="edge")
+
+
+def median_filter(values: np.ndarray, window: int = 5) -> np.ndarray:
+    """Running median along frames, ignoring NaN, with nearest-value edges"""
+    _check_window(window)
+    windows = sliding_window_view(_pad_edges(values, window // 2), window, axis=0)
+    with warnings.catch_warnings():  # windows without values stay NaN
+        warnings.simplefilter("ignore", RuntimeWarning)
+        return np.nanmedian(windows, axis=-1)
+
+
+def savgol_coefficients(window: int, polyorder: int) -> np.ndarray:
+    """Savitzky-Golay smoothing weights of the window, centered"""
+    _check_window(window)
+    if polyorder >= window:
+        raise ValueError(f"polyorder ({polyorder}) must be less than window")
+    offsets = np.arange(window) - window // 2
+    design = np.vander(offsets, polyorder + 1, increasing=True)
+    return np.linalg.pinv(design)[0]
+
+
+def savgol_filter(values: np.ndarray, window: int = 7, polyorder: int = 2):
+    """Savitzky-Golay smoothing along frames, with nearest-value edges"""
+    coefficients = savgol_coefficients(window, polyorder)
+    windows = sliding_window_view(_pad_edges(values, window // 2), window, axis=0)
+    return windows @ coefficients
+
+
+def kalman_smoother(
+    values: np.ndarray,
+    likelihood: np.ndarray = None,
+    process_noise: float = 1.0,
+    measurement_noise: float = 4.0,
+) -> np.ndarray:
+    """Constant-velocity Kalman filter and Rauch-Tung-Striebel smoother.
+
+    All series are smoothed together, as elementwise 2x2 matrix algebra. NaN
+    values are missing measurements, filled by the model.
+
+    Args:
+        values (np.ndarray): Array (frames, series).
+        likelihood (np.ndarray): Optional. Array (frames, series). The measurement
+            noise of a frame is measurement_noise / likelihood.
+        process_noise (float): Optional. Acceleration noise (px^2 / frame^3).
+        measurement_noise (float): Optional. Position noise (px^2).
+    """
+    nframes, n_series = values.shape
+    if likelihood is None:
+        noise = np.full(values.shape, float(measurement_noise))
+    else:
+        noise = measurement_noise / np.clip(likelihood, 1e-3, 1)
+    q = float(process_noise)
+
+    # filtered state (position, velocity) and covariance (p00, p01, p11)
+    state = np.empty((nframes, 2, n_series))
+    cov = np.empty((nframes, 3, n_series))
+    predicted_state = np.empty((nframes, 2, n_series))
+    predicted_cov = np.empty((nframes, 3, n_series))
+
+    position = np.where(np.isfinite(values[0]), values[0], 0.0) if nframes else None
+    velocity = np.zeros(n_series)
+    p00, p01, p11 = np.full(n_series, 1e4), np.zeros(n_series), np.full(n_series, 1e4)
+    for t in range(nframes):
+        if t:  # predict
+            position = position + velocity
+            p00, p01, p11 = p00 + 2 * p01 + p11 + q / 3, p01 + p11 + q / 2, p11 + q
+        predicted_state[t] = position, velocity
+        predicted_cov[t] = p00, p01, p11
+
+        measured = np.isfinite(values[t])
+        innovation = np.where(measured, values[t] - position, 0.0)
+        gain0 = np.where(measured, p00 / (p00 + noise[t]), 0.0)
+        gain1 = np.where(measured, p01 / (p00 + noise[t]), 0.0)
+        position = position + gain0 * innovation
+        velocity = velocity + gain1 * innovation
+        p00, p01, p11 = (1 - gain0) * p00, (1 - gain0) * p01, p11 - gain1 * p01
+        state[t] = position, velocity
+        cov[t] = p00, p01, p11
+
+    smoothed = np.empty((nframes, n_series))
+    if not nframes:
+        return smoothed
+    smoothed_position, smoothed_velocity = state[-1]
+    smoothed[-1] = smoothed_position
+    for t in range(nframes - 2, -1, -1):
+        # gain C = P_t F' inv(P_pred_t+1), with F = [[1, 1], [0, 1]]
+        f00, f01, f11 = cov[t]
+        a00, a01, a10, a11 = f00 + f01, f01, f01 + f11, f11
+        n00, n01, n11 = predicted_cov[t + 1]
+        determinant = n00 * n11 - n01 * n01
+        c00 = (a00 * n11 - a01 * n01) / determinant
+        c01 = (a01 * n00 - a00 * n01) / determinant
+        c10 = (a10 * n11 - a11 * n01) / determinant
+        c11 = (a11 * n00 - a10 * n01) / determinant
+        d_position = smoothed_position - predicted_state[t + 1, 0]
+        d_velocity = smoothed_velocity - predicted_state[t + 1, 1]
+        smoothed_position, smoothed_velocity = (
+            state[t, 0] + c00 * d_position + c01 * d_velocity,
+            state[t, 1] + c10 * d_position + c11 * d_velocity,
+        )
+        smoothed[t] = smoothed_position
+    return smoothed
+
+
+def filter_positions(positions: np.ndarray, params: dict) -> np.ndarray:
+    """Mask, interpolate and filter the coordinates of all body parts at once.
+
+    Args:
+        positions (np.ndarray): Array (frames, body parts, coords), with
+            likelihood in the last coordinate.
+        params (dict): See the module docstring.
+
+    Returns:
+        Filtered float array of the same shape
+    """
+    nframes, n_body_parts, n_coords = positions.shape
+    likelihood = positions[..., -1]
+    series = positions[..., :-1].reshape(nframes, -1).astype(float)
+    series_likelihood = np.repeat(likelihood, n_coords - 1, axis=1)
+
+    valid = np.isfinite(series) & (series_likelihood >= params["pcutoff"])
+    series = interpolate_gaps(series, valid, params.get("max_gap", 10))
+
+    for filter_params in params.get("filters", []):
+        filter_params = dict(filter_params)
+        filter_type = filter_params.pop("type")
+        if filter_type == "median":
+            series = median_filter(series, **filter_params)
+        elif filter_type == "savgol":
+            series = savgol_filter(series, **filter_params)
+        elif filter_type == "kalman":
+            filter_params.pop("halo", None)
+            series = kalman_smoother(series, series_likelihood, **filter_params)
+        else:
+            raise ValueError(f"Unknown filter type: {filter_type}")
+
+    filtered = np.empty(positions.shape, dtype=float)
+    filtered[..., :-1] = series.reshape(nframes, n_body_parts, n_coords - 1)
+    filtered[..., -1] = likelihood
+    return filtered
+
+
+def filter_halo(params: dict) -> int:
+    """Frames of context needed on each side of a chunk to filter it exactly"""
+    halo = params.get("max_gap", 10) + 1
+    for filter_params in params.get("filters", []):
+        if filter_params["type"] == "kalman":
+            halo += filter_params.get("halo", 200)
+        else:
+            halo += filter_params.get("window", 5) // 2
+    return halo
+
+
+def filter_chunks(chunks, params: dict):
+    """Filter consecutive chunks of a recording, with halos from their neighbors.
+
+    Each chunk is filtered once the next one is read, so that at most three
+    chunks are held in memory. Chunks other than the last must have at least
+    `filter_halo(params)` frames.
+
+    Args:
+        chunks (iterable): (frame_start, array (frames, body parts, coords)) of
+            consecutive chunks, e.g. from `dlc_reader.PoseEstimation.iter_frames`.
+        params (dict): See the module docstring.
+
+    Yields:
+        Tuple of (a) index of the first frame of the chunk and (b) filtered chunk
+    """
+    halo = filter_halo(params)
+    previous, current = None, None
+    for frame_start, chunk in chunks:
+        if current is not None:
+            yield _filter_with_halo(previous, current, chunk, halo, params)
+        previous, current = current, (frame_start, chunk)
+    if current is not None:
+        yield _filter_with_halo(previous, current, None, halo, params)
+
+
+def _filter_with_halo(previous, current, following, halo: int, params: dict):
+    frame_start, chunk = current
+    if len(chunk) < halo and following is not None:
+        raise ValueError(f"Chunks must have at least {halo} frames to be filtered")
+    before = previous[1][-halo:] if previous is not None else chunk[:0]
+    after = following[:halo] if following is not None else chunk[:0]
+    filtered = filter_positions(np.concatenate([before, chunk, after]), params)
+    return frame_start, filtered[len(before) : len(before) + len(chunk)]
+
+
+def _check_window(window: int):
+    if window < 1 or window % 2 == 0:
+        raise ValueError(f"Filter window must be a positive odd number: {window}")
@@ -0,0 +1,74 @@
+"""
+Kinematics of pose estimation results.
+
+Derivatives, distances and angles are computed for all frames and body parts at
+once from (frames, body parts, 2) arrays of x, y, NaN where not located.
+"""
+
+import numpy as np
+
+
+def motion(xy: np.ndarray, fps: float) -> np.ndarray:
+    """Velocity, speed and acceleration of each body part.
+
+    Args:
+        xy (np.ndarray): Array (frames, body parts, 2) of x, y (px).
+        fps (float): Frame rate (Hz).
+
+    Returns:
+        Array (frames, body parts, 4) of vx, vy, speed (px/s) and the magnitude of
+            the acceleration (px/s^2), central differences in the interior
+    """
+    result = np.full((*xy.shape[:2], 4), np.nan)
+    if len(xy) < 2:
+        return result
+    velocity = np.gradient(xy, 1 / fps, axis=0)
+    result[..., :2] = velocity
+    result[..., 2] = np.hypot(velocity[..., 0], velocity[..., 1])
+    acceleration = np.gradient(velocity, 1 / fps, axis=0)
+    result[..., 3] = np.hypot(acceleration[..., 0], acceleration[..., 1])
+    return result
+
+
+def skeleton_edges(skeleton: list, body_parts: list) -> np.ndarray:
+    """Index pairs (edges, 2) of the skeleton segments between known body parts"""
+    index = {body_part: i for i, body_part in enumerate(body_parts)}
+    edges = [
+        (index[a], index[b]) for a, b in skeleton or [] if a in index and b in index
+    ]
+    return np.array(edges, dtype=int).reshape(-1, 2)
+
+
+def pairwise_edges(n_body_parts: int) -> np.ndarray:
+    """Index pairs (pairs, 2) of all body parts"""
+    return np.stack(np.triu_indices(n_body_parts, k=1), axis=-1)
+
+
+def distances(xy: np.ndarray, edges: np.ndarray) -> np.ndarray:
+    """Distances (frames, edges) between the body parts of each index pair"""
+    delta = xy[:, edges[:, 0]] - xy[:, edges[:, 1]]
+    return np.hypot(delta[..., 0], delta[..., 1])
+
+
+def joint_triplets(edges: np.ndarray) -> np.ndarray:
+    """(joint, a, b) index triplets of every two edges sharing a body part"""
+    edges = np.asarray(edges).reshape(-1, 2)
+    triplets = []
+    for joint in np.unique(edges):
+        neighbors = np.concatenate(
+            [edges[edges[:, 0] == joint, 1], edges[edges[:, 1] == joint, 0]]
+        )
+        neighbors = np.unique(neighbors[neighbors != joint])
+        a, b = np.triu_indices(len(neighbors), k=1)
+        triplets.extend((joint, neighbors[i], neighbors[j]) for i, j in zip(a, b))
+    return np.array(triplets, dtype=int).reshape(-1, 3)
+
+
+def joint_angles(xy: np.ndarray, triplets: np.ndarray) -> np.ndarray:
+    """Angles (frames, triplets) in degrees, in [0, 180], at the joint of each
+    (joint, a, b) triplet between the segments to a and to b"""
+    to_a = xy[:, triplets[:, 1]] - xy[:, triplets[:, 0]]
+    to_b = xy[:, triplets[:, 2]] - xy[:, triplets[:, 0]]
+    cross = to_a[..., 0] * to_b[..., 1] - to_a[..., 1] * to_b[..., 0]
+    dot = (to_a * to_b).sum(axis=-1)
+    return np.degrees(np.abs(np.arctan2(cross, dot)))
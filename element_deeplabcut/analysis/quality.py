@@ -0,0 +1,102 @@
+"""
+Quality metrics of pose estimation results.
+
+All metrics are computed column-wise on (frames, body parts) arrays, one pass per
+metric without a Python loop over frames or body parts.
+"""
+
+import warnings
+import numpy as np
+
+
+def longest_run(mask: np.ndarray) -> np.ndarray:
+    """Length of the longest run of True along the first axis, per column"""
+    mask = np.asarray(mask, dtype=bool)
+    if not len(mask):
+        return np.zeros(mask.shape[1:], dtype=int)
+    frame_index = np.arange(len(mask)).reshape(-1, *[1] * (mask.ndim - 1))
+    last_false = np.maximum.accumulate(np.where(mask, -1, frame_index), axis=0)
+    return (frame_index - last_false).max(axis=0)
+
+
+def jump_outliers(x: np.ndarray, y: np.ndarray, n_mads: float = 6) -> tuple:
+    """Frame-to-frame displacements larger than median + n_mads robust SDs.
+
+    Args:
+        x (np.ndarray): X positions (frames, body parts), NaN where missing.
+        y (np.ndarray): Y positions (frames, body parts), NaN where missing.
+        n_mads (float): Optional. Threshold, in scaled median absolute deviations.
+
+    Returns:
+        Tuple of (a) threshold (px), (b) number of outlier jumps and (c) number of
+            valid jumps, each per body part
+    """
+    displacement = np.hypot(np.diff(x, axis=0), np.diff(y, axis=0))
+    valid = np.isfinite(displacement)
+    n_valid = valid.sum(axis=0)
+    if not displacement.size:
+        threshold = np.full(displacement.shape[1], np.nan)
+        return threshold, np.zeros_like(n_valid), n_valid
+    with warnings.catch_warnings():  # All-NaN columns have a NaN threshold
+        warnings.simplefilter("ignore", RuntimeWarning)
+        median = np.nanmedian(displacement, axis=0)
+        mad = 1.4826 * np.nanmedian(np.abs(displacement - median), axis=0)
+    threshold = median + n_mads * mad
+    with np.errstate(invalid="ignore"):
+        n_outliers = (valid & (displacement > threshold)).sum(axis=0)
+    return threshold, n_outliers, n_valid
+
+
+def pose_quality(
+    positions: np.ndarray,
+    px_width: int,
+    px_height: int,
+    pcutoff: float,
+    n_mads: float = 6,
+) -> dict:
+    """Quality metrics of each body part of a pose estimation.
+
+    Args:
+        positions (np.ndarray): Array (frames, body parts, >= 3) of x, y, ..., with
+            likelihood in the last coordinate.
+        px_width (int): Video width in pixels.
+        px_height (int): Video height in pixels.
+        pcutoff (float): Likelihood threshold.
+        n_mads (float): Optional. Jump outlier threshold, see `jump_outliers`.
+
+    Returns:
+        Dict of arrays, one value per body part: fraction_above_pcutoff,
+            longest_low_likelihood_run (frames), jump_threshold (px),
+            jump_outliers, jump_outlier_fraction, out_of_frame and
+            out_of_frame_fraction. Fractions are NaN when undefined.
+    """
+    x, y = positions[..., 0], positions[..., 1]
+    likelihood = positions[..., -1]
+    nframes = len(positions)
+
+    above = likelihood >= pcutoff
+    n_above = above.sum(axis=0)
+    threshold, n_jump_outliers, n_jumps = jump_outliers(x, y, n_mads)
+
+    located = np.isfinite(x) & np.isfinite(y)
+    with np.errstate(invalid="ignore"):
+        outside = located & ((x < 0) | (x >= px_width) | (y < 0) | (y >= px_height))
+    n_located = located.sum(axis=0)
+    n_outside = outside.sum(axis=0)
+
+    with np.errstate(all="ignore"):
+        return {
+            "fraction_above_pcutoff": (
+                n_above / nframes if nframes else n_above * np.nan
+            ),
+            "longest_low_likelihood_run": longest_run(~above),
+            "jump_threshold": threshold,
+            "jump_outliers": n_jump_outliers,
+            "jump_outlier_fraction": np.where(
+                n_jumps > 0, n_jump_outliers / n_jumps, np.nan
+            ),
+            "out_of_frame": n_outside,
+            "out_of_frame_fraction": np.where(
+                n_located > 0, n_outside / n_located, np.nan
+            ),
+        }
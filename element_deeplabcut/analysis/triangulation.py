@@ -0,0 +1,98 @@
+"""
+Triangulation of synchronized 2D pose estimations from calibrated cameras.
+
+Points are triangulated with the direct linear transform (DLT), with the two
+equations of each view weighted by its likelihood. All frames and body parts of a
+chunk are solved at once, as a batch of small SVD problems.
+"""
+
+import numpy as np
+
+
+def projection_matrix(
+    intrinsics: np.ndarray, rotation: np.ndarray, translation: np.ndarray
+) -> np.ndarray:
+    """Projection matrix (3, 4) K [R | t] of a camera"""
+    extrinsics = np.hstack(
+        [np.asarray(rotation, dtype=float), np.reshape(translation, (3, 1))]
+    )
+    return np.asarray(intrinsics, dtype=float) @ extrinsics
+
+
+def triangulate(
+    points: np.ndarray, weights: np.ndarray, projections: np.ndarray
+) -> np.ndarray:
+    """Likelihood-weighted DLT triangulation.
+
+    Args:
+        points (np.ndarray): Array (views, ..., 2) of x, y (px), e.g. (views,
+            frames, body parts, 2).
+        weights (np.ndarray): Array (views, ...) of weights, e.g. likelihoods,
+            0 for views not used.
+        projections (np.ndarray): Array (views, 3, 4) of projection matrices.
+
+    Returns:
+        Array (..., 3) of x, y, z, NaN where fewer than two views are used
+    """
+    n_views = len(projections)
+    shape = points.shape[1:-1]
+    points = points.reshape(n_views, -1, 2)
+    weights = weights.reshape(n_views, -1)
+    usable = np.isfinite(points).all(axis=-1) & (weights > 0)
+    weights = np.where(usable, weights, 0.0)
+    points = np.where(usable[..., None], points, 0.0)
+
+    # rows w * (x P3 - P1) and w * (y P3 - P2) of each view: (points, 2 * views, 4)
+    rows = (
+        points[..., None] * projections[:, None, 2:3, :] - projections[:, None, :2, :]
+    ) * weights[..., None, None]
+    system = rows.transpose(1, 0, 2, 3).reshape(-1, 2 * n_views, 4)
+
+    solution = np.linalg.svd(system)[2][:, -1, :]
+    with np.errstate(invalid="ignore", divide="ignore"):
+        xyz = solution[:, :3] / solution[:, 3:]
+    xyz[usable.sum(axis=0) < 2] = np.nan
+    return xyz.reshape(*shape, 3)
+
+
+def reproject(xyz: np.ndarray, projections: np.ndarray) -> np.ndarray:
+    """Projections (views, ..., 2) of points (..., 3) in each camera"""
+    homogeneous = np.concatenate([xyz, np.ones((*xyz.shape[:-1], 1))], axis=-1)
+    projected = np.einsum("vij,...j->v...i", projections, homogeneous)
+    with np.errstate(invalid="ignore", divide="ignore"):
+        return projected[..., :2] / projected[..., 2:]
+
+
+def reprojection_error(
+    xyz: np.ndarray, points: np.ndarray, weights: np.ndarray, projections: np.ndarray
+) -> np.ndarray:
+    """Mean distance (px) between the 2D points and the reprojected 3D points,
+    over the views used"""
+    distance = np.linalg.norm(reproject(xyz, projections) - points, axis=-1)
+    used = np.isfinite(distance) & (weights > 0)
+    with np.errstate(invalid="ignore", divide="ignore"):
+        return np.where(used, distance, 0).sum(axis=0) / used.sum(axis=0)
+
+
+def triangulate_chunks(
+    points: np.ndarray,
+    weights: np.ndarray,
+    projections: np.ndarray,
+    chunk_size: int = 100000,
+):
+    """Triangulate (views, frames, body parts, 2) points in chunks of frames.
+
+    Peak memory of the SVD batches is set by chunk_size, not the session length.
+
+    Yields:
+        Tuple of (a) index of the first frame of the chunk, (b) array (frames,
+            body parts, 3) of x, y, z and (c) array (frames, body parts) of
+            reprojection errors (px)
+    """
+    for start in range(0, points.shape[1], chunk_size):
+        chunk_points = points[:, start : start + chunk_size]
+        chunk_weights = weights[:, start : start + chunk_size]
+        xyz = triangulate(chunk_points, chunk_weights, projections)
+        yield start, xyz, reprojection_error(
+            xyz, chunk_points, chunk_weights, projections
+        )
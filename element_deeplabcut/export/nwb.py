@@ -11,6 +11,7 @@ from collections import abc
 from pynwb import NWBHDF5IO
 from hdmf.build.warnings import DtypeConversionWarning
 from .. import model
+from ..readers import dlc_reader
 
 
 try:  # Not all users will want NWB export, so dependency not in requirements.
@@ -51,8 +52,12 @@ def dlc_session_to_nwb(
         output_dir = model.PoseEstimationTask.infer_output_dir(key)
         config_file = str(output_dir / "dj_dlc_config.yaml")
         video_name = Path((model.VideoRecording.File & key).fetch1("file_path")).stem
-        h5file = next(output_dir.glob(f"{video_name}*h5"))
-        output_path = h5file.replace(".h5", f"_{subject_id}.nwb")  # DLC2NWB convention
+        h5file = dlc_reader.find_files(
+            output_dir, f"{video_name}*h5", category="h5", recursive=False
+        )[0]
+        # DLC2NWB convention
+        output_path = h5file.with_name(f"{h5file.stem}_{subject_id}.nwb").as_posix()
+        h5file = h5file.as_posix()
 
         if Path(output_path).exists():
             logger.warning(f"Skipping {subject_id}. NWB already exists.")
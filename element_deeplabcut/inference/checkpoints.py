@@ -0,0 +1,139 @@
+"""
+Per-video completion markers for resumable pose estimation.
+
+After a video is analyzed and its outputs validated, a marker
+`.{video stem}.dj_dlc_done.json` is written to the output directory. It records
+the hash of the inference settings, the frame count and the output file sizes.
+A later run skips videos whose marker matches, and analyzes the others. Outputs
+with another frame count than expected are moved to `.dj_dlc_quarantine/` and
+left without marker.
+"""
+
+import re
+import glob
+import json
+import time
+import pickle
+import shutil
+import logging
+import pandas as pd
+from pathlib import Path
+from element_interface.utils import dict_to_uuid
+from ..readers.dlc_reader import paired_h5_path
+
+logger = logging.getLogger("datajoint")
+
+
+def find_outputs(output_dir: Path, video_stem: str) -> list:
+    """(meta pickle, h5) path pairs of a video, including its segment outputs"""
+    output_dir = Path(output_dir)
+    # "{stem}DLC..." or "{stem}_seg000DLC...", not the outputs of "{stem}_seg..."
+    pattern = re.compile(re.escape(video_stem) + r"(_seg\d{3})?DLC.*_meta")
+    pairs = []
+    for meta_path in sorted(output_dir.glob(f"{glob.escape(video_stem)}*_meta.pickle")):
+        if not pattern.fullmatch(meta_path.stem):
+            continue
+        stem = meta_path.stem.removesuffix("_meta")
+        h5_path = paired_h5_path(meta_path, output_dir.glob(f"{glob.escape(stem)}*.h5"))
+        if h5_path is not None:
+            pairs.append((meta_path, h5_path))
+    return pairs
+
+
+def output_nframes(output_dir: Path, video_stem: str):
+    """Total frames in the readable h5 outputs of a video, None if none are"""
+    pairs = find_outputs(output_dir, video_stem)
+    if not pairs:
+        return None
+    nframes = 0
+    for meta_path, h5_path in pairs:
+        try:
+            with open(meta_path, "rb") as f:
+                pickle.load(f)
+            with pd.HDFStore(h5_path, mode="r") as store:
+                nframes += int(store.get_storer(store.keys()[0]).nrows)
+        except Exception as e:  # truncated or partially written files
+            logger.warning(f"Unreadable DLC output {h5_path}: {e}")
+            return None
+    return nframes
+
+
+class VideoCheckpoints:
+    """Completion markers of the videos of one pose estimation task.
+
+    Args:
+        output_dir (Path): Output directory of the task.
+        uniqueness_dict (dict): Inference settings. Markers written with other
+            settings are ignored.
+    """
+
+    def __init__(self, output_dir: Path, uniqueness_dict: dict):
+        self.output_dir = Path(output_dir)
+        self.settings_hash = str(dict_to_uuid(uniqueness_dict))
+
+    def marker_path(self, video: Path) -> Path:
+        return self.output_dir / f".{Path(video).stem}.dj_dlc_done.json"
+
+    def is_done(self, video: Path) -> bool:
+        """Whether the video has a matching marker and unchanged outputs"""
+        try:
+            with open(self.marker_path(video), "r") as f:
+                marker = json.load(f)
+        except (OSError, ValueError):
+            return False
+        if marker.get("settings_hash") != self.settings_hash:
+            return False
+        return marker["outputs"] == self._output_sizes(video)
+
+    def mark_done(self, video: Path, nframes: int):
+        """Write the marker of an analyzed video"""
+        marker = {
+            "video": Path(video).name,
+            "settings_hash": self.settings_hash,
+            "nframes": nframes,
+            "outputs": self._output_sizes(video),
+        }
+        with open(self.marker_path(video), "w") as f:
+            json.dump(marker, f)
+
+    def validate(self, video: Path, expected_nframes: int) -> int:
+        """Frame count of the outputs of a video, which must be the expected one
+
+        Outputs with another frame count are quarantined, see `quarantine`.
+
+        Raises:
+            FileNotFoundError: If the video has no readable outputs.
+            ValueError: If the frame count differs from expected_nframes.
+        """
+        nframes = output_nframes(self.output_dir, Path(video).stem)
+        if nframes is None:
+            raise FileNotFoundError(f"No readable DLC output for {video}")
+        if nframes != expected_nframes:
+            quarantine_dir = self.quarantine(video)
+            raise ValueError(
+                f"DLC output of {Path(video).name} has {nframes} frames,"
+                + f" RecordingInfo expects {expected_nframes}."
+                + f" Outputs moved to {quarantine_dir}"
+            )
+        return nframes
+
+    def quarantine(self, video: Path) -> Path:
+        """Move the outputs and marker of a video out of the way of readers"""
+        quarantine_dir = (
+            self.output_dir
+            / ".dj_dlc_quarantine"
+            / f"{Path(video).stem}_{time.strftime('%Y%m%d%H%M%S')}"
+        )
+        quarantine_dir.mkdir(parents=True, exist_ok=True)
+        for pair in find_outputs(self.output_dir, Path(video).stem):
+            for fp in pair:
+                shutil.move(fp, quarantine_dir / fp.name)
+        self.marker_path(video).unlink(missing_ok=True)
+        return quarantine_dir
+
+    def _output_sizes(self, video: Path) -> dict:
+        return {
+            fp.name: fp.stat().st_size
+            for pair in find_outputs(self.output_dir, Path(video).stem)
+            for fp in pair
+        }
@@ -0,0 +1,434 @@
+"""
+Registry of inference engines, selected by `Model.engine`.
+
+An engine provides the analyze_videos function used by `PoseEstimation` and the
+scorer name recorded in `Model`. Register a new engine by subclassing
+`InferenceEngine` and decorating it with `register_engine("name")`.
+"""
+
+import re
+import time
+import pickle
+import logging
+import numpy as np
+import pandas as pd
+from pathlib import Path
+from ruamel.yaml import YAML
+from ..readers.video_probe import open_video_at
+
+logger = logging.getLogger("datajoint")
+
+_engines = {}
+
+
+def register_engine(name: str):
+    """Class decorator adding an `InferenceEngine` subclass to the registry"""
+
+    def decorator(engine_class):
+        engine_class.name = name
+        _engines[name] = engine_class
+        return engine_class
+
+    return decorator
+
+
+def list_engines() -> list:
+    """Names of the registered engines"""
+    return sorted(_engines)
+
+
+def get_engine(name: str = None) -> "InferenceEngine":
+    """Return an instance of the registered engine. Defaults to TensorFlow."""
+    if name is None:
+        logger.warning(
+            "DLC engine not specified in config file. Defaulting to TensorFlow."
+        )
+        name = "tensorflow"
+    if name not in _engines:
+        raise ValueError(f"Unknow engine type {name}. Registered: {list_engines()}")
+    return _engines[name]()
+
+
+class InferenceEngine:
+    """Base class of inference engines.
+
+    `get_analyze_videos` returns a callable with DLC's analyze_videos signature:
+    config, videos, shuffle, trainingsetindex, destfolder and modelprefix, plus
+    optional keyword parameters. Outputs must follow DLC's naming and layout,
+    `{video stem}{scorer}.h5` and `{video stem}{scorer}_meta.pickle`, so they
+    can be read by `readers.dlc_reader`.
+    """
+
+    name = None
+    holds_session = False  # whether weights stay loaded between analyze_videos calls
+
+    def get_analyze_videos(self):
+        """Return the analyze_videos callable of this engine"""
+        raise NotImplementedError
+
+    def model_nbytes(self, dlc_model: dict) -> int:
+        """Estimated memory of the weights this engine keeps loaded for a model.
+
+        0 for engines that restore the weights on each call.
+        """
+        return 0
+
+    def close(self):
+        """Release the sessions held by this engine"""
+
+    def get_scorer_name(
+        self, dlc_config: dict, shuffle: int, trainingsetindex: int, model_prefix=""
+    ) -> str:
+        """Return DLC's scorer name of the model, as in the output file names"""
+        raise NotImplementedError
+
+
+@register_engine("tensorflow")
+class TensorFlowEngine(InferenceEngine):
+    """DeepLabCut's TensorFlow engine"""
+
+    def get_analyze_videos(self):
+        from deeplabcut.pose_estimation_tensorflow import analyze_videos
+
+        return analyze_videos
+
+    def get_scorer_name(self, dlc_config, shuffle, trainingsetindex, model_prefix=""):
+        from deeplabcut.utils.auxiliaryfunctions import GetScorerName  # isort:skip
+        from ..model import str_to_bool
+
+        # "or 'f'" below covers case where config returns None. str_to_bool handles else
+        scorer_legacy = str_to_bool(dlc_config.get("scorer_legacy", "f"))
+        return GetScorerName(
+            cfg=dlc_config,
+            shuffle=shuffle,
+            trainFraction=dlc_config["TrainingFraction"][int(trainingsetindex)],
+            modelprefix=model_prefix,
+        )[scorer_legacy]
+
+
+@register_engine("pytorch")
+class PyTorchEngine(InferenceEngine):
+    """DeepLabCut's PyTorch engine"""
+
+    def get_analyze_videos(self):
+        from deeplabcut.pose_estimation_pytorch import analyze_videos
+
+        return analyze_videos
+
+    def get_scorer_name(self, dlc_config, shuffle, trainingsetindex, model_prefix=""):
+        from deeplabcut.pose_estimation_pytorch.apis.utils import get_scorer_name
+
+        return get_scorer_name(
+            cfg=dlc_config,
+            shuffle=shuffle,
+            train_fraction=dlc_config["TrainingFraction"][int(trainingsetindex)],
+            modelprefix=model_prefix,
+        )
+
+
+@register_engine("onnx")
+class ExportedModelEngine(InferenceEngine):
+    """CPU inference of an exported DLC model with onnxruntime.
+
+    Expects the model exported by `deeplabcut.export_model` and converted to ONNX
+    (e.g. with tf2onnx), as `exported-models/DLC_{Task}_*_iteration-{iteration}_
+    shuffle-{shuffle}/*.onnx` in the project, next to the exported pose_cfg.yaml.
+    The network may output poses (batch, joints, 3), or score maps and location
+    refinement maps that are decoded as in DLC. Scorer names are the TensorFlow
+    ones, since exported models come from TensorFlow projects.
+
+    Sessions are kept per model file, so an engine instance held by the inference
+    worker keeps the weights loaded between jobs.
+    """
+
+    holds_session = True
+
+    def __init__(self):
+        self._sessions = {}  # {(onnx path, n_threads): InferenceSession}
+
+    def get_analyze_videos(self):
+        return self.analyze_videos
+
+    def model_nbytes(self, dlc_model: dict) -> int:
+        """Size of the exported model files of the model's shuffle"""
+        exported_dir = (
+            Path(dlc_model["project_path"])
+            / (dlc_model.get("model_prefix") or "")
+            / "exported-models"
+        )
+        # the pattern ends with the shuffle: "shuffle-1" does not match "shuffle-10"
+        return sum(
+            fp.stat().st_size
+            for model_dir in exported_dir.glob(
+                f"DLC_*_shuffle-{int(dlc_model['shuffle'])}"
+            )
+            for fp in model_dir.glob("*.onnx")
+        )
+
+    def close(self):
+        self._sessions.clear()
+
+    def get_scorer_name(self, dlc_config, shuffle, trainingsetindex, model_prefix=""):
+        return TensorFlowEngine().get_scorer_name(
+            dlc_config, shuffle, trainingsetindex, model_prefix
+        )
+
+    def analyze_videos(
+        self,
+        config: str,
+        videos: list,
+        shuffle: int = 1,
+        trainingsetindex: int = 0,
+        destfolder: str = None,
+        modelprefix: str = "",
+        dlc_scorer: str = None,
+        batch_size: int = 8,
+        n_threads: int = None,
+        save_as_csv: bool = False,
+        frame_range: tuple = None,
+        output_stem: str = None,
+        sequential_seek: bool = False,
+    ):
+        """Analyze videos and save DLC-compatible outputs.
+
+        Args:
+            config (str): Path to the project config.yaml.
+            videos (list): Full paths to the videos.
+            shuffle (int): Shuffle of the exported model.
+            trainingsetindex (int): Index of the training fraction in the config.
+            destfolder (str): Optional. Output directory. Defaults to the video's.
+            modelprefix (str): Optional. Subdirectory of the model in the project.
+            dlc_scorer (str): Optional. Scorer name of the model (`Model.scorer`).
+                Defaults to the TensorFlow scorer name, which requires deeplabcut.
+            batch_size (int): Optional. Number of frames per inference call.
+            n_threads (int): Optional. Intra-op threads of the CPU runtime.
+                Defaults to onnxruntime's choice (all physical cores).
+            save_as_csv (bool): Optional. Also save the poses as csv.
+            frame_range (tuple): Optional. (start, stop) frames to analyze, stop
+                None for the end of the video. Defaults to all frames.
+            output_stem (str): Optional. Stem of the output files instead of the
+                video stem. Requires a single video.
+            sequential_seek (bool): Optional. Decode up to the start of frame_range
+                instead of seeking, see `video_probe.open_video_at`.
+        """
+        if output_stem is not None and len(videos) != 1:
+            raise ValueError("output_stem requires a single video")
+
+        yaml = YAML(typ="safe", pure=True)
+        with open(config, "rb") as f:
+            cfg = yaml.load(f)
+
+        model_dir = self.find_model_dir(cfg, shuffle, modelprefix)
+        onnx_path = sorted(model_dir.glob("*.onnx"))[-1]
+        with open(model_dir / "pose_cfg.yaml", "rb") as f:
+            pose_cfg = yaml.load(f)
+        session = self.get_session(onnx_path, n_threads)
+
+        snapshot = re.search(r"(\d+)$", onnx_path.stem)
+        if dlc_scorer is None:
+            dlc_scorer = self.get_scorer_name(
+                cfg, shuffle, trainingsetindex, modelprefix
+            )
+        if snapshot and dlc_scorer.split("_")[-1] != snapshot.group(1):
+            dlc_scorer = f"{dlc_scorer}_{snapshot.group(1)}"
+
+        bodyparts = pose_cfg.get("all_joints_names") or cfg["bodyparts"]
+        for video in videos:
+            video = Path(video)
+            start = time.time()
+            poses, fps, frame_dimensions = self.predict_video(
+                session, video, pose_cfg, cfg, batch_size, frame_range, sequential_seek
+            )
+            stop = time.time()
+            metadata = {
+                "start": start,
+                "stop": stop,
+                "run_duration": stop - start,
+                "Scorer": dlc_scorer,
+                "DLC-model-config file": pose_cfg,
+                "fps": fps,
+                "batch_size": batch_size,
+                "frame_dimensions": frame_dimensions,
+                "nframes": len(poses),
+                "iteration (active-learning)": cfg["iteration"],
+                "training set fraction": cfg["TrainingFraction"][int(trainingsetindex)],
+                "cropping": bool(cfg.get("cropping")),
+                "cropping_parameters": [cfg.get(k) for k in ("x1", "x2", "y1", "y2")],
+                "engine": self.name,
+            }
+            save_dlc_output(
+                Path(destfolder or video.parent),
+                output_stem or video.stem,
+                dlc_scorer,
+                bodyparts,
+                poses,
+                metadata,
+                save_as_csv=save_as_csv,
+            )
+
+    @staticmethod
+    def find_model_dir(cfg: dict, shuffle: int, modelprefix: str = "") -> Path:
+        """Directory of the exported model in the DLC project"""
+        exported_dir = Path(cfg["project_path"]) / modelprefix / "exported-models"
+        pattern = f"DLC_{cfg['Task']}_*_iteration-{cfg['iteration']}_shuffle-{shuffle}"
+        model_dirs = sorted(exported_dir.glob(pattern))
+        if not model_dirs:
+            raise FileNotFoundError(f"No exported model {pattern} in {exported_dir}")
+        return model_dirs[-1]
+
+    def get_session(self, onnx_path: Path, n_threads: int = None):
+        """Cached onnxruntime session of the model, on the CPU"""
+        import onnxruntime
+
+        session_key = (Path(onnx_path).as_posix(), n_threads)
+        if session_key not in self._sessions:
+            options = onnxruntime.SessionOptions()
+            options.graph_optimization_level = (
+                onnxruntime.GraphOptimizationLevel.ORT_ENABLE_ALL
+            )
+            options.execution_mode = onnxruntime.ExecutionMode.ORT_SEQUENTIAL
+            options.inter_op_num_threads = 1
+            if n_threads:
+                options.intra_op_num_threads = n_threads
+            self._sessions[session_key] = onnxruntime.InferenceSession(
+                session_key[0], options, providers=["CPUExecutionProvider"]
+            )
+        return self._sessions[session_key]
+
+    def predict_video(
+        self,
+        session,
+        video: Path,
+        pose_cfg: dict,
+        cfg: dict,
+        batch_size: int,
+        frame_range: tuple = None,
+        sequential_seek: bool = False,
+    ) -> tuple:
+        """Run the network over the frames of a video, or over a (start, stop) range.
+
+        Returns:
+            Tuple of (a) float32 array (frames, joints, 3) of x, y, likelihood,
+                (b) fps and (c) frame dimensions (height, width)
+        """
+        import cv2
+
+        model_input = session.get_inputs()[0]
+        if isinstance(model_input.shape[0], int):
+            batch_size = model_input.shape[0]  # fixed batch size in the graph
+        x1, y1 = (cfg["x1"], cfg["y1"]) if cfg.get("cropping") else (0, 0)
+
+        start, stop = frame_range or (0, None)
+        cap = open_video_at(video, start, sequential=sequential_seek)
+        fps = cap.get(cv2.CAP_PROP_FPS)
+        poses, batch = [], []
+        frame_dimensions = None
+        try:
+            frame_index = start
+            while True:
+                ret = stop is None or frame_index < stop
+                if ret:
+                    ret, frame = cap.read()
+                    frame_index += 1
+                if ret:
+                    if frame_dimensions is None:
+                        frame_dimensions = frame.shape[:2]
+                    if cfg.get("cropping"):
+                        frame = frame[cfg["y1"] : cfg["y2"], cfg["x1"] : cfg["x2"]]
+                    batch.append(cv2.cvtColor(frame, cv2.COLOR_BGR2RGB))
+                if batch and (len(batch) == batch_size or not ret):
+                    nbatch = len(batch)
+                    batch += [batch[-1]] * (batch_size - nbatch)  # pad last batch
+                    outputs = session.run(
+                        None, {model_input.name: np.stack(batch).astype(np.float32)}
+                    )
+                    poses.append(decode_outputs(outputs, pose_cfg)[:nbatch])
+                    batch = []
+                if not ret:
+                    break
+        finally:
+            cap.release()
+
+        num_joints = len(pose_cfg["all_joints_names"])
+        poses = (
+            np.concatenate(poses)
+            if poses
+            else np.empty((0, num_joints, 3), dtype=np.float32)
+        )
+        poses[..., 0] += x1
+        poses[..., 1] += y1
+        return poses, fps, frame_dimensions
+
+
+def decode_outputs(outputs: list, pose_cfg: dict) -> np.ndarray:
+    """Poses (batch, joints, 3) from the outputs of an exported DLC network.
+
+    Args:
+        outputs (list): Network outputs. Either a single pose array, reshapeable to
+            (batch, joints, 3), or a score map (batch, h, w, joints) and location
+            refinement map (batch, h, w, 2 * joints).
+        pose_cfg (dict): Exported pose_cfg.yaml, with all_joints_names, stride
+            and locref_stdev.
+    """
+    num_joints = len(pose_cfg["all_joints_names"])
+    if len(outputs) == 1:
+        return np.asarray(outputs[0], dtype=np.float32).reshape(-1, num_joints, 3)
+
+    scmap, locref = sorted(outputs[:2], key=lambda output: output.shape[-1])
+    nbatch, height, width, _ = scmap.shape
+    locref = locref.reshape(nbatch, height, width, num_joints, 2)
+    locref = locref * pose_cfg.get("locref_stdev", 7.2801)
+    stride = pose_cfg.get("stride", 8.0)
+
+    flat_index = scmap.reshape(nbatch, -1, num_joints).argmax(axis=1)
+    rows, cols = np.unravel_index(flat_index, (height, width))
+    batch_index, joint_index = np.indices((nbatch, num_joints))
+    offsets = locref[batch_index, rows, cols, joint_index]  # (batch, joints, 2)
+
+    poses = np.empty((nbatch, num_joints, 3), dtype=np.float32)
+    poses[..., 0] = cols * stride + 0.5 * stride + offsets[..., 0]
+    poses[..., 1] = rows * stride + 0.5 * stride + offsets[..., 1]
+    poses[..., 2] = scmap[batch_index, rows, cols, joint_index]
+    return poses
+
+
+def save_dlc_output(
+    destfolder: Path,
+    video_stem: str,
+    dlc_scorer: str,
+    bodyparts: list,
+    poses: np.ndarray,
+    metadata: dict,
+    save_as_csv: bool = False,
+) -> Path:
+    """Save poses with DLC's h5 and meta pickle layout.
+
+    Args:
+        destfolder (Path): Output directory.
+        video_stem (str): Stem of the analyzed video.
+        dlc_scorer (str): Scorer name, ending with the training iteration.
+        bodyparts (list): Body part names, in the order of the poses.
+        poses (np.ndarray): Array (frames, bodyparts, 3) of x, y, likelihood.
+        metadata (dict): Contents of the meta pickle "data" dict.
+        save_as_csv (bool): Optional. Also save the poses as csv.
+
+    Returns:
+        Path of the h5 file
+    """
+    columns = pd.MultiIndex.from_product(
+        [[dlc_scorer], bodyparts, ["x", "y", "likelihood"]],
+        names=["scorer", "bodyparts", "coords"],
+    )
+    df = pd.DataFrame(
+        np.asarray(poses, dtype=np.float64).reshape(len(poses), -1), columns=columns
+    )
+
+    destfolder = Path(destfolder)
+    destfolder.mkdir(parents=True, exist_ok=True)
+    h5_path = destfolder / f"{video_stem}{dlc_scorer}.h5"
+    df.to_hdf(h5_path, key="df_with_missing", format="table", mode="w")
+    if save_as_csv:
+        df.to_csv(h5_path.with_suffix(".csv"))
+    with open(destfolder / f"{video_stem}{dlc_scorer}_meta.pickle", "wb") as f:
+        pickle.dump({"data": metadata}, f, pickle.HIGHEST_PROTOCOL)
+    return h5_path
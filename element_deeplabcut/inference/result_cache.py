@@ -0,0 +1,145 @@
+"""
+Content-addressed cache of inference outputs.
+
+Entries are keyed by a sampled hash of the video bytes, the model identity and
+the inference settings, not by file paths. A moved or re-registered video is
+restored from the cache instead of analyzed again. Output names are stored
+relative to the video stem and renamed for the new video on restore.
+"""
+
+import os
+import json
+import shutil
+import hashlib
+import logging
+import tempfile
+from pathlib import Path
+from element_interface.utils import dict_to_uuid
+from .checkpoints import find_outputs
+
+logger = logging.getLogger("datajoint")
+
+_FICLONE = 0x40049409  # Linux ioctl of reflink copies
+
+MODEL_IDENTITY_ATTRS = (
+    "project_path",
+    "scorer",
+    "shuffle",
+    "trainingsetindex",
+    "snapshotindex",
+    "engine",
+    "model_prefix",
+)
+
+
+def sampled_hash(file_path: str, n_samples: int = 16, sample_size: int = 65536) -> str:
+    """Hash of the size and of evenly spaced samples of a file, first and last included.
+
+    Reads at most n_samples * sample_size bytes, whatever the video length.
+    """
+    file_path = Path(file_path)
+    size = file_path.stat().st_size
+    digest = hashlib.blake2b(str(size).encode(), digest_size=16)
+    with open(file_path, "rb") as f:
+        if size <= n_samples * sample_size:
+            digest.update(f.read())
+        else:
+            step = (size - sample_size) / (n_samples - 1)
+            for i in range(n_samples):
+                f.seek(round(i * step))
+                digest.update(f.read(sample_size))
+    return digest.hexdigest()
+
+
+class ResultCache:
+    """Cache of inference outputs in a directory, `{key[:2]}/{key}/` per entry.
+
+    Args:
+        cache_dir (str): Root directory of the cache.
+    """
+
+    def __init__(self, cache_dir: str):
+        self.cache_dir = Path(cache_dir)
+
+    @staticmethod
+    def key(video: str, dlc_model: dict, inference_settings: dict) -> str:
+        """Cache key of the outputs of a video for a model and inference settings"""
+        return str(
+            dict_to_uuid(
+                {
+                    "video": sampled_hash(video),
+                    "model": {k: dlc_model.get(k) for k in MODEL_IDENTITY_ATTRS},
+                    "settings": inference_settings,
+                }
+            )
+        )
+
+    def entry_dir(self, key: str) -> Path:
+        return self.cache_dir / key[:2] / key
+
+    def restore(self, key: str, video_stem: str, output_dir: Path) -> bool:
+        """Copy cached outputs into output_dir, named for video_stem
+
+        Files are reflinked where the file system supports it, and otherwise
+        copied, so that the restored outputs are writable and independent of the
+        cache entry.
+
+        Returns:
+            Whether the entry was found and restored
+        """
+        entry_dir = self.entry_dir(key)
+        try:
+            with open(entry_dir / "manifest.json", "r") as f:
+                manifest = json.load(f)
+        except (OSError, ValueError):
+            return False
+        damaged = [
+            name
+            for name, size in manifest["files"].items()
+            if not (entry_dir / name).exists()
+            or (entry_dir / name).stat().st_size != size
+        ]
+        if damaged:
+            logger.warning(f"Discarding damaged inference cache entry {entry_dir}")
+            shutil.rmtree(entry_dir, ignore_errors=True)
+            return False
+
+        for name in manifest["files"]:
+            dest = Path(output_dir) / f"{video_stem}{name}"
+            dest.unlink(missing_ok=True)
+            _copy_file(entry_dir / name, dest)
+        logger.info(f"Restored DLC outputs of {video_stem} from the inference cache")
+        return True
+
+    def store(self, key: str, video_stem: str, output_dir: Path):
+        """Copy the outputs of a video into the cache"""
+        entry_dir = self.entry_dir(key)
+        if entry_dir.exists():
+            return
+        entry_dir.parent.mkdir(parents=True, exist_ok=True)
+        tmp_dir = Path(tempfile.mkdtemp(prefix=".tmp_", dir=entry_dir.parent))
+        try:
+            files = {}
+            for pair in find_outputs(output_dir, video_stem):
+                for fp in pair:
+                    name = fp.name[len(video_stem) :]
+                    shutil.copy2(fp, tmp_dir / name)
+                    files[name] = fp.stat().st_size
+            with open(tmp_dir / "manifest.json", "w") as f:
+                json.dump({"files": files}, f)
+            os.rename(tmp_dir, entry_dir)
+        except OSError as e:
+            logger.warning(f"Unable to store DLC outputs in the inference cache: {e}")
+            shutil.rmtree(tmp_dir, ignore_errors=True)
+
+
+def _copy_file(source: Path, dest: Path):
+    """Reflink source to dest if supported (e.g. btrfs, xfs), else copy it"""
+    try:
+        import fcntl
+
+        with open(source, "rb") as src, open(dest, "wb") as dst:
+            fcntl.ioctl(dst.fileno(), _FICLONE, src.fileno())
+        shutil.copystat(source, dest)
+    except (ImportError, OSError):  # not Linux, or no reflink support
+        shutil.copy2(source, dest)
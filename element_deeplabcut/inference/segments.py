@@ -0,0 +1,252 @@
+"""
+Segment-parallel inference of long videos.
+
+Each video is split into frame ranges that are analyzed in separate processes.
+Outputs are named `{video stem}_seg{index:03d}{scorer}`, so they sort in frame
+order and `readers.dlc_reader.PoseEstimation` stitches them into one trajectory.
+"""
+
+import os
+import glob
+import pickle
+import inspect
+import logging
+import tempfile
+import multiprocessing
+from pathlib import Path
+from concurrent.futures import ProcessPoolExecutor
+from ..readers.video_probe import open_video_at
+from .checkpoints import find_outputs, output_nframes
+from .engines import get_engine
+
+logger = logging.getLogger("datajoint")
+
+
+def split_frame_ranges(nframes: int, n_segments: int) -> list:
+    """Split frames into contiguous (start, stop) ranges of near-equal length.
+
+    The stop of the last range is None (read to the end of the video), since the
+    frame count reported by the container can be approximate.
+    """
+    n_segments = max(1, min(n_segments, nframes))
+    bounds = [round(i * nframes / n_segments) for i in range(n_segments + 1)]
+    ranges = list(zip(bounds[:-1], bounds[1:]))
+    ranges[-1] = (ranges[-1][0], None)
+    return ranges
+
+
+def segment_stem(video_stem: str, index: int) -> str:
+    """Stem of the outputs of one segment of a video"""
+    return f"{video_stem}_seg{index:03d}"
+
+
+def analyze_video_segments(
+    engine_name: str,
+    config_filepath: str,
+    dlc_model_: dict,
+    video_filepaths: list,
+    destfolder: str,
+    analyze_video_params: dict,
+    nframes: list,
+    fps: list,
+    n_segments: int,
+    n_workers: int = None,
+):
+    """Analyze videos as frame-range segments in a process pool.
+
+    Engines whose analyze_videos accepts `frame_range` read their range from the
+    video. For the others (e.g. DLC's), each process first writes its range to a
+    lossless temporary video. Segments whose outputs do not have the frame count
+    of their range are analyzed again without seeking.
+
+    Args:
+        engine_name (str): Registered inference engine, see `engines`.
+        config_filepath (str): Config passed to analyze_videos.
+        dlc_model_ (dict): Model entry.
+        video_filepaths (list): Full paths to the videos.
+        destfolder (str): Output directory.
+        analyze_video_params (dict): analyze_videos params.
+        nframes (list): Number of frames of each video.
+        fps (list): Frame rate of each video, recorded in the segment meta files.
+        n_segments (int): Number of segments per video.
+        n_workers (int): Optional. Number of processes. Defaults to the CPU count.
+    """
+    jobs = [
+        (video, index, frame_range, video_fps, video_nframes)
+        for video, video_nframes, video_fps in zip(video_filepaths, nframes, fps)
+        for index, frame_range in enumerate(
+            split_frame_ranges(video_nframes, n_segments)
+        )
+    ]
+    n_workers = min(n_workers or os.cpu_count(), len(jobs))
+    params = dict(analyze_video_params)
+    params.setdefault("n_threads", max(1, os.cpu_count() // n_workers))
+
+    # spawned processes start without the thread pools of the parent
+    with ProcessPoolExecutor(
+        max_workers=n_workers,
+        mp_context=multiprocessing.get_context("spawn"),
+        initializer=_limit_threads,
+        initargs=(params["n_threads"],),
+    ) as executor:
+
+        def submit(job, sequential_seek=False):
+            video, index, frame_range, video_fps, _ = job
+            return executor.submit(
+                _analyze_segment,
+                engine_name,
+                config_filepath,
+                dlc_model_,
+                video,
+                index,
+                frame_range,
+                video_fps,
+                destfolder,
+                params,
+                sequential_seek,
+            )
+
+        for future in [submit(job) for job in jobs]:
+            future.result()
+
+        # seeking is not frame-accurate for every video: segments with another
+        # frame count than their range are analyzed again, decoding sequentially
+        retried = [job for job in jobs if not _segment_complete(destfolder, job)]
+        for job in retried:
+            logger.warning(
+                f"Segment {job[1]} of {Path(job[0]).name} has a wrong frame count,"
+                + " analyzing it again without seeking"
+            )
+            for pair in find_outputs(destfolder, _job_stem(job)):
+                for fp in pair:
+                    fp.unlink()
+        for future in [submit(job, sequential_seek=True) for job in retried]:
+            future.result()
+
+    # the ranges of a video cover its nframes, so the totals match as well
+    incomplete = [job for job in retried if not _segment_complete(destfolder, job)]
+    if incomplete:
+        raise ValueError(
+            "Segment outputs do not have the frame counts of their ranges: "
+            + ", ".join(f"{Path(job[0]).name} {job[2]}" for job in incomplete)
+        )
+
+
+def _job_stem(job: tuple) -> str:
+    return segment_stem(Path(job[0]).stem, job[1])
+
+
+def _segment_complete(destfolder: str, job: tuple) -> bool:
+    """Whether the outputs of a segment job have the frames of its range"""
+    _, _, (start, stop), _, video_nframes = job
+    expected = (video_nframes if stop is None else stop) - start
+    return output_nframes(destfolder, _job_stem(job)) == expected
+
+
+def _limit_threads(n_threads: int):
+    """Limit the threads of numerical libraries in each segment process
+
+    Environment variables apply to the libraries loaded afterwards (e.g.
+    TensorFlow), threadpoolctl, if installed, to the BLAS already loaded.
+    """
+    for var in ("OMP_NUM_THREADS", "MKL_NUM_THREADS", "TF_NUM_INTRAOP_THREADS"):
+        os.environ[var] = str(n_threads)
+    try:
+        from threadpoolctl import threadpool_limits
+    except ImportError:
+        return
+    threadpool_limits(n_threads)
+
+
+def _analyze_segment(
+    engine_name: str,
+    config_filepath: str,
+    dlc_model_: dict,
+    video: str,
+    index: int,
+    frame_range: tuple,
+    fps: float,
+    destfolder: str,
+    params: dict,
+    sequential_seek: bool = False,
+):
+    from ..model import _run_analyze_videos
+
+    analyze_videos = get_engine(engine_name).get_analyze_videos()
+    video = Path(video)
+    stem = segment_stem(video.stem, index)
+
+    parameters = inspect.signature(analyze_videos).parameters
+    if "frame_range" in parameters:
+        params = {**params, "frame_range": frame_range, "output_stem": stem}
+        if sequential_seek and "sequential_seek" in parameters:
+            params["sequential_seek"] = True
+        _run_analyze_videos(
+            analyze_videos,
+            config_filepath,
+            dlc_model_,
+            [video.as_posix()],
+            destfolder,
+            params,
+        )
+    else:
+        with tempfile.TemporaryDirectory(
+            prefix=".dj_dlc_segment_", dir=destfolder
+        ) as tmp_dir:
+            segment_video = write_segment_video(
+                video, frame_range, Path(tmp_dir) / f"{stem}.avi", sequential_seek
+            )
+            _run_analyze_videos(
+                analyze_videos,
+                config_filepath,
+                dlc_model_,
+                [segment_video.as_posix()],
+                destfolder,
+                {**params, "videotype": "avi"},
+            )
+
+    # segments of a video must share their meta content, fps included
+    for meta_path in Path(destfolder).glob(f"{glob.escape(stem)}DLC*_meta.pickle"):
+        with open(meta_path, "rb") as f:
+            meta = pickle.load(f)
+        meta["data"]["fps"] = fps
+        with open(meta_path, "wb") as f:
+            pickle.dump(meta, f, pickle.HIGHEST_PROTOCOL)
+
+
+def write_segment_video(
+    video: Path, frame_range: tuple, segment_path: Path, sequential_seek=False
+) -> Path:
+    """Write a frame range of a video to a lossless (FFV1) video file
+
+    Args:
+        sequential_seek (bool): Optional. Decode up to the start of the range
+            instead of seeking, see `video_probe.open_video_at`.
+    """
+    import cv2
+
+    start, stop = frame_range
+    cap = open_video_at(video, start, sequential=sequential_seek)
+    writer = None
+    try:
+        frame_index = start
+        while stop is None or frame_index < stop:
+            ret, frame = cap.read()
+            if not ret:
+                break
+            if writer is None:
+                writer = cv2.VideoWriter(
+                    Path(segment_path).as_posix(),
+                    cv2.VideoWriter_fourcc(*"FFV1"),
+                    cap.get(cv2.CAP_PROP_FPS),
+                    (frame.shape[1], frame.shape[0]),
+                )
+            writer.write(frame)
+            frame_index += 1
+    finally:
+        cap.release()
+        if writer is not None:
+            writer.release()
+    if writer is None:
+        raise ValueError(f"No frames in range {frame_range} of {video}")
+    return Path(segment_path)
@@ -0,0 +1,376 @@
+"""
+Long-lived local inference worker for element-deeplabcut.
+
+`PoseEstimation.make` submits videos to the worker instead of calling DLC's
+analyze_videos in-process, when the linking module provides
+`get_dlc_inference_worker()`. The worker keeps the engines imported, so
+consecutive tasks skip the import and process start-up. Only engines holding a
+session, such as "onnx", also keep their model weights loaded between tasks, in an
+LRU bounded by the memory budget. DLC's tensorflow and pytorch analyze_videos
+restore the weights of the model on every call. Start the worker with:
+
+    export DJ_DLC_WORKER_AUTHKEY_FILE=~/.dj_dlc_worker_key  # secret, mode 600
+    python -m element_deeplabcut.inference.worker
+
+Requests are pickled, so anyone able to connect with the key can run code as the
+worker. The worker listens on a Unix socket by default, and on a TCP port only on
+loopback hosts unless remote hosts are explicitly allowed.
+"""
+
+import os
+import time
+import queue
+import logging
+import argparse
+import ipaddress
+import threading
+from pathlib import Path
+from collections import OrderedDict
+from multiprocessing import AuthenticationError
+from multiprocessing.connection import Client, Listener
+from .engines import get_engine
+
+logger = logging.getLogger("datajoint")
+
+AUTHKEY_ENV = "DJ_DLC_WORKER_AUTHKEY"
+AUTHKEY_FILE_ENV = "DJ_DLC_WORKER_AUTHKEY_FILE"
+DEFAULT_ADDRESS = (Path.home() / ".dj_dlc_inference_worker.sock").as_posix()
+
+
+def parse_address(address):
+    """Return a multiprocessing.connection address from "host:port" or a socket path"""
+    if isinstance(address, (tuple, list)):
+        return tuple(address)
+    host, sep, port = str(address).rpartition(":")
+    if sep and port.isdigit():
+        return host or "localhost", int(port)
+    return str(address)  # Unix domain socket
+
+
+def is_loopback(address) -> bool:
+    """Whether a parsed address is a Unix socket or a loopback host"""
+    if isinstance(address, str):
+        return True
+    host = address[0]
+    if host == "localhost":
+        return True
+    try:
+        return ipaddress.ip_address(host).is_loopback
+    except ValueError:  # other host names
+        return False
+
+
+def resolve_authkey(authkey=None, authkey_file: str = None) -> bytes:
+    """Shared secret of the worker and its clients.
+
+    Taken from authkey, authkey_file, or else the DJ_DLC_WORKER_AUTHKEY or
+    DJ_DLC_WORKER_AUTHKEY_FILE environment variables, in that order.
+
+    Raises:
+        ValueError: If no key is given.
+    """
+    if authkey is None and authkey_file is None:
+        authkey = os.environ.get(AUTHKEY_ENV) or None
+        authkey_file = os.environ.get(AUTHKEY_FILE_ENV) or None
+    if authkey is None and authkey_file is not None:
+        authkey = Path(authkey_file).expanduser().read_bytes().strip()
+    if not authkey:
+        raise ValueError(
+            "The inference worker requires a secret key: set "
+            + f"{AUTHKEY_ENV} or {AUTHKEY_FILE_ENV}, or pass authkey_file"
+        )
+    return authkey.encode() if isinstance(authkey, str) else authkey
+
+
+def model_key(dlc_model: dict) -> tuple:
+    """Identity of a loaded model in the worker's LRU"""
+    return (
+        Path(dlc_model["project_path"]).as_posix(),
+        int(dlc_model["shuffle"]),
+        int(dlc_model["trainingsetindex"]),
+        int(dlc_model["snapshotindex"]),
+        dlc_model.get("engine") or "tensorflow",
+        dlc_model.get("model_prefix", ""),
+    )
+
+
+class LoadedModel:
+    """An engine prepared by the worker for a model.
+
+    For the tensorflow and pytorch engines, only the engine's imports are kept:
+    their nbytes is 0 and they do not count towards the memory budget. Engines
+    holding a session, such as "onnx", keep the weights loaded until evicted.
+
+    Args:
+        dlc_model (dict): Model entry, with project_path as a full path.
+    """
+
+    def __init__(self, dlc_model: dict):
+        self.dlc_model = dlc_model
+        self.engine = get_engine(dlc_model.get("engine"))
+        self.analyze_videos = self.engine.get_analyze_videos()
+        self.nbytes = self.engine.model_nbytes(dlc_model)
+
+    def analyze(self, config: str, videos: list, destfolder: str, params: dict):
+        """Run analyze_videos for videos with this model"""
+        from ..model import _run_analyze_videos
+
+        _run_analyze_videos(
+            self.analyze_videos, config, self.dlc_model, videos, destfolder, params
+        )
+
+    def close(self):
+        """Release the sessions held by the model's engine"""
+        self.engine.close()
+        self.analyze_videos = None
+        self.engine = None
+
+
+class InferenceWorker:
+    """Serve analyze requests from local clients, one job at a time.
+
+    Args:
+        address (str): Optional. Unix socket path or "host:port" to listen on.
+        memory_budget (int): Optional. Bytes of session-holding (e.g. onnx) models
+            to keep, least recently used models are evicted beyond it. None for no
+            limit.
+        authkey (bytes): Optional. Shared key clients must present. Defaults to
+            `resolve_authkey()`.
+        allow_remote (bool): Optional. Allow listening on a non-loopback host.
+    """
+
+    def __init__(
+        self,
+        address: str = DEFAULT_ADDRESS,
+        memory_budget: int = None,
+        authkey: bytes = None,
+        allow_remote: bool = False,
+    ):
+        self.address = parse_address(address)
+        if not allow_remote and not is_loopback(self.address):
+            raise ValueError(
+                f"Refusing to listen on non-loopback host {self.address[0]}:"
+                + " requests can run code on the worker. Set allow_remote to override"
+            )
+        self.memory_budget = memory_budget
+        self.authkey = resolve_authkey(authkey)
+        self.models = OrderedDict()  # {model_key: LoadedModel}, least recent first
+        self.throughput = {}  # {model_key: {"videos", "frames", "seconds"}}
+        self._lock = threading.Lock()  # models and throughput, read by clients
+        self._jobs = queue.Queue()
+        self._busy = False
+
+    def serve_forever(self):
+        """Accept clients and process queued jobs until interrupted"""
+        threading.Thread(target=self._process_jobs, daemon=True).start()
+        with Listener(self.address, authkey=self.authkey) as listener:
+            if isinstance(self.address, str):
+                os.chmod(self.address, 0o600)
+            logger.info(f"DLC inference worker listening on {listener.address}")
+            while True:
+                try:
+                    conn = listener.accept()
+                except (AuthenticationError, EOFError, OSError) as e:
+                    logger.warning(f"Rejected inference worker client: {e!r}")
+                    continue
+                threading.Thread(
+                    target=self._handle_client, args=(conn,), daemon=True
+                ).start()
+
+    def status(self) -> dict:
+        """Queue depth, loaded models and per-model throughput"""
+        with self._lock:
+            models = {k: m.nbytes for k, m in self.models.items()}
+            throughput = {k: dict(stats) for k, stats in self.throughput.items()}
+        return {
+            "queue_depth": self._jobs.qsize() + int(self._busy),
+            "loaded_models": [list(k) for k in models],
+            "memory_bytes": sum(models.values()),
+            "throughput": [
+                {
+                    "model": list(k),
+                    **stats,
+                    "frames_per_second": (
+                        stats["frames"] / stats["seconds"] if stats["seconds"] else None
+                    ),
+                }
+                for k, stats in throughput.items()
+            ],
+        }
+
+    def _handle_client(self, conn):
+        with conn:
+            while True:
+                try:
+                    request = conn.recv()
+                except EOFError:
+                    return
+                if request.get("op") == "status":
+                    conn.send({"ok": True, "status": self.status()})
+                    continue
+                done = threading.Event()
+                job = {"request": request, "done": done}
+                self._jobs.put(job)
+                done.wait()
+                conn.send(job["response"])
+
+    def _process_jobs(self):
+        while True:
+            job = self._jobs.get()
+            self._busy = True
+            try:
+                job["response"] = {"ok": True, "result": self._analyze(job["request"])}
+            except Exception as e:
+                logger.exception("Inference job failed")
+                job["response"] = {"ok": False, "error": f"{type(e).__name__}: {e}"}
+            finally:
+                self._busy = False
+                job["done"].set()
+
+    def _get_model(self, dlc_model: dict) -> LoadedModel:
+        key = model_key(dlc_model)
+        with self._lock:
+            if key in self.models:
+                self.models.move_to_end(key)
+                return self.models[key]
+        loaded = LoadedModel(dlc_model)
+        evicted = []
+        with self._lock:
+            if self.memory_budget is not None and loaded.nbytes:
+                while self.models and (
+                    sum(m.nbytes for m in self.models.values()) + loaded.nbytes
+                    > self.memory_budget
+                ):
+                    evicted.append(self.models.popitem(last=False))
+            self.models[key] = loaded
+        for evicted_key, evicted_model in evicted:
+            evicted_model.close()
+            logger.info(f"Evicted model {evicted_key}")
+        return loaded
+
+    def _analyze(self, request: dict) -> dict:
+        from ..readers.video_probe import probe_video
+
+        loaded = self._get_model(request["model"])
+        start = time.monotonic()
+        loaded.analyze(
+            request["config"],
+            request["videos"],
+            request["destfolder"],
+            request.get("params") or {},
+        )
+        seconds = time.monotonic() - start
+        frames = sum(probe_video(video)["nframes"] for video in request["videos"])
+        with self._lock:
+            stats = self.throughput.setdefault(
+                model_key(request["model"]), {"videos": 0, "frames": 0, "seconds": 0.0}
+            )
+            stats["videos"] += len(request["videos"])
+            stats["frames"] += frames
+            stats["seconds"] += seconds
+        return {"frames": frames, "seconds": seconds}
+
+
+class InferenceClient:
+    """Submit analyze requests to a running `InferenceWorker`.
+
+    Args:
+        address (str): Optional. Unix socket path or "host:port" of the worker.
+        authkey (bytes): Optional. Shared key of the worker.
+        authkey_file (str): Optional. File holding the shared key. Without
+            authkey or authkey_file, see `resolve_authkey`.
+    """
+
+    def __init__(
+        self, address: str = DEFAULT_ADDRESS, authkey: bytes = None, authkey_file=None
+    ):
+        self.address = parse_address(address)
+        self.authkey = resolve_authkey(authkey, authkey_file)
+
+    def _request(self, request: dict):
+        with Client(self.address, authkey=self.authkey) as conn:
+            conn.send(request)
+            response = conn.recv()
+        if not response["ok"]:
+            raise RuntimeError(f"Inference worker error: {response['error']}")
+        return response
+
+    def status(self) -> dict:
+        """Queue depth, loaded models and per-model throughput of the worker"""
+        return self._request({"op": "status"})["status"]
+
+    def analyze_videos_func(self, dlc_model: dict, project_path: str):
+        """Return an analyze_videos replacement that runs on the worker.
+
+        Args:
+            dlc_model (dict): Model entry.
+            project_path (str): Full path of the model's DLC project.
+        """
+        worker_model = {
+            k: dlc_model.get(k)
+            for k in (
+                "shuffle",
+                "trainingsetindex",
+                "snapshotindex",
+                "engine",
+                "model_prefix",
+                "scorer",
+            )
+        }
+        worker_model["project_path"] = Path(project_path).as_posix()
+
+        def analyze_videos(config, videos, destfolder, **params):
+            for k in ("shuffle", "trainingsetindex", "modelprefix"):
+                params.pop(k, None)  # taken from the model
+            return self._request(
+                {
+                    "op": "analyze",
+                    "model": worker_model,
+                    "config": str(config),
+                    "videos": [str(v) for v in videos],
+                    "destfolder": str(destfolder),
+                    "params": params,
+                }
+            )["result"]
+
+        return analyze_videos
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument(
+        "--address",
+        default=DEFAULT_ADDRESS,
+        help='Unix socket path, or "host:port" (default: %(default)s)',
+    )
+    parser.add_argument(
+        "--authkey-file",
+        default=None,
+        help=f"File holding the secret key. Defaults to ${AUTHKEY_ENV} or"
+        + f" ${AUTHKEY_FILE_ENV}",
+    )
+    parser.add_argument(
+        "--allow-remote",
+        action="store_true",
+        help="Allow listening on a non-loopback host",
+    )
+    parser.add_argument(
+        "--memory-budget",
+        type=float,
+        default=None,
+        help="GB of session-holding models (e.g. onnx) to keep before evicting the"
+        + " least recently used",
+    )
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO)
+    memory_budget = None if args.memory_budget is None else args.memory_budget * 1e9
+    InferenceWorker(
+        args.address,
+        memory_budget=memory_budget,
+        authkey=resolve_authkey(authkey_file=args.authkey_file),
+        allow_remote=args.allow_remote,
+    ).serve_forever()
+
+
+if __name__ == "__main__":
+    main()
@@ -5,23 +5,32 @@ DataJoint Schema for DeepLabCut 2.x, Supports 2D and 3D DLC via triangulation.
 """
 
 import datajoint as dj
-import os
 import csv
+import shutil
+import tempfile
 from ruamel.yaml import YAML
 import inspect
 import importlib
+import re
 import numpy as np
 import pandas as pd
 from pathlib import Path
 from typing import Optional
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
 from datetime import datetime, timezone
-from element_interface.utils import find_full_path, find_root_directory, memoized_result
-from .readers import dlc_reader
+from element_interface.utils import dict_to_uuid, memoized_result
+from .paths import PathResolver
+from .analysis import filters, kinematics, quality, triangulation
+from .inference import engines, segments
+from .inference.checkpoints import VideoCheckpoints
+from .inference.result_cache import ResultCache
+from .readers import dlc_reader, video_probe
 
 schema = dj.schema()
 logger = dj.logger
 
 _linking_module = None
+path_resolver = None  # PathResolver, created by activate()
 
 
 def activate(
@@ -50,6 +59,19 @@ def activate(
                                  with all behavioral recordings, as (list of) string(s).
         get_dlc_processed_data_dir(): Optional. Returns absolute path for processed
                                       data. Defaults to session video subfolder.
+        get_dlc_inference_worker(): Optional. Returns the address (socket path or
+                                    "host:port"), or a dict with "address" and
+                                    "authkey" or "authkey_file", of a running
+                                    `inference.worker`. Inference is then submitted
+                                    to the worker instead of run in-process. The
+                                    key defaults to $DJ_DLC_WORKER_AUTHKEY(_FILE).
+        get_dlc_result_cache_dir(): Optional. Returns absolute path of a directory
+                                    caching inference outputs by video content,
+                                    model and params. Defaults to no cache.
+
+    Root directories are requested once and paths resolved against them are
+    memoized by `path_resolver`. Call `path_resolver.invalidate()` after changing
+    the root directories or moving data.
     """
 
     if isinstance(linking_module, str):
@@ -61,8 +83,9 @@ def activate(
         linking_module, "get_dlc_root_data_dir"
     ), "The linking module must specify a lookup function for a root data directory"
 
-    global _linking_module
+    global _linking_module, path_resolver
     _linking_module = linking_module
+    path_resolver = PathResolver(get_dlc_root_data_dir)
 
     # activate
     schema.activate(
@@ -87,6 +110,7 @@ def get_dlc_root_data_dir() -> list:
     root_directories = _linking_module.get_dlc_root_data_dir()
     if isinstance(root_directories, (str, Path)):
         root_directories = [root_directories]
+    root_directories = list(root_directories)  # never extend the caller's list
 
     if (
         hasattr(_linking_module, "get_dlc_processed_data_dir")
@@ -110,6 +134,33 @@ def get_dlc_processed_data_dir() -> Optional[str]:
         return None
 
 
+def get_dlc_inference_worker() -> Optional[dict]:
+    """Pulls relevant func from parent namespace. Defaults to in-process inference.
+
+    Method in parent namespace should return the address of a running inference
+    worker, as a string or as a dict with "address" and optional "authkey" or
+    "authkey_file".
+    """
+    if not hasattr(_linking_module, "get_dlc_inference_worker"):
+        return None
+    worker = _linking_module.get_dlc_inference_worker()
+    if worker is None or isinstance(worker, dict):
+        return worker
+    return {"address": worker}
+
+
+def get_dlc_result_cache_dir() -> Optional[str]:
+    """Pulls relevant func from parent namespace. Defaults to no inference cache.
+
+    Method in parent namespace should provide a string to a directory where
+    inference outputs are cached, keyed by video content, model and params.
+    """
+    if hasattr(_linking_module, "get_dlc_result_cache_dir"):
+        return _linking_module.get_dlc_result_cache_dir()
+    else:
+        return None
+
+
 # ----------------------------- Table declarations ----------------------
 
 
@@ -176,29 +227,53 @@ class RecordingInfo(dj.Imported):
         """Defines order of keys for make function when called via `populate()`"""
         return VideoRecording & VideoRecording.File
 
-    def make(self, key):
-        """Populates table with video metadata using CV2."""
-        import cv2
+    @staticmethod
+    def probe_cache_path() -> Path:
+        """SQLite file caching video metadata, in the processed (or first root) dir"""
+        cache_dir = get_dlc_processed_data_dir() or path_resolver.root_dirs[0]
+        return Path(cache_dir) / ".dj_video_probe_cache.sqlite"
+
+    @classmethod
+    def probe_videos(cls, *restrictions, n_workers: int = None) -> int:
+        """Probe the videos of all pending recordings into the cache in parallel.
 
-        file_paths = (VideoRecording.File & key).fetch("file_path")
+        A following `populate()` then reads the metadata from the cache.
 
-        nframes = 0
-        px_height, px_width, fps = None, None, None
+        Args:
+            restrictions: Optional. Restrictions on the recordings to probe.
+            n_workers (int): Optional. Maximum number of probing processes.
 
-        for file_path in file_paths:
-            file_path = (find_full_path(get_dlc_root_data_dir(), file_path)).as_posix()
+        Returns:
+            Number of video files probed or found in the cache
+        """
+        pending = VideoRecording.File & cls().key_source
+        for restriction in restrictions:
+            pending &= restriction
+        pending -= cls
+        file_paths = [
+            path_resolver.find_full_path(file_path)
+            for file_path in pending.fetch("file_path")
+        ]
+        video_probe.ProbeCache(cls.probe_cache_path()).probe_many(
+            file_paths, n_workers=n_workers
+        )
+        return len(file_paths)
 
-            cap = cv2.VideoCapture(file_path)
-            info = (
-                int(cap.get(cv2.CAP_PROP_FRAME_HEIGHT)),
-                int(cap.get(cv2.CAP_PROP_FRAME_WIDTH)),
-                int(cap.get(cv2.CAP_PROP_FPS)),
-            )
+    def make(self, key):
+        """Populates table with video metadata using CV2."""
+        file_paths = [
+            path_resolver.find_full_path(file_path)
+            for file_path in (VideoRecording.File & key).fetch("file_path")
+        ]
+        infos = video_probe.probe_many(file_paths, cache_path=self.probe_cache_path())
+
+        px_height, px_width, fps = None, None, None
+        for info in infos:
+            info = (info["px_height"], info["px_width"], int(info["fps"]))
             if px_height is not None:
                 assert (px_height, px_width, fps) == info
             px_height, px_width, fps = info
-            nframes += int(cap.get(cv2.CAP_PROP_FRAME_COUNT))
-            cap.release()
+        nframes = sum(info["nframes"] for info in infos)
 
         self.insert1(
             {
@@ -237,7 +312,7 @@ class BodyPart(dj.Lookup):
             verbose (bool): Default True. Print both existing and new items to console.
         """
         if not isinstance(dlc_config, dict):
-            dlc_config_fp = find_full_path(get_dlc_root_data_dir(), Path(dlc_config))
+            dlc_config_fp = path_resolver.find_full_path(Path(dlc_config))
             assert dlc_config_fp.exists() and dlc_config_fp.suffix in (
                 ".yml",
                 ".yaml",
@@ -249,7 +324,9 @@ class BodyPart(dj.Lookup):
         # -- Check and insert new BodyPart --
         assert "bodyparts" in dlc_config, f"Found no bodyparts section in {dlc_config}"
         tracked_body_parts = cls.fetch("body_part")
-        new_body_parts = np.setdiff1d(dlc_config["bodyparts"], tracked_body_parts)
+        new_body_parts = np.setdiff1d(
+            dlc_reader.config_body_parts(dlc_config), tracked_body_parts
+        )
         if verbose:  # Added to silence duplicate prompt during `insert_new_model`
             print(f"Existing body parts: {tracked_body_parts}")
             print(f"New body parts: {new_body_parts}")
@@ -308,7 +385,7 @@ class Model(dj.Manual):
         snapshotindex (int): Which snapshot for prediction (if -1, latest).
         shuffle (int): Which shuffle of the training dataset.
         trainingsetindex (int): Which training set fraction to generate model.
-        engine (str): Engine used for model. Either 'tensorflow' or 'pytorch'.
+        engine (str): Inference engine of the model, see `inference.engines`.
         scorer ( varchar(64) ): Scorer/network name - DLC's GetScorerName().
         config_template (longblob): Dictionary of the config for analyze_videos().
         project_path ( varchar(255) ): DLC's project_path in config relative to root.
@@ -330,7 +407,7 @@ class Model(dj.Manual):
     snapshotindex        : int          # which snapshot for prediction (if -1, latest)
     shuffle              : int          # Shuffle (1) or not (0)
     trainingsetindex     : int          # Index of training fraction list in config.yaml
-    engine='tensorflow'  : varchar(16)  # Engine used for model. Either 'tensorflow' or 'pytorch'
+    engine='tensorflow'  : varchar(16)  # Inference engine: 'tensorflow', 'pytorch' or 'onnx'
     unique index (task, date, iteration, shuffle, snapshotindex, trainingsetindex, engine)
     scorer               : varchar(64)  # Scorer/network name - DLC's GetScorerName()
     config_template      : longblob     # Dictionary of the config for analyze_videos()
@@ -381,7 +458,7 @@ class Model(dj.Manual):
             params (dict): Optional. If dlc_config is path, dict of override items
         """
         # handle dlc_config being a yaml file
-        dlc_config_fp = find_full_path(get_dlc_root_data_dir(), Path(dlc_config))
+        dlc_config_fp = path_resolver.find_full_path(Path(dlc_config))
         assert dlc_config_fp.exists(), (
             "dlc_config is not a filepath" + f"\n Check: {dlc_config_fp}"
         )
@@ -395,7 +472,7 @@ class Model(dj.Manual):
         # ---- Get and resolve project path ----
         project_path = dlc_config_fp.parent
         dlc_config["project_path"] = project_path.as_posix()  # update if different
-        root_dir = find_root_directory(get_dlc_root_data_dir(), project_path)
+        root_dir = path_resolver.find_root_directory(project_path)
 
         # ---- Verify config ----
         needed_attributes = [
@@ -415,29 +492,10 @@ class Model(dj.Manual):
             )
             engine = "tensorflow"
 
-        if engine == "tensorflow":
-            from deeplabcut.utils.auxiliaryfunctions import GetScorerName  # isort:skip
-
-            # ---- Get scorer name ----
-            # "or 'f'" below covers case where config returns None. str_to_bool handles else
-            scorer_legacy = str_to_bool(dlc_config.get("scorer_legacy", "f"))
-            dlc_scorer = GetScorerName(
-                cfg=dlc_config,
-                shuffle=shuffle,
-                trainFraction=dlc_config["TrainingFraction"][int(trainingsetindex)],
-                modelprefix=model_prefix,
-            )[scorer_legacy]
-        elif engine == "pytorch":
-            from deeplabcut.pose_estimation_pytorch.apis.utils import get_scorer_name
-
-            dlc_scorer = get_scorer_name(
-                cfg=dlc_config,
-                shuffle=shuffle,
-                train_fraction=dlc_config["TrainingFraction"][int(trainingsetindex)],
-                modelprefix=model_prefix,
-            )
-        else:
-            raise ValueError(f"Unknow engine type {engine}")
+        # ---- Get scorer name ----
+        dlc_scorer = engines.get_engine(engine).get_scorer_name(
+            dlc_config, shuffle, trainingsetindex, model_prefix
+        )
 
         if dlc_config["snapshotindex"] == -1:
             dlc_scorer = "".join(dlc_scorer.split("_")[:-1])
@@ -482,7 +540,9 @@ class Model(dj.Manual):
             # Returns array, so check size for unambiguous truth value
             if BodyPart.extract_new_body_parts(dlc_config, verbose=False).size > 0:
                 BodyPart.insert_from_config(dlc_config, prompt=prompt)
-            cls.BodyPart.insert((model_name, bp) for bp in dlc_config["bodyparts"])
+            cls.BodyPart.insert(
+                (model_name, bp) for bp in dlc_reader.config_body_parts(dlc_config)
+            )
 
         # ____ Insert into table ----
         if cls.connection.in_transaction:
@@ -496,6 +556,13 @@ class Model(dj.Manual):
 class ModelEvaluation(dj.Computed):
     """Performance characteristics model calculated by `deeplabcut.evaluate_network`
 
+    All snapshots of the model are evaluated, one at a time unless
+    `ModelEvaluation.n_workers` is raised and the GPU memory fits several
+    evaluations. Each snapshot is evaluated in its own copy of the project's
+    evaluation folder, merged into the project once all are done. The master holds
+    the results of the configured snapshot and the snapshot with the lowest test
+    error.
+
     Attributes:
         Model (foreign key): Model name.
         train_iterations (int): Training iterations.
@@ -503,7 +570,8 @@ class ModelEvaluation(dj.Computed):
         test_error (float): Optional. Test error (px).
         p_cutoff (float): Optional. p-cutoff used.
         train_error_p (float): Optional. Train error with p-cutoff.
-        test_error_p (float): Optional. Test error with p-cutoff."""
+        test_error_p (float): Optional. Test error with p-cutoff.
+        best_snapshotindex (int): Optional. Snapshot with the lowest test error."""
 
     definition = """
     -> Model
@@ -514,64 +582,80 @@ class ModelEvaluation(dj.Computed):
     p_cutoff=null      : float # p-cutoff used
     train_error_p=null : float # Train error with p-cutoff
     test_error_p=null  : float # Test error with p-cutoff
+    best_snapshotindex=null : int  # snapshotindex with the lowest test error
     """
 
-    def make(self, key):
-        from deeplabcut import evaluate_network  # isort:skip
-        from deeplabcut.utils.auxiliaryfunctions import (
-            get_evaluation_folder,
-        )  # isort:skip
+    n_workers = 1  # snapshots evaluated concurrently
 
-        """.populate() method will launch evaluation for each unique entry in Model."""
-        dlc_config, project_path, model_prefix, shuffle, trainingsetindex = (
-            Model & key
-        ).fetch1(
-            "config_template",
-            "project_path",
-            "model_prefix",
-            "shuffle",
-            "trainingsetindex",
-        )
+    class Snapshot(dj.Part):
+        """Performance of one snapshot of the model
 
-        project_path = find_full_path(get_dlc_root_data_dir(), project_path)
-        yml_path, _ = dlc_reader.read_yaml(project_path)
+        Attributes:
+            ModelEvaluation (foreign key): Model name.
+            snapshotindex (int): Index of the snapshot, by training iterations.
+            train_iterations (int): Training iterations.
+            train_error (float): Optional. Train error (px).
+            test_error (float): Optional. Test error (px).
+            p_cutoff (float): Optional. p-cutoff used.
+            train_error_p (float): Optional. Train error with p-cutoff.
+            test_error_p (float): Optional. Test error with p-cutoff."""
 
-        evaluate_network(
-            yml_path,
-            Shuffles=[shuffle],  # this needs to be a list
-            trainingsetindex=trainingsetindex,
-            comparisonbodyparts="all",
-        )
+        definition = """
+        -> master
+        snapshotindex      : int   # index of the snapshot, by training iterations
+        ---
+        train_iterations   : int   # Training iterations
+        train_error=null   : float # Train error (px)
+        test_error=null    : float # Test error (px)
+        p_cutoff=null      : float # p-cutoff used
+        train_error_p=null : float # Train error with p-cutoff
+        test_error_p=null  : float # Test error with p-cutoff
+        """
+
+    def make(self, key):
+        """.populate() method will launch evaluation for each unique entry in Model."""
+        dlc_model_ = (Model & key).fetch1()
+        project_path = path_resolver.find_full_path(dlc_model_["project_path"])
+        snapshots = _list_snapshots(dlc_model_, project_path)
+        if not snapshots:
+            raise FileNotFoundError(f"No snapshot found for model {key}")
+
+        with tempfile.TemporaryDirectory(
+            prefix=".dj_dlc_eval_", dir=project_path
+        ) as tmp_dir, ProcessPoolExecutor(
+            max_workers=min(self.n_workers, len(snapshots))
+        ) as executor:
+            futures = [
+                executor.submit(
+                    _evaluate_snapshot,
+                    dlc_model_,
+                    project_path,
+                    snapshotindex,
+                    train_iterations,
+                    tmp_dir,
+                )
+                for snapshotindex, train_iterations in enumerate(snapshots)
+            ]
+            snapshot_entries = [
+                {**key, "snapshotindex": snapshotindex, **future.result()}
+                for snapshotindex, future in enumerate(futures)
+            ]
+            for snapshotindex in range(len(snapshots)):
+                _merge_evaluation_results(
+                    Path(tmp_dir) / f"snapshot{snapshotindex}", project_path
+                )
+
+        configured = snapshot_entries[dlc_model_["snapshotindex"]]  # -1 is the last
+        evaluated = [e for e in snapshot_entries if e["test_error"] is not None]
+        best = min(evaluated, key=lambda e: e["test_error"]) if evaluated else None
 
-        eval_folder = get_evaluation_folder(
-            trainFraction=dlc_config["TrainingFraction"][trainingsetindex],
-            shuffle=shuffle,
-            cfg=dlc_config,
-            modelprefix=model_prefix,
-        )
-        eval_path = project_path / eval_folder
-        assert eval_path.exists(), f"Couldn't find evaluation folder:\n{eval_path}"
-
-        eval_csvs = list(eval_path.glob("*csv"))
-        max_modified_time = 0
-        for eval_csv in eval_csvs:
-            modified_time = os.path.getmtime(eval_csv)
-            if modified_time > max_modified_time:
-                eval_csv_latest = eval_csv
-        with open(eval_csv_latest, newline="") as f:
-            results = list(csv.DictReader(f, delimiter=","))[0]
-        # in testing, test_error_p returned empty string
         self.insert1(
-            dict(
-                key,
-                train_iterations=results["Training iterations:"],
-                train_error=results[" Train error(px)"],
-                test_error=results[" Test error(px)"],
-                p_cutoff=results["p-cutoff used"],
-                train_error_p=results["Train error with p-cutoff"],
-                test_error_p=results["Test error with p-cutoff"],
-            )
+            {
+                **{k: v for k, v in configured.items() if k != "snapshotindex"},
+                "best_snapshotindex": best["snapshotindex"] if best else None,
+            }
         )
+        self.Snapshot.insert(snapshot_entries)
 
 
 @schema
@@ -585,7 +669,12 @@ class PoseEstimationTask(dj.Manual):
         pose_estimation_output_dir ( varchar(255) ): Optional. Output dir relative to
                                                      get_dlc_root_data_dir.
         pose_estimation_params (longblob): Optional. Params for DLC's analyze_videos
-                                           params, if not default."""
+                                           params, if not default. Set
+                                           "storage_layout" to "compact" to store
+                                           results in PoseEstimation's packed tables.
+                                           Set "parallel_inference" to {"n_segments",
+                                           "n_workers"} to split each video into
+                                           frame ranges analyzed in parallel."""
 
     definition = """
     -> VideoRecording                           # Session -> Recording + File part table
@@ -608,11 +697,10 @@ class PoseEstimationTask(dj.Manual):
             relative (bool): Report directory relative to get_dlc_processed_data_dir().
             mkdir (bool): Default False. Make directory if it doesn't exist.
         """
-        video_filepath = find_full_path(
-            get_dlc_root_data_dir(),
+        video_filepath = path_resolver.find_full_path(
             (VideoRecording.File & key).fetch("file_path", limit=1)[0],
         )
-        root_dir = find_root_directory(get_dlc_root_data_dir(), video_filepath.parent)
+        root_dir = path_resolver.find_root_directory(video_filepath.parent)
         recording_key = VideoRecording & key
         device = "-".join(
             str(v)
@@ -633,6 +721,7 @@ class PoseEstimationTask(dj.Manual):
         )
         if mkdir:
             output_dir.mkdir(parents=True, exist_ok=True)
+            path_resolver.invalidate(output_dir.relative_to(processed_dir))
         return output_dir.relative_to(processed_dir) if relative else output_dir
 
     @classmethod
@@ -665,7 +754,7 @@ class PoseEstimationTask(dj.Manual):
         )
 
         if task_mode is None:
-            try:
+            try:  # construction only discovers files, metadata is parsed lazily
                 _ = dlc_reader.PoseEstimation(output_dir)
             except FileNotFoundError:
                 task_mode = "trigger"
@@ -725,13 +814,235 @@ class PoseEstimation(dj.Computed):
         likelihood  : longblob
         """
 
+    class PackedPosition(dj.Part):
+        """Frame range shared by all body parts in the compact storage layout
+
+        Attributes:
+            PoseEstimation (foreign key): Pose Estimation key.
+            frame_start (int unsigned): Frame index of the first stored frame.
+            nframes (int unsigned): Number of consecutive frames stored.
+            coords ( varchar(64) ): Comma-separated coordinates of packed arrays."""
+
+        definition = """ # frame range of the compact layout, in place of frame_index
+        -> master
+        ---
+        frame_start=0 : int unsigned  # frame index is frame_start + arange(nframes)
+        nframes       : int unsigned
+        coords        : varchar(64)   # e.g. 'x,y,likelihood' - columns of packed arrays
+        """
+
+    class PackedBodyPartPosition(dj.Part):
+        """Position of individual body parts as one packed float32 array
+
+        Attributes:
+            PoseEstimation (foreign key): Pose Estimation key.
+            Model.BodyPart (foreign key): Body Part key.
+            position (longblob): float32 array of shape (nframes, coords)."""
+
+        definition = """ # compact layout alternative to BodyPartPosition
+        -> master
+        -> Model.BodyPart
+        ---
+        position    : longblob     # float32 (nframes, coords), see PackedPosition
+        """
+
+    class IndividualPosition(dj.Part):
+        """Position of the body parts of one individual of multi-animal outputs
+
+        Attributes:
+            PoseEstimation (foreign key): Pose Estimation key.
+            individual ( varchar(32) ): Individual, e.g. "mouse1" or "single" for
+                unique body parts.
+            Model.BodyPart (foreign key): Body Part key.
+            position (longblob): float32 array of shape (nframes, coords)."""
+
+        definition = """ # multi-animal layout, with the frame range of PackedPosition
+        -> master
+        individual  : varchar(32)
+        -> Model.BodyPart
+        ---
+        position    : longblob     # float32 (nframes, coords), see PackedPosition
+        """
+
     def make(self, key):
         """.populate() method will launch training for each PoseEstimationTask"""
         # ID model and directories
         dlc_model_ = (Model & key).fetch1()
-        task_mode, output_dir = (PoseEstimationTask & key).fetch1(
-            "task_mode", "pose_estimation_output_dir"
+        task_mode, pose_estimation_params = (PoseEstimationTask & key).fetch1(
+            "task_mode", "pose_estimation_params"
+        )
+        pose_estimation_params = pose_estimation_params or {}
+        output_dir = self._get_output_dir(key, task_mode)
+
+        # Trigger PoseEstimation
+        if task_mode == "trigger":
+            # Triggering dlc for pose estimation required:
+            # - project_path: full path to the directory containing the trained model
+            # - video_filepaths: full paths to the video files for inference
+            # - analyze_video_params: optional parameters to analyze video
+            _TaskInference(key, dlc_model_, output_dir, pose_estimation_params).run()
+
+        self._insert_results(key, output_dir, pose_estimation_params)
+
+    @classmethod
+    def populate_batched(
+        cls, *restrictions, analyze_videos=None, suppress_errors: bool = False
+    ) -> list:
+        """Run inference once per Model for all pending 'trigger' tasks, then ingest.
+
+        Pending PoseEstimationTask entries are grouped by Model and analyze_videos
+        parameters. Each group is analyzed with a single `analyze_videos` call, so
+        the network is loaded once per group instead of once per recording. Outputs
+        are moved from a staging folder into the output dir of each task, and then
+        validated, checkpointed, cached and inserted as in `make`. A failed task
+        does not stop the other tasks.
+
+        Args:
+            restrictions: Optional. Restrictions on PoseEstimationTask.
+            analyze_videos (callable): Optional. Replacement for DLC's analyze_videos,
+                with the same signature (e.g. a stub engine for testing). Defaults
+                to the inference worker if configured, else the model's engine.
+            suppress_errors (bool): Optional. Only log failed tasks. By default, a
+                RuntimeError is raised once all tasks were processed.
+
+        Returns:
+            List of the PoseEstimation keys inserted
+        """
+        pending = (PoseEstimationTask & {"task_mode": "trigger"}).proj() - cls
+        for restriction in restrictions:
+            pending &= restriction
+
+        groups = {}  # {(model_name, params hash): [(key, pose_estimation_params)]}
+        for key in pending.fetch("KEY"):
+            params = (PoseEstimationTask & key).fetch1("pose_estimation_params") or {}
+            group_id = (
+                key["model_name"],
+                dict_to_uuid(_get_analyze_video_params(params)),
+            )
+            groups.setdefault(group_id, []).append((key, params))
+
+        inserted, failures = [], []  # failures: [(key, error)]
+        for (model_name, _), tasks in groups.items():
+            dlc_model_ = (Model & {"model_name": model_name}).fetch1()
+            try:
+                task_inferences = [
+                    _TaskInference(
+                        key, dlc_model_, cls._get_output_dir(key, "trigger"), params
+                    )
+                    for key, params in tasks
+                ]
+                cls._analyze_batched(task_inferences, analyze_videos, failures)
+            except Exception as e:
+                logger.exception(f"Batched inference failed for model {model_name}")
+                failures.extend((key, e) for key, _ in tasks)
+                continue
+
+            # as in make: the checkpointed videos are skipped, the others analyzed
+            failed_keys = [key for key, _ in failures]
+            for task_inference in task_inferences:
+                key = task_inference.key
+                if key in failed_keys:
+                    continue
+                try:
+                    task_inference.run(analyze_videos)
+                    with cls.connection.transaction:
+                        cls()._insert_results(
+                            key,
+                            task_inference.output_dir,
+                            task_inference.pose_estimation_params,
+                            allow_direct_insert=True,
+                        )
+                except Exception as e:
+                    logger.exception(f"Pose estimation failed for {key}")
+                    failures.append((key, e))
+                else:
+                    inserted.append(key)
+
+        if failures and not suppress_errors:
+            raise RuntimeError(
+                f"{len(failures)} pose estimation task(s) failed, the first for"
+                + f" {failures[0][0]}: {failures[0][1]!r}"
+            ) from failures[0][1]
+        return inserted
+
+    @staticmethod
+    def _analyze_batched(task_inferences: list, analyze_videos, failures: list):
+        """Analyze the pending videos of tasks of one model with few calls.
+
+        Videos are analyzed into a staging folder and their outputs moved to the
+        output dir of their task, then validated, checkpointed and cached as in
+        `make`. Tasks with segment-parallel inference are left to
+        `_TaskInference.run`. Failed tasks are appended to failures.
+        """
+        first = task_inferences[0]
+        owners = {}  # {video path: _TaskInference}
+        for task_inference in task_inferences:
+            if task_inference.parallel_inference.get("n_segments", 1) > 1:
+                continue
+            try:
+                for video in task_inference.pending_videos():
+                    owners[Path(video)] = task_inference
+            except Exception as e:
+                logger.exception(f"Pose estimation failed for {task_inference.key}")
+                failures.append((task_inference.key, e))
+        if not owners:
+            return
+
+        config_filepath = _save_dlc_config(
+            first.dlc_model,
+            first.project_path,
+            {owner.output_dir for owner in owners.values()},
+            first.analyze_video_params,
         )
+        analyze_videos = analyze_videos or _get_analyze_videos_for(
+            first.dlc_model, first.project_path
+        )
+
+        # DLC names outputs by video stem: same-stem videos go in separate calls
+        batches = []
+        for video in owners:
+            batch = next(
+                (b for b in batches if video.stem not in {v.stem for v in b}), None
+            )
+            if batch is None:
+                batches.append([video])
+            else:
+                batch.append(video)
+
+        staging_root = get_dlc_processed_data_dir() or first.output_dir.parent
+        for batch in batches:
+            batch_tasks = {id(owners[video]): owners[video] for video in batch}
+            try:
+                with tempfile.TemporaryDirectory(
+                    prefix=".dj_dlc_batch_", dir=staging_root
+                ) as staging_dir:
+                    _run_analyze_videos(
+                        analyze_videos,
+                        config_filepath,
+                        first.dlc_model,
+                        [video.as_posix() for video in batch],
+                        staging_dir,
+                        first.analyze_video_params,
+                    )
+                    for fp in Path(staging_dir).iterdir():
+                        video = _output_owner(fp.name, batch)
+                        if video is not None:
+                            shutil.move(fp, owners[video].output_dir / fp.name)
+            except Exception as e:
+                logger.exception("Batched analyze_videos failed")
+                failures.extend((task.key, e) for task in batch_tasks.values())
+                continue
+            for video in batch:
+                try:
+                    owners[video].complete(video.as_posix())
+                except Exception as e:
+                    logger.exception(f"Invalid DLC output for {video}")
+                    failures.append((owners[video].key, e))
+
+    @classmethod
+    def _get_output_dir(cls, key: dict, task_mode: str) -> Path:
+        """Full path of the task's output dir, inferred and created if needed"""
+        output_dir = (PoseEstimationTask & key).fetch1("pose_estimation_output_dir")
         if not output_dir:
             output_dir = PoseEstimationTask.infer_output_dir(
                 key, relative=True, mkdir=True
@@ -742,128 +1053,91 @@ class PoseEstimation(dj.Computed):
             )
 
         try:
-            output_dir = find_full_path(get_dlc_root_data_dir(), output_dir)
+            output_dir = path_resolver.find_full_path(output_dir)
         except FileNotFoundError as e:
             if task_mode == "trigger":
                 processed_dir = Path(get_dlc_processed_data_dir())
+                path_resolver.invalidate(output_dir)
                 output_dir = processed_dir / output_dir
                 output_dir.mkdir(parents=True, exist_ok=True)
             else:
                 raise e
+        return output_dir
+
+    def _insert_results(
+        self,
+        key: dict,
+        output_dir: Path,
+        pose_estimation_params: dict,
+        allow_direct_insert: bool = False,
+    ):
+        """Load DLC outputs from output_dir and insert them for key"""
+        compact = pose_estimation_params.get("storage_layout", "default") == "compact"
+        # the default layout stores float64 positions, the packed layouts float32
+        dlc_result = dlc_reader.PoseEstimation(
+            output_dir, dtype=np.float32 if compact else np.float64
+        )
+        creation_time = datetime.fromtimestamp(dlc_result.creation_time).strftime(
+            "%Y-%m-%d %H:%M:%S"
+        )
 
-        # Trigger PoseEstimation
-        if task_mode == "trigger":
-            # Triggering dlc for pose estimation required:
-            # - project_path: full path to the directory containing the trained model
-            # - video_filepaths: full paths to the video files for inference
-            # - analyze_video_params: optional parameters to analyze video
-            project_path = find_full_path(
-                get_dlc_root_data_dir(), dlc_model_["project_path"]
-            )
-            video_relpaths = list((VideoRecording.File & key).fetch("file_path"))
-            video_filepaths = [
-                find_full_path(get_dlc_root_data_dir(), fp).as_posix()
-                for fp in video_relpaths
-            ]
-            pose_estimation_params = (PoseEstimationTask & key).fetch1(
-                "pose_estimation_params"
-            ) or {}
-
-            # expect a nested dictionary with "analyze_videos" params
-            # if not, assume "pose_estimation_params" as a flat dictionary that include relevant "analyze_videos" params
-            analyze_video_params = (
-                pose_estimation_params.get("analyze_videos") or pose_estimation_params
-            )
+        self.insert1(
+            {**key, "pose_estimation_time": creation_time},
+            allow_direct_insert=allow_direct_insert,
+        )
 
-            @memoized_result(
-                uniqueness_dict={
-                    **analyze_video_params,
-                    "project_path": dlc_model_["project_path"],
-                    "shuffle": dlc_model_["shuffle"],
-                    "trainingsetindex": dlc_model_["trainingsetindex"],
-                    "video_filepaths": video_relpaths,
-                },
-                output_directory=output_dir,
+        # multi-animal: packed arrays of each body part of each individual
+        if dlc_result.individuals:
+            self.PackedPosition.insert1(
+                {
+                    **key,
+                    "nframes": dlc_result.nframes,
+                    "coords": ",".join(dlc_result.coords),
+                }
             )
-            def do_analyze_videos():
-                engine = dlc_model_.get("engine")
-                if engine is None:
-                    logger.warning(
-                        "DLC engine not specified in config file. Defaulting to TensorFlow."
-                    )
-                    engine = "tensorflow"
-                if engine == "pytorch":
-                    from deeplabcut.pose_estimation_pytorch import analyze_videos
-                elif engine == "tensorflow":
-                    from deeplabcut.pose_estimation_tensorflow import analyze_videos
-                else:
-                    raise ValueError(f"Unknow engine type {engine}")
-
-                # ---- Build and save DLC configuration (yaml) file ----
-                dlc_config = dlc_model_["config_template"]
-                dlc_project_path = Path(project_path)
-                dlc_config["project_path"] = dlc_project_path.as_posix()
-
-                # ---- Special handling for "cropping" ----
-                # `analyze_videos` behavior:
-                #   i) if is None, use the "cropping" from the config file
-                #   ii) if defined, use the specified "cropping" values but not updating the config file
-                # new behavior: if defined as "False", overwrite "cropping" to False in config file
-                cropping = analyze_video_params.get("cropping", None)
-                if cropping is not None:
-                    if cropping:
-                        dlc_config["cropping"] = True
-                        (
-                            dlc_config["x1"],
-                            dlc_config["x2"],
-                            dlc_config["y1"],
-                            dlc_config["y2"],
-                        ) = cropping
-                    else:  # cropping is False
-                        dlc_config["cropping"] = False
-
-                # ---- Write config files ----
-                config_filename = f"dj_dlc_config_{datetime.now(tz=timezone.utc).strftime('%Y%m%d_%H%M%S')}.yaml"
-                # To output dir: Important for loading/parsing output in datajoint
-                _ = dlc_reader.save_yaml(output_dir, dlc_config)
-                # To project dir: Required by DLC to run the analyze_videos
-                if dlc_project_path != output_dir:
-                    config_filepath = dlc_reader.save_yaml(
-                        dlc_project_path,
-                        dlc_config,
-                        filename=config_filename,
-                    )
-
-                # ---- Take valid parameters for analyze_videos ----
-                kwargs = {
-                    k: v
-                    for k, v in analyze_video_params.items()
-                    if k in inspect.signature(analyze_videos).parameters
+            body_part_index = dlc_result.body_part_index
+            self.IndividualPosition.insert(
+                {
+                    **key,
+                    "individual": individual,
+                    "body_part": body_part,
+                    "position": dlc_result.array[
+                        :, i_idx, body_part_index[body_part], :
+                    ].astype(np.float32),
                 }
-
-                # ---- Trigger DLC prediction job ----
-                analyze_videos(
-                    config=config_filepath,
-                    videos=video_filepaths,
-                    shuffle=dlc_model_["shuffle"],
-                    trainingsetindex=dlc_model_["trainingsetindex"],
-                    destfolder=output_dir,
-                    modelprefix=dlc_model_["model_prefix"],
-                    **kwargs,
+                for i_idx, (individual, body_parts) in enumerate(
+                    dlc_result.individual_body_parts.items()
                 )
+                for body_part in body_parts
+            )
+            return
 
-            do_analyze_videos()
-
-        dlc_result = dlc_reader.PoseEstimation(output_dir)
-        creation_time = datetime.fromtimestamp(dlc_result.creation_time).strftime(
-            "%Y-%m-%d %H:%M:%S"
-        )
+        # opt-in: one shared frame range and one packed float32 array per body part
+        if compact:
+            self.PackedPosition.insert1(
+                {
+                    **key,
+                    "nframes": dlc_result.nframes,
+                    "coords": ",".join(dlc_result.coords),
+                }
+            )
+            self.PackedBodyPartPosition.insert(
+                {
+                    **key,
+                    "body_part": body_part,
+                    "position": dlc_result.array[:, bp_idx, :].astype(np.float32),
+                }
+                for body_part, bp_idx in dlc_result.body_part_index.items()
+            )
+            return
 
+        # views into the reader's single (frames, body parts, coords) buffer
+        frame_index = np.arange(dlc_result.nframes)
         body_parts = [
             {
                 **key,
                 "body_part": k,
-                "frame_index": np.arange(dlc_result.nframes),
+                "frame_index": frame_index,
                 "x_pos": v["x"],
                 "y_pos": v["y"],
                 "z_pos": v.get("z"),
@@ -871,51 +1145,268 @@ class PoseEstimation(dj.Computed):
             }
             for k, v in dlc_result.data.items()
         ]
-
-        self.insert1({**key, "pose_estimation_time": creation_time})
         self.BodyPartPosition.insert(body_parts)
 
     @classmethod
-    def get_trajectory(cls, key: dict, body_parts: list = "all") -> pd.DataFrame:
+    def get_trajectory(
+        cls,
+        key: dict,
+        body_parts: list = "all",
+        format: str = "pandas",
+        individual: str = None,
+    ) -> pd.DataFrame:
         """Returns a pandas dataframe of coordinates of the specified body_part(s)
 
         Args:
             key (dict): A DataJoint query specifying one PoseEstimation entry.
             body_parts (list, optional): Body parts as a list. If "all", all joints
+            format (str, optional): "pandas" (default) or "numpy". If "numpy", return
+                an array of shape (frames, body parts, 4) with x, y, z and likelihood
+                along the last axis, body parts ordered as given (sorted if "all").
+            individual (str, optional): Individual of a multi-animal entry. Only the
+                data of this individual is fetched.
 
         Returns:
             df: multi index pandas dataframe with DLC scorer names, body_parts
                 and x/y coordinates of each joint name for a camera_id, similar to
                  output of DLC dataframe. If 2D, z is set of zeros
         """
-        model_name = key["model_name"]
+        if format not in ("pandas", "numpy"):
+            raise ValueError(f"Unknown format: {format}. Use 'pandas' or 'numpy'")
 
-        if body_parts == "all":
-            body_parts = (cls.BodyPartPosition & key).fetch("body_part")
-        elif not isinstance(body_parts, list):
+        body_parts, positions = cls._fetch_positions(key, body_parts, individual)
+        if format == "numpy":
+            return positions
+
+        pdindex = pd.MultiIndex.from_product(
+            [[key["model_name"]], body_parts, ["x", "y", "z", "likelihood"]],
+            names=["scorer", "bodyparts", "coords"],
+        )
+        return pd.DataFrame(
+            positions.reshape(len(positions), -1),
+            columns=pdindex,
+            index=range(0, len(positions)),
+        )
+
+    @classmethod
+    def _fetch_individuals(cls, key: dict) -> list:
+        """Individuals of a multi-animal entry, [None] for a single-animal entry"""
+        return sorted(set((cls.IndividualPosition & key).fetch("individual"))) or [None]
+
+    @classmethod
+    def _fetch_positions(
+        cls, key: dict, body_parts: list = "all", individual: str = None
+    ) -> tuple:
+        """Fetch body parts of one PoseEstimation entry in a single query.
+
+        Reads any storage layout. Multi-animal entries require an individual.
+
+        Returns:
+            Tuple of (a) list of body parts and (b) array of shape
+                (frames, body parts, 4) with x, y, z (zeros if 2D) and likelihood
+        """
+        packed = cls.PackedPosition & key
+        if individual is not None:
+            query = cls.IndividualPosition & key & {"individual": individual}
+        elif cls.IndividualPosition & key:
+            individuals = sorted(
+                set((cls.IndividualPosition & key).fetch("individual"))
+            )
+            raise ValueError(f"Multi-animal entry: specify one of {individuals}")
+        else:
+            query = (
+                cls.PackedBodyPartPosition if packed else cls.BodyPartPosition
+            ) & key
+        if body_parts != "all":
+            body_parts = [body_parts] if isinstance(body_parts, str) else body_parts
             body_parts = list(body_parts)
+            query &= [{"body_part": body_part} for body_part in body_parts]
+
+        if packed:
+            coords = packed.fetch1("coords").split(",")
+            fetched_parts, packed_positions = query.fetch(
+                "body_part", "position", order_by="body_part"
+            )
+            arrays = [
+                [
+                    position[:, coords.index(c)] if c in coords else None
+                    for c in ("x", "y", "z", "likelihood")
+                ]
+                for position in packed_positions
+            ]
+        else:
+            fetched_parts, *columns = query.fetch(
+                "body_part",
+                "x_pos",
+                "y_pos",
+                "z_pos",
+                "likelihood",
+                order_by="body_part",
+            )
+            arrays = list(zip(*columns))
+
+        fetched_parts = list(fetched_parts)
+        if len(set(fetched_parts)) != len(fetched_parts):
+            raise ValueError("key must specify exactly one PoseEstimation entry")
+        if body_parts == "all":
+            body_parts = fetched_parts
+        missing = set(body_parts) - set(fetched_parts)
+        if missing:
+            raise ValueError(f"Body part(s) not found for this key: {sorted(missing)}")
+
+        nframes = len(arrays[0][0]) if arrays else 0
+        dtype = np.result_type(*(a[0] for a in arrays)) if arrays else np.float64
+        positions = np.zeros((nframes, len(body_parts), 4), dtype=dtype)
+        arrays = dict(zip(fetched_parts, arrays))
+        for bp_idx, body_part in enumerate(body_parts):
+            for c_idx, values in enumerate(arrays[body_part]):
+                if values is not None:
+                    positions[:, bp_idx, c_idx] = values
+        return body_parts, positions
+
+    @classmethod
+    def fetch_trajectories(
+        cls,
+        query,
+        body_parts: list = "all",
+        n_workers: int = 4,
+        format: str = "pandas",
+        batch_size: int = 500,
+    ):
+        """Fetch the trajectories of many PoseEstimation entries at once.
+
+        The keys of the positions are read first, without blobs. Positions are then
+        fetched in batches of keys, one query per batch, and the blobs of a batch
+        are decoded in a thread pool into the output arrays before the next batch
+        is fetched.
+        Multi-animal entries are not included, see `get_trajectory`.
+
+        Args:
+            query (dict, list or QueryExpression): Restriction on PoseEstimation.
+            body_parts (list, optional): Body parts as a list. If "all", the sorted
+                union of body parts across entries. Missing body parts are NaN.
+            n_workers (int, optional): Number of threads decoding blobs.
+            format (str, optional): "pandas" (default) or "numpy".
+            batch_size (int, optional): Number of body part positions fetched from
+                the server per query.
 
-        df = None
-        for body_part in body_parts:
-            x_pos, y_pos, z_pos, likelihood = (
-                cls.BodyPartPosition & {"body_part": body_part}
-            ).fetch1("x_pos", "y_pos", "z_pos", "likelihood")
-            if not z_pos:
-                z_pos = np.zeros_like(x_pos)
-
-            a = np.vstack((x_pos, y_pos, z_pos, likelihood))
-            a = a.T
-            pdindex = pd.MultiIndex.from_product(
-                [[model_name], [body_part], ["x", "y", "z", "likelihood"]],
-                names=["scorer", "bodyparts", "coords"],
+        Returns:
+            If "pandas", a long-format dataframe indexed by the PoseEstimation primary
+                key and frame_index, with (bodyparts, coords) columns. If "numpy", a
+                dict of {primary key tuple: array of shape (frames, body parts, 4)}.
+                Coordinates are x, y, z (zeros if 2D) and likelihood.
+        """
+        from datajoint.blob import unpack
+
+        if format not in ("pandas", "numpy"):
+            raise ValueError(f"Unknown format: {format}. Use 'pandas' or 'numpy'")
+
+        entries = (cls & query).proj()
+        primary_key = cls.primary_key
+        packed_coords = {
+            tuple(row[:-1]): row[-1].split(",")
+            for row in zip(
+                *(cls.PackedPosition & entries).fetch(*primary_key, "coords")
+            )
+        }
+
+        layouts = []
+        for part, blob_fields in (
+            (cls.BodyPartPosition, ["x_pos", "y_pos", "z_pos", "likelihood"]),
+            (cls.PackedBodyPartPosition, ["position"]),
+        ):
+            part_query = part & entries
+            if body_parts != "all":
+                part_query &= [{"body_part": body_part} for body_part in body_parts]
+            layouts.append((part_query, blob_fields, part_query.fetch("KEY")))
+        if body_parts == "all":
+            body_parts = sorted(
+                {key["body_part"] for _, _, part_keys in layouts for key in part_keys}
+            )
+        bp_index = {body_part: bp_idx for bp_idx, body_part in enumerate(body_parts)}
+
+        # a query per batch of keys, as the client receives the whole result set
+        # of a query at once
+        trajectories = {}  # {primary key tuple: array (frames, body parts, 4)}
+        with ThreadPoolExecutor(max_workers=n_workers) as executor:
+            for part_query, blob_fields, part_keys in layouts:
+                for batch_start in range(0, len(part_keys), batch_size):
+                    batch_query = (
+                        part_query & part_keys[batch_start : batch_start + batch_size]
+                    )
+                    rows = cls.connection.query(
+                        batch_query.make_sql(primary_key + ["body_part"] + blob_fields)
+                    ).fetchall()
+                    decoded = [
+                        (
+                            tuple(row[: len(primary_key)]),
+                            row[len(primary_key)],
+                            [
+                                executor.submit(unpack, blob)
+                                for blob in row[-len(blob_fields) :]
+                            ],
+                        )
+                        for row in rows
+                    ]
+                    for entry_key, body_part, futures in decoded:
+                        blobs = [future.result() for future in futures]
+                        if len(blob_fields) == 1:  # packed layout
+                            coords = packed_coords[entry_key]
+                            blobs = [
+                                blobs[0][:, coords.index(c)] if c in coords else None
+                                for c in ("x", "y", "z", "likelihood")
+                            ]
+                        x_pos, y_pos, z_pos, likelihood = blobs
+                        if entry_key not in trajectories:
+                            trajectories[entry_key] = np.full(
+                                (len(x_pos), len(body_parts), 4), np.nan
+                            )
+                        array = trajectories[entry_key]
+                        bp_idx = bp_index[body_part]
+                        array[:, bp_idx, 0] = x_pos
+                        array[:, bp_idx, 1] = y_pos
+                        array[:, bp_idx, 2] = 0 if z_pos is None else z_pos
+                        array[:, bp_idx, 3] = likelihood
+
+        if format == "numpy":
+            return trajectories
+
+        columns = pd.MultiIndex.from_product(
+            [body_parts, ["x", "y", "z", "likelihood"]], names=["bodyparts", "coords"]
+        )
+        if not trajectories:
+            return pd.DataFrame(
+                columns=columns,
+                index=pd.MultiIndex.from_arrays(
+                    [[]] * (len(primary_key) + 1), names=primary_key + ["frame_index"]
+                ),
             )
-            frame = pd.DataFrame(a, columns=pdindex, index=range(0, a.shape[0]))
-            df = pd.concat([df, frame], axis=1)
-        return df
+        nframes = [len(array) for array in trajectories.values()]
+        index = pd.MultiIndex.from_arrays(
+            [
+                np.repeat(np.array(values, dtype=object), nframes)
+                for values in zip(*trajectories)
+            ]
+            + [np.concatenate([np.arange(n) for n in nframes])],
+            names=primary_key + ["frame_index"],
+        )
+        data = np.concatenate(
+            [array.reshape(len(array), -1) for array in trajectories.values()]
+        )
+        return pd.DataFrame(data, columns=columns, index=index)
 
 
 @schema
 class LabeledVideo(dj.Computed):
+    """Labeled videos of a PoseEstimation, one per video file.
+
+    Rendered from the stored poses by `plotting.labeled_video`, with
+    "outputframerate", "pcutoff", "dotsize", "colormap", "draw_skeleton",
+    "n_workers", "n_segments" and "encoder" ({"codec", "crf", "preset",
+    "threads"} of ffmpeg) from the "create_labeled_video" params of the
+    PoseEstimationTask. Set "renderer" to "deeplabcut" to use
+    `deeplabcut.create_labeled_video` instead."""
+
     definition = """
     -> PoseEstimation
     """
@@ -933,15 +1424,13 @@ class LabeledVideo(dj.Computed):
         return PoseEstimation & RecordingInfo
 
     def make(self, key):
-        import deeplabcut
-
         pose_estimation_params = (PoseEstimationTask & key).fetch1(
             "pose_estimation_params"
         ) or {}
 
         # expect a nested dictionary with "create_labeled_video" and "extract_outlier_frames" params
         # if not, assume "pose_estimation_params" as a flat dictionary
-        create_labeled_video_params = (
+        create_labeled_video_params = dict(
             pose_estimation_params.get("create_labeled_video") or pose_estimation_params
         )
 
@@ -949,34 +1438,151 @@ class LabeledVideo(dj.Computed):
             "outputframerate", 5
         )  # final labeled video FPS defaults to 5 Hz
 
-        dlc_model_ = (Model & key).fetch1()
-        fps, nframes = (RecordingInfo & key).fetch1("fps", "nframes")
         output_dir = (PoseEstimationTask & key).fetch1("pose_estimation_output_dir")
-        output_dir = find_full_path(get_dlc_root_data_dir(), output_dir)
+        output_dir = path_resolver.find_full_path(output_dir)
+
+        # "renderer": "deeplabcut" uses deeplabcut.create_labeled_video instead
+        if create_labeled_video_params.pop("renderer", None) == "deeplabcut":
+            labeled_video_paths = self._create_labeled_videos_dlc(
+                key, output_dir, create_labeled_video_params, outputframerate
+            )
+        else:
+            labeled_video_paths = self._render_labeled_videos(
+                key, output_dir, create_labeled_video_params, outputframerate
+            )
+
+        self.insert1(key)
+        self.File.insert(
+            {
+                **key,
+                **vkey,
+                "labeled_video_path": labeled_video_path.relative_to(
+                    get_dlc_processed_data_dir()
+                ).as_posix(),
+            }
+            for vkey, labeled_video_path in labeled_video_paths
+        )
+
+    @staticmethod
+    def _render_labeled_videos(
+        key: dict, output_dir: Path, params: dict, outputframerate: float
+    ) -> list:
+        """Render labeled videos from the stored poses, see `plotting.labeled_video`
+
+        Returns:
+            List of (VideoRecording.File key, labeled video path)
+        """
+        from .plotting import labeled_video
+
+        dlc_model_ = (Model & key).fetch1()
+        dlc_config = dlc_model_["config_template"]
+        fps = (RecordingInfo & key).fetch1("fps")
+        # the body parts of all individuals of multi-animal entries are drawn
+        individual_positions = [
+            PoseEstimation._fetch_positions(key, individual=individual)
+            for individual in PoseEstimation._fetch_individuals(key)
+        ]
+        positions = np.concatenate([p for _, p in individual_positions], axis=1)
+        skeleton = dlc_config.get("skeleton") if params.get("draw_skeleton") else []
+        colormap = params.get("colormap", dlc_config.get("colormap", "rainbow"))
+        colors, edges, n_drawn = [], [], 0
+        for body_parts, _ in individual_positions:
+            colors.extend(labeled_video.body_part_colors(len(body_parts), colormap))
+            edges.append(kinematics.skeleton_edges(skeleton, body_parts) + n_drawn)
+            n_drawn += len(body_parts)
+
+        # Files are concatenated in the order of their DLC outputs, i.e. by name
+        vkeys, file_paths = (VideoRecording.File & key).fetch("KEY", "file_path")
+        video_files = [path_resolver.find_full_path(fp) for fp in file_paths]
+        order = sorted(range(len(video_files)), key=lambda i: video_files[i].stem)
+        vkeys = [vkeys[i] for i in order]
+        video_files = [video_files[i] for i in order]
+        # frames of each file in the stored poses: the rows of its DLC outputs
+        dlc_result = dlc_reader.PoseEstimation(output_dir)
+        file_nframes = [0] * len(video_files)
+        for h5_path, nframes in zip(dlc_result.h5_paths, dlc_result.segment_nframes):
+            owner = _output_owner(Path(h5_path).name, video_files)
+            if owner is None:
+                raise ValueError(f"DLC output {h5_path} matches no video of {key}")
+            file_nframes[video_files.index(owner)] += nframes
+        assert sum(file_nframes) == len(positions), (
+            f"DLC outputs have {sum(file_nframes)} frames,"
+            + f" the stored poses {len(positions)}"
+        )
 
-        project_path = find_full_path(
-            get_dlc_root_data_dir(), dlc_model_["project_path"]
+        style = {
+            "pcutoff": params.get("pcutoff", dlc_config.get("pcutoff", 0.6)),
+            "dotsize": int(params.get("dotsize", dlc_config.get("dotsize", 8))),
+            "colors": colors,
+            "edges": np.concatenate(edges),
+            "edge_color": labeled_video.named_color(
+                dlc_config.get("skeleton_color", "black")
+            ),
+        }
+        videos, output_paths = [], []
+        frame_offset = 0
+        for video_file, nframes in zip(video_files, file_nframes):
+            frame_indices = labeled_video.output_frame_indices(
+                nframes, fps, outputframerate
+            )
+            videos.append(
+                (video_file, frame_indices, positions[frame_offset + frame_indices])
+            )
+            output_paths.append(
+                output_dir / f"{video_file.stem}{dlc_model_['scorer']}_labeled.mp4"
+            )
+            frame_offset += nframes
+
+        rendered = labeled_video.render_labeled_videos(
+            videos,
+            output_paths,
+            outputframerate,
+            style,
+            n_workers=params.get("n_workers"),
+            n_segments=params.get("n_segments"),
+            encoder=params.get("encoder"),
         )
+        # files without output frames are not rendered
+        return [(vkey, fp) for vkey, fp in zip(vkeys, output_paths) if fp in rendered]
+
+    @staticmethod
+    def _create_labeled_videos_dlc(
+        key: dict, output_dir: Path, params: dict, outputframerate: float
+    ) -> list:
+        """Create labeled videos with deeplabcut.create_labeled_video, file by file
+
+        Returns:
+            List of (VideoRecording.File key, labeled video path)
+        """
+        import deeplabcut
+
+        dlc_model_ = (Model & key).fetch1()
+        fps, nframes = (RecordingInfo & key).fetch1("fps", "nframes")
+        project_path = path_resolver.find_full_path(dlc_model_["project_path"])
 
         try:
-            dlc_config = next(output_dir.glob("dj_dlc_config*.yaml"))
+            dlc_config = dlc_reader.find_files(
+                output_dir, "dj_dlc_config*.yaml", recursive=False
+            )[0]
             dlc_config = project_path / dlc_config.name
             assert dlc_config.exists()
-        except (StopIteration, AssertionError):
-            dlc_config = next(project_path.glob("dj_dlc_config*.yaml"))
+        except (IndexError, AssertionError):
+            dlc_config = dlc_reader.find_files(
+                project_path, "dj_dlc_config*.yaml", recursive=False
+            )[0]
             logger.warning(
                 f"No dj_dlc_config*.yaml file found in {output_dir} - this is unexpected.\nUsing {dlc_config}"
             )
 
-        entries = []
+        labeled_video_paths = []
         for vkey in (VideoRecording.File & key).fetch("KEY"):
             video_file = (VideoRecording.File & vkey).fetch1("file_path")
-            video_file = find_full_path(get_dlc_root_data_dir(), video_file)
+            video_file = path_resolver.find_full_path(video_file)
 
             # -- create labeled video --
             create_labeled_video_kwargs = {
                 k: v
-                for k, v in create_labeled_video_params.items()
+                for k, v in params.items()
                 if k in inspect.signature(deeplabcut.create_labeled_video).parameters
             }
             create_labeled_video_kwargs.update(
@@ -993,21 +1599,1097 @@ class LabeledVideo(dj.Computed):
             )
             deeplabcut.create_labeled_video(**create_labeled_video_kwargs)
 
-            labeled_video_path = next(
-                output_dir.glob(f"{video_file.stem}*_labeled.mp4")
-            )
-            entries.append(
-                {
-                    **key,
-                    **vkey,
-                    "labeled_video_path": labeled_video_path.relative_to(
-                        get_dlc_processed_data_dir()
-                    ).as_posix(),
+            labeled_video_path = dlc_reader.find_files(
+                output_dir, f"{video_file.stem}*_labeled.mp4", recursive=False
+            )[0]
+            labeled_video_paths.append((vkey, labeled_video_path))
+        return labeled_video_paths
+
+
+@schema
+class PoseQuality(dj.Computed):
+    """Quality metrics of a PoseEstimation, per body part.
+
+    Computed from the stored positions by `analysis.quality`, with the p-cutoff of
+    the model config. Jumps are frame-to-frame displacements larger than the
+    median plus `jump_mads` scaled median absolute deviations of the body part.
+
+    Attributes:
+        PoseEstimation (foreign key): Pose Estimation key.
+        pcutoff (float): Likelihood threshold used.
+        jump_mads (float): Jump outlier threshold, in scaled MADs.
+        nframes (int): Number of frames.
+        fraction_above_pcutoff (float): Optional. Lowest fraction across body parts.
+    """
+
+    definition = """
+    -> PoseEstimation
+    ---
+    pcutoff                     : float         # likelihood threshold used
+    jump_mads                   : float         # jump outlier threshold, in scaled MADs
+    nframes                     : int unsigned
+    fraction_above_pcutoff=null : float         # lowest fraction across body parts
+    """
+
+    jump_mads = 6
+
+    class BodyPart(dj.Part):
+        """Quality metrics of one body part
+
+        Attributes:
+            PoseQuality (foreign key): Pose Quality key.
+            Model.BodyPart (foreign key): Body Part key.
+            fraction_above_pcutoff (float): Optional. Frames with likelihood >= pcutoff.
+            longest_low_likelihood_run (int unsigned): Frames of the longest run
+                below pcutoff.
+            jump_threshold (float): Optional. Displacement (px) above which a
+                frame-to-frame jump is an outlier.
+            jump_outliers (int unsigned): Number of outlier jumps.
+            jump_outlier_fraction (float): Optional. Outlier jumps over valid jumps.
+            out_of_frame (int unsigned): Frames located outside of the video.
+            out_of_frame_fraction (float): Optional. Out of frame over located
+                frames."""
+
+        definition = """
+        -> master
+        -> Model.BodyPart
+        ---
+        fraction_above_pcutoff=null : float
+        longest_low_likelihood_run  : int unsigned  # frames
+        jump_threshold=null         : float         # (px)
+        jump_outliers               : int unsigned
+        jump_outlier_fraction=null  : float
+        out_of_frame                : int unsigned  # frames outside px_width/px_height
+        out_of_frame_fraction=null  : float
+        """
+
+    @property
+    def key_source(self):
+        # single-animal entries only, body parts are not keyed by individual
+        return (PoseEstimation - PoseEstimation.IndividualPosition) & RecordingInfo
+
+    def make(self, key):
+        dlc_config = (Model & key).fetch1("config_template")
+        pcutoff = float(dlc_config.get("pcutoff", 0.6))
+        px_width, px_height = (RecordingInfo & key).fetch1("px_width", "px_height")
+        body_parts, positions = PoseEstimation._fetch_positions(key)
+
+        metrics = quality.pose_quality(
+            positions, px_width, px_height, pcutoff, self.jump_mads
+        )
+
+        def _value(value):
+            return None if np.isnan(value) else value.item()
+
+        fractions = metrics["fraction_above_pcutoff"]
+        self.insert1(
+            {
+                **key,
+                "pcutoff": pcutoff,
+                "jump_mads": self.jump_mads,
+                "nframes": len(positions),
+                "fraction_above_pcutoff": (
+                    _value(np.nanmin(fractions)) if len(fractions) else None
+                ),
+            }
+        )
+        self.BodyPart.insert(
+            {
+                **key,
+                "body_part": body_part,
+                **{name: _value(values[bp_idx]) for name, values in metrics.items()},
+            }
+            for bp_idx, body_part in enumerate(body_parts)
+        )
+
+
+@schema
+class FilterParamSet(dj.Lookup):
+    """Parameters of trajectory filtering, see `analysis.filters`
+
+    Attributes:
+        filter_paramset_idx (smallint): Index uniquely identifying paramset.
+        filter_paramset_desc ( varchar(128) ): Description of paramset.
+        filter_param_set_hash (uuid): Hash identifying this paramset.
+        params (longblob): "pcutoff" (defaults to the model config), "max_gap",
+            "filters" and, to filter the DLC output files in chunks of frames
+            instead of the stored arrays, "chunk_size".
+        Note: filter_param_set_hash must be unique."""
+
+    definition = """
+    filter_paramset_idx           : smallint
+    ---
+    filter_paramset_desc          : varchar(128)
+    filter_param_set_hash         : uuid      # hash identifying this parameterset
+    unique index (filter_param_set_hash)
+    params                        : longblob  # dictionary of all applicable parameters
+    """
+
+    @classmethod
+    def insert_new_params(
+        cls, filter_paramset_desc: str, params: dict, filter_paramset_idx: int = None
+    ):
+        """Insert a new set of filtering parameters into FilterParamSet.
+
+        Args:
+            filter_paramset_desc (str): Description of parameter set to be inserted
+            params (dict): Filtering parameters, see `analysis.filters`. For
+                example, {"max_gap": 10, "filters": [{"type": "median",
+                "window": 5}, {"type": "savgol", "window": 7, "polyorder": 2}]}
+            filter_paramset_idx (int): optional, integer to represent parameters.
+        """
+        for filter_params in params.get("filters", []):
+            assert filter_params.get("type") in (
+                "median",
+                "savgol",
+                "kalman",
+            ), "Unknown filter type: " + str(filter_params.get("type"))
+
+        if filter_paramset_idx is None:
+            filter_paramset_idx = (
+                dj.U().aggr(cls, n="max(filter_paramset_idx)").fetch1("n") or 0
+            ) + 1
+
+        param_dict = {
+            "filter_paramset_idx": filter_paramset_idx,
+            "filter_paramset_desc": filter_paramset_desc,
+            "params": params,
+            "filter_param_set_hash": dict_to_uuid(params),
+        }
+        param_query = cls & {
+            "filter_param_set_hash": param_dict["filter_param_set_hash"]
+        }
+        # If the specified param-set already exists
+        if param_query:
+            existing_paramset_idx = param_query.fetch1("filter_paramset_idx")
+            if existing_paramset_idx == int(
+                filter_paramset_idx
+            ):  # If existing_idx same:
+                return  # job done
+        else:
+            cls.insert1(param_dict)  # if duplicate, will raise duplicate error
+
+
+@schema
+class FilteredPoseEstimation(dj.Computed):
+    """Pose estimation filtered with a FilterParamSet.
+
+    Frames below p-cutoff are masked and short gaps interpolated, then the filters
+    are applied to all body parts and coordinates at once. With "chunk_size" in
+    the params, the DLC output files are read and filtered in chunks of frames
+    with overlapping halos, see `analysis.filters.filter_chunks`.
+
+    Attributes:
+        PoseEstimation (foreign key): Pose Estimation key.
+        FilterParamSet (foreign key): Filter ParamSet key.
+        nframes (int unsigned): Number of frames.
+        coords ( varchar(64) ): Comma-separated coordinates of position arrays."""
+
+    definition = """
+    -> PoseEstimation
+    -> FilterParamSet
+    ---
+    nframes     : int unsigned
+    coords      : varchar(64)   # e.g. 'x,y,likelihood' - columns of position arrays
+    """
+
+    class BodyPartPosition(dj.Part):
+        """Filtered position of individual body parts
+
+        Attributes:
+            FilteredPoseEstimation (foreign key): Filtered Pose Estimation key.
+            Model.BodyPart (foreign key): Body Part key.
+            position (longblob): float32 array of shape (nframes, coords)."""
+
+        definition = """
+        -> master
+        -> Model.BodyPart
+        ---
+        position    : longblob     # float32 (nframes, coords), NaN where not filled
+        """
+
+    @property
+    def key_source(self):
+        # single-animal entries only, body parts are not keyed by individual
+        return (PoseEstimation - PoseEstimation.IndividualPosition) * FilterParamSet
+
+    def make(self, key):
+        params = dict((FilterParamSet & key).fetch1("params"))
+        if params.get("pcutoff") is None:
+            dlc_config = (Model & key).fetch1("config_template")
+            params["pcutoff"] = float(dlc_config.get("pcutoff", 0.6))
+        chunk_size = params.pop("chunk_size", None)
+
+        if chunk_size:
+            output_dir = path_resolver.find_full_path(
+                (PoseEstimationTask & key).fetch1("pose_estimation_output_dir")
+            )
+            dlc_result = dlc_reader.PoseEstimation(output_dir)
+            body_parts, coords = list(dlc_result.body_parts), list(dlc_result.coords)
+            filtered = np.empty(
+                (dlc_result.nframes, len(body_parts), len(coords)), dtype=np.float32
+            )
+            window = max(int(chunk_size), filters.filter_halo(params))
+            for frame_start, chunk in filters.filter_chunks(
+                dlc_result.iter_frames(window=window), params
+            ):
+                filtered[frame_start : frame_start + len(chunk)] = chunk
+        else:
+            body_parts, positions = PoseEstimation._fetch_positions(key)
+            coords = ["x", "y", "z", "likelihood"]
+            if not positions[..., 2].any():  # 2D
+                positions, coords = positions[..., [0, 1, 3]], ["x", "y", "likelihood"]
+            filtered = filters.filter_positions(positions, params).astype(np.float32)
+
+        self.insert1({**key, "nframes": len(filtered), "coords": ",".join(coords)})
+        self.BodyPartPosition.insert(
+            {**key, "body_part": body_part, "position": filtered[:, bp_idx, :]}
+            for bp_idx, body_part in enumerate(body_parts)
+        )
+
+
+@schema
+class Kinematics(dj.Computed):
+    """Kinematics of a PoseEstimation, computed by `analysis.kinematics`.
+
+    Positions below the model p-cutoff are NaN. Derivatives use the frame rate of
+    the DLC outputs, or RecordingInfo.fps if they do not record it.
+    Distances are computed between the body parts joined in the skeleton of the
+    model config, or between all pairs of body parts without a skeleton or with
+    `Kinematics.all_pair_distances = True`. Joint angles are computed at each
+    body part joined to two others in the skeleton. Arrays are stored as float32,
+    with summary values queryable in SQL.
+
+    Attributes:
+        PoseEstimation (foreign key): Pose Estimation key.
+        fps (float): Frame rate of the derivatives (Hz).
+        pcutoff (float): Likelihood threshold used.
+        nframes (int unsigned): Number of frames."""
+
+    definition = """
+    -> PoseEstimation
+    ---
+    fps         : float         # (Hz) frame rate of the derivatives
+    pcutoff     : float         # positions with a lower likelihood are NaN
+    nframes     : int unsigned
+    """
+
+    all_pair_distances = False
+
+    class BodyPart(dj.Part):
+        """Motion of one body part
+
+        Attributes:
+            Kinematics (foreign key): Kinematics key.
+            Model.BodyPart (foreign key): Body Part key.
+            motion (longblob): float32 array (nframes, 4) of vx, vy, speed (px/s)
+                and acceleration (px/s^2).
+            mean_speed (float): Optional. Mean speed (px/s).
+            max_speed (float): Optional. Maximum speed (px/s).
+            mean_acceleration (float): Optional. Mean acceleration (px/s^2)."""
+
+        definition = """
+        -> master
+        -> Model.BodyPart
+        ---
+        motion                 : longblob  # float32 (nframes, 4): vx, vy, speed, acceleration
+        mean_speed=null        : float     # (px/s)
+        max_speed=null         : float     # (px/s)
+        mean_acceleration=null : float     # (px/s^2)
+        """
+
+    class Distance(dj.Part):
+        """Distance between two body parts
+
+        Attributes:
+            Kinematics (foreign key): Kinematics key.
+            body_part_a ( varchar(32) ): First body part.
+            body_part_b ( varchar(32) ): Second body part.
+            distance (longblob): float32 array (nframes,) of distances (px).
+            mean_distance (float): Optional. Mean distance (px)."""
+
+        definition = """
+        -> master
+        -> Model.BodyPart.proj(body_part_a="body_part")
+        -> Model.BodyPart.proj(body_part_b="body_part")
+        ---
+        distance           : longblob  # float32 (nframes,) (px)
+        mean_distance=null : float     # (px)
+        """
+
+    class JointAngle(dj.Part):
+        """Angle at a body part between the segments to two others
+
+        Attributes:
+            Kinematics (foreign key): Kinematics key.
+            joint ( varchar(32) ): Body part at the vertex of the angle.
+            body_part_a ( varchar(32) ): End of the first segment.
+            body_part_b ( varchar(32) ): End of the second segment.
+            angle (longblob): float32 array (nframes,) of angles (deg), in [0, 180].
+            mean_angle (float): Optional. Mean angle (deg)."""
+
+        definition = """
+        -> master
+        -> Model.BodyPart.proj(joint="body_part")
+        -> Model.BodyPart.proj(body_part_a="body_part")
+        -> Model.BodyPart.proj(body_part_b="body_part")
+        ---
+        angle           : longblob  # float32 (nframes,) (deg)
+        mean_angle=null : float     # (deg)
+        """
+
+    @property
+    def key_source(self):
+        # single-animal entries only, body parts are not keyed by individual
+        return (PoseEstimation - PoseEstimation.IndividualPosition) & RecordingInfo
+
+    def make(self, key):
+        dlc_config = (Model & key).fetch1("config_template")
+        pcutoff = float(dlc_config.get("pcutoff", 0.6))
+        fps = self._get_fps(key)
+        body_parts, positions = PoseEstimation._fetch_positions(key)
+        xy = np.where(
+            (positions[..., -1] >= pcutoff)[..., None], positions[..., :2], np.nan
+        )
+
+        edges = kinematics.skeleton_edges(dlc_config.get("skeleton"), body_parts)
+        edges = np.unique(np.sort(edges[edges[:, 0] != edges[:, 1]], axis=1), axis=0)
+        triplets = kinematics.joint_triplets(edges)
+        if self.all_pair_distances or not len(edges):
+            edges = kinematics.pairwise_edges(len(body_parts))
+
+        motion = kinematics.motion(xy, fps).astype(np.float32)
+        distances = kinematics.distances(xy, edges).astype(np.float32)
+        angles = kinematics.joint_angles(xy, triplets).astype(np.float32)
+
+        self.insert1({**key, "fps": fps, "pcutoff": pcutoff, "nframes": len(xy)})
+        self.BodyPart.insert(
+            {
+                **key,
+                "body_part": body_part,
+                "motion": motion[:, bp_idx],
+                "mean_speed": _nan_summary(np.nanmean, motion[:, bp_idx, 2]),
+                "max_speed": _nan_summary(np.nanmax, motion[:, bp_idx, 2]),
+                "mean_acceleration": _nan_summary(np.nanmean, motion[:, bp_idx, 3]),
+            }
+            for bp_idx, body_part in enumerate(body_parts)
+        )
+        self.Distance.insert(
+            {
+                **key,
+                "body_part_a": body_parts[a],
+                "body_part_b": body_parts[b],
+                "distance": distances[:, edge_idx],
+                "mean_distance": _nan_summary(np.nanmean, distances[:, edge_idx]),
+            }
+            for edge_idx, (a, b) in enumerate(edges)
+        )
+        self.JointAngle.insert(
+            {
+                **key,
+                "joint": body_parts[joint],
+                "body_part_a": body_parts[a],
+                "body_part_b": body_parts[b],
+                "angle": angles[:, triplet_idx],
+                "mean_angle": _nan_summary(np.nanmean, angles[:, triplet_idx]),
+            }
+            for triplet_idx, (joint, a, b) in enumerate(triplets)
+        )
+
+    @staticmethod
+    def _get_fps(key: dict) -> float:
+        """Frame rate recorded by DLC in its output meta file, else RecordingInfo.fps
+
+        RecordingInfo.fps is an optional integer, truncated for e.g. 29.97 Hz.
+        """
+        output_dir = (PoseEstimationTask & key).fetch1("pose_estimation_output_dir")
+        try:
+            fps = dlc_reader.PoseEstimation(
+                path_resolver.find_full_path(output_dir)
+            ).fps
+        except (FileNotFoundError, KeyError) as e:
+            logger.warning(f"No frame rate in the DLC output of {key}: {e}")
+            fps = None
+        fps = fps or (RecordingInfo & key).fetch1("fps")
+        if not fps:
+            raise ValueError(f"Unknown frame rate of {key}")
+        return float(fps)
+
+
+@schema
+class CameraCalibration(dj.Manual):
+    """Calibration of a set of cameras, for 3D triangulation
+
+    Attributes:
+        calibration_id (int): Unique calibration ID.
+        calibration_description ( varchar(255) ): Optional. Description."""
+
+    definition = """
+    calibration_id                 : int
+    ---
+    calibration_description=''     : varchar(255)
+    """
+
+    class Camera(dj.Part):
+        """Intrinsic and extrinsic parameters of one camera (Device)
+
+        Attributes:
+            CameraCalibration (foreign key): Camera Calibration key.
+            Device (foreign key): Device key, the camera of a VideoRecording.
+            intrinsics (longblob): Camera matrix K (3, 3).
+            rotation (longblob): Rotation matrix R (3, 3), world to camera.
+            translation (longblob): Translation vector t (3,), world to camera.
+            projection_matrix (longblob): K [R | t] (3, 4)."""
+
+        definition = """
+        -> master
+        -> Device
+        ---
+        intrinsics        : longblob  # camera matrix K (3, 3)
+        rotation          : longblob  # rotation matrix R (3, 3), world to camera
+        translation       : longblob  # translation vector t (3,), world to camera
+        projection_matrix : longblob  # K [R | t] (3, 4)
+        """
+
+    @classmethod
+    def insert_cameras(
+        cls, calibration_id: int, cameras: list, calibration_description: str = ""
+    ):
+        """Insert a calibration and the projection matrices of its cameras.
+
+        Args:
+            calibration_id (int): Unique calibration ID.
+            cameras (list): Dicts of the Device key with intrinsics, rotation and
+                translation, e.g. from OpenCV's calibrateCamera and stereoCalibrate
+                (use cv2.Rodrigues for rotation vectors).
+            calibration_description (str): Optional. Description.
+        """
+        entries = [
+            {
+                **camera,
+                "calibration_id": calibration_id,
+                "projection_matrix": triangulation.projection_matrix(
+                    camera["intrinsics"], camera["rotation"], camera["translation"]
+                ),
+            }
+            for camera in cameras
+        ]
+        with cls.connection.transaction:
+            cls.insert1(
+                {
+                    "calibration_id": calibration_id,
+                    "calibration_description": calibration_description,
                 }
             )
+            cls.Camera.insert(entries)
 
-        self.insert1(key)
-        self.File.insert(entries)
+
+@schema
+class TriangulationTask(dj.Manual):
+    """Synchronized 2D pose estimations of a session to triangulate in 3D
+
+    Attributes:
+        Session (foreign key): Session key.
+        triangulation_id (smallint): Triangulation ID within the session.
+        CameraCalibration (foreign key): Calibration of the cameras.
+        triangulation_params (longblob): Optional. "pcutoff" (defaults to the
+            model config) and "chunk_size" (frames triangulated at once)."""
+
+    definition = """
+    -> Session
+    triangulation_id          : smallint
+    ---
+    -> CameraCalibration
+    triangulation_params=null : longblob  # pcutoff, chunk_size
+    """
+
+    class View(dj.Part):
+        """2D pose estimation of one camera, whose Device is calibrated
+
+        Attributes:
+            TriangulationTask (foreign key): Triangulation Task key.
+            PoseEstimation (foreign key): Pose Estimation key."""
+
+        definition = """
+        -> master
+        -> PoseEstimation
+        """
+
+
+@schema
+class Triangulated3D(dj.Computed):
+    """3D body part positions triangulated from the views of a TriangulationTask.
+
+    Views are matched to cameras by the Device of their VideoRecording, and frames
+    by index. In each frame, a body part is triangulated by likelihood-weighted
+    DLT from the views above p-cutoff, in chunks of frames, see
+    `analysis.triangulation`.
+
+    Attributes:
+        TriangulationTask (foreign key): Triangulation Task key.
+        pcutoff (float): Likelihood threshold of the views used.
+        nframes (int unsigned): Number of frames.
+        mean_reprojection_error (float): Optional. Mean reprojection error (px)."""
+
+    definition = """
+    -> TriangulationTask
+    ---
+    pcutoff                      : float  # views with a lower likelihood are not used
+    nframes                      : int unsigned
+    mean_reprojection_error=null : float  # (px)
+    """
+
+    class BodyPartPosition(dj.Part):
+        """3D position of individual body parts by frame index
+
+        Attributes:
+            Triangulated3D (foreign key): Triangulated3D key.
+            BodyPart (foreign key): Body Part key.
+            x_pos (longblob): X position (float32), NaN with fewer than 2 views.
+            y_pos (longblob): Y position (float32).
+            z_pos (longblob): Z position (float32).
+            reprojection_error (longblob): Mean reprojection error (px, float32).
+            n_views (longblob): Number of views used (uint8).
+            mean_reprojection_error (float): Optional. Across frames (px)."""
+
+        definition = """
+        -> master
+        -> BodyPart
+        ---
+        x_pos                        : longblob
+        y_pos                        : longblob
+        z_pos                        : longblob
+        reprojection_error           : longblob  # (px) mean over the views used
+        n_views                      : longblob  # number of views used
+        mean_reprojection_error=null : float     # (px)
+        """
+
+    @property
+    def key_source(self):
+        # single-animal views only, body parts are not keyed by individual
+        return (
+            TriangulationTask
+            - (TriangulationTask.View & PoseEstimation.IndividualPosition).proj()
+        )
+
+    def make(self, key):
+        params = (TriangulationTask & key).fetch1("triangulation_params") or {}
+        views = (TriangulationTask.View & key).fetch("KEY", order_by="recording_id")
+        if len(views) < 2:
+            raise ValueError(f"Triangulation requires at least two views: {key}")
+        pcutoff = params.get("pcutoff")
+        if pcutoff is None:
+            dlc_config = (Model & views[0]).fetch1("config_template")
+            pcutoff = float(dlc_config.get("pcutoff", 0.6))
+
+        calibration_id = (TriangulationTask & key).fetch1("calibration_id")
+        projections, view_positions = [], []
+        for view in views:  # the camera of a view is the Device of its recording
+            camera = (
+                CameraCalibration.Camera
+                & {"calibration_id": calibration_id}
+                & (VideoRecording & view)
+            )
+            projections.append(camera.fetch1("projection_matrix"))
+            view_positions.append(PoseEstimation._fetch_positions(view))
+
+        # body parts estimated in all views, in the order of the first one
+        body_parts = [
+            body_part
+            for body_part in view_positions[0][0]
+            if all(body_part in view_parts for view_parts, _ in view_positions)
+        ]
+        nframes = min(len(positions) for _, positions in view_positions)
+        if any(len(positions) != nframes for _, positions in view_positions):
+            logger.warning(
+                f"Views of {key} have different lengths, triangulating {nframes} frames"
+            )
+
+        points = np.empty((len(views), nframes, len(body_parts), 2), dtype=np.float32)
+        weights = np.empty((len(views), nframes, len(body_parts)), dtype=np.float32)
+        for view_idx, (view_parts, positions) in enumerate(view_positions):
+            bp_indices = [view_parts.index(body_part) for body_part in body_parts]
+            selected = positions[:nframes, bp_indices]
+            points[view_idx] = selected[..., :2]
+            likelihood = selected[..., -1]
+            weights[view_idx] = np.where(likelihood >= pcutoff, likelihood, 0)
+
+        xyz = np.empty((nframes, len(body_parts), 3), dtype=np.float32)
+        errors = np.empty((nframes, len(body_parts)), dtype=np.float32)
+        for frame_start, chunk_xyz, chunk_errors in triangulation.triangulate_chunks(
+            points,
+            weights,
+            np.stack(projections),
+            chunk_size=params.get("chunk_size", 100000),
+        ):
+            xyz[frame_start : frame_start + len(chunk_xyz)] = chunk_xyz
+            errors[frame_start : frame_start + len(chunk_errors)] = chunk_errors
+        n_views = ((weights > 0) & np.isfinite(points).all(axis=-1)).sum(axis=0)
+
+        self.insert1(
+            {
+                **key,
+                "pcutoff": pcutoff,
+                "nframes": nframes,
+                "mean_reprojection_error": _nan_summary(np.nanmean, errors),
+            }
+        )
+        self.BodyPartPosition.insert(
+            {
+                **key,
+                "body_part": body_part,
+                "x_pos": xyz[:, bp_idx, 0],
+                "y_pos": xyz[:, bp_idx, 1],
+                "z_pos": xyz[:, bp_idx, 2],
+                "reprojection_error": errors[:, bp_idx],
+                "n_views": n_views[:, bp_idx].astype(np.uint8),
+                "mean_reprojection_error": _nan_summary(np.nanmean, errors[:, bp_idx]),
+            }
+            for bp_idx, body_part in enumerate(body_parts)
+        )
+
+
+def _nan_summary(func, values: np.ndarray) -> Optional[float]:
+    """func (e.g. np.nanmean) of values, None if all are NaN"""
+    if not np.isfinite(values).any():
+        return None
+    return float(func(values))
+
+
+def _list_snapshots(dlc_model_: dict, project_path: Path) -> list:
+    """Training iterations of the model's snapshots, in snapshotindex order"""
+    try:
+        from deeplabcut.utils.auxiliaryfunctions import get_model_folder
+    except ImportError:
+        from deeplabcut.utils.auxiliaryfunctions import (
+            GetModelFolder as get_model_folder,
+        )  # isort:skip
+
+    kwargs = {}
+    if dlc_model_.get("engine") == "pytorch":
+        from deeplabcut.core.engine import Engine
+
+        kwargs["engine"] = Engine.PYTORCH
+    dlc_config = dlc_model_["config_template"]
+    model_folder = get_model_folder(
+        trainFraction=dlc_config["TrainingFraction"][dlc_model_["trainingsetindex"]],
+        shuffle=dlc_model_["shuffle"],
+        cfg=dlc_config,
+        modelprefix=dlc_model_["model_prefix"],
+        **kwargs,
+    )
+    return sorted(
+        {
+            int(match.group(1))
+            for fp in (project_path / model_folder / "train").iterdir()
+            if (match := re.fullmatch(r"snapshot-(\d+)\.(index|pt)", fp.name))
+        }
+    )
+
+
+def _evaluate_snapshot(
+    dlc_model_: dict,
+    project_path: Path,
+    snapshotindex: int,
+    train_iterations: int,
+    tmp_dir: str,
+) -> dict:
+    """Evaluate one snapshot with `deeplabcut.evaluate_network` and read its results
+
+    The snapshot is selected by a config copy, so that concurrent evaluations do not
+    edit the project config. The config points to a project of links in
+    tmp_dir/snapshot<index>, with its own evaluation folders, as evaluations of all
+    snapshots write to the same CombinedEvaluation-results.csv.
+    """
+    from deeplabcut import evaluate_network  # isort:skip
+    from deeplabcut.utils.auxiliaryfunctions import (
+        get_evaluation_folder,
+    )  # isort:skip
+
+    snapshot_dir = Path(tmp_dir) / f"snapshot{snapshotindex}"
+    _link_project(project_path, snapshot_dir)
+    dlc_config = {
+        **dlc_model_["config_template"],
+        "project_path": snapshot_dir.as_posix(),
+        "snapshotindex": snapshotindex,
+    }
+    config_filepath = dlc_reader.save_yaml(
+        snapshot_dir, dlc_config, filename=f"dj_dlc_config_snapshot{snapshotindex}"
+    )
+    evaluate_network(
+        config_filepath,
+        Shuffles=[dlc_model_["shuffle"]],  # this needs to be a list
+        trainingsetindex=dlc_model_["trainingsetindex"],
+        comparisonbodyparts="all",
+        modelprefix=dlc_model_["model_prefix"],
+    )
+
+    eval_folder = get_evaluation_folder(
+        trainFraction=dlc_config["TrainingFraction"][dlc_model_["trainingsetindex"]],
+        shuffle=dlc_model_["shuffle"],
+        cfg=dlc_config,
+        modelprefix=dlc_model_["model_prefix"],
+    )
+    eval_path = snapshot_dir / eval_folder
+    eval_csvs = sorted(eval_path.glob(f"*_{train_iterations}-results.csv"))
+    assert eval_csvs, f"No evaluation results for snapshot {train_iterations}"
+    with open(eval_csvs[0], newline="") as f:
+        results = list(csv.DictReader(f, delimiter=","))[0]
+
+    # in testing, test_error_p returned empty string
+    def _float(value):
+        return float(value) if value not in ("", None) else None
+
+    return {
+        "train_iterations": int(float(results["Training iterations:"])),
+        "train_error": _float(results[" Train error(px)"]),
+        "test_error": _float(results[" Test error(px)"]),
+        "p_cutoff": _float(results["p-cutoff used"]),
+        "train_error_p": _float(results["Train error with p-cutoff"]),
+        "test_error_p": _float(results["Test error with p-cutoff"]),
+    }
+
+
+def _is_evaluation_folder(path: Path) -> bool:
+    # "evaluation-results", or "evaluation-results-pytorch" with DLC 3
+    return path.name.startswith("evaluation-results")
+
+
+def _link_project(project_path: Path, snapshot_dir: Path):
+    """Link the entries of a DLC project into snapshot_dir, except its evaluation
+    folders, config copies and the temporary evaluation directories"""
+    snapshot_dir.mkdir(parents=True)
+    for entry in Path(project_path).iterdir():
+        if _is_evaluation_folder(entry) or entry.name.startswith(
+            (".dj_dlc_eval_", "dj_dlc_config")
+        ):
+            continue
+        (snapshot_dir / entry.name).symlink_to(entry, entry.is_dir())
+
+
+def _merge_evaluation_results(snapshot_dir: Path, project_path: Path):
+    """Copy the evaluation results of a snapshot into the project.
+
+    Rows of CombinedEvaluation-results.csv are added to the project's, replacing
+    earlier results of the same training iterations, shuffle and training fraction.
+    """
+    for eval_root in filter(_is_evaluation_folder, snapshot_dir.iterdir()):
+        for fp in eval_root.rglob("*"):
+            if fp.is_dir():
+                continue
+            dest = Path(project_path) / fp.relative_to(snapshot_dir)
+            dest.parent.mkdir(parents=True, exist_ok=True)
+            if fp.name != "CombinedEvaluation-results.csv" or not dest.exists():
+                shutil.copy2(fp, dest)
+                continue
+            combined = pd.concat(
+                [pd.read_csv(dest, index_col=0), pd.read_csv(fp, index_col=0)],
+                ignore_index=True,
+            )
+            subset = [
+                c
+                for c in ("Training iterations:", "%Training dataset", "Shuffle number")
+                if c in combined.columns
+            ]
+            combined.drop_duplicates(subset=subset or None, keep="last").to_csv(dest)
+
+
+def _expected_video_nframes(key: dict, video_infos: dict) -> dict:
+    """Frames expected in the DLC output of each video, {video: nframes}
+
+    A single video has the frames of its RecordingInfo. The frame counts of several
+    videos are probed, and must sum to the RecordingInfo frame count.
+    """
+    expected = {video: info["nframes"] for video, info in video_infos.items()}
+    recording_nframes = (RecordingInfo & key).fetch("nframes")
+    if not len(recording_nframes):
+        return expected
+    if len(expected) == 1:
+        return {video: int(recording_nframes[0]) for video in expected}
+    if sum(expected.values()) != recording_nframes[0]:
+        raise ValueError(
+            f"Video frame counts ({sum(expected.values())}) differ from"
+            + f" RecordingInfo ({recording_nframes[0]}) for {key}"
+        )
+    return expected
+
+
+class _TaskInference:
+    """Resumable inference of the videos of one 'trigger' PoseEstimationTask.
+
+    Shared by `PoseEstimation.make` and `PoseEstimation.populate_batched`. Videos
+    with a matching checkpoint are skipped and cached results restored. New
+    outputs are validated against RecordingInfo, checkpointed and cached.
+
+    Args:
+        key (dict): PoseEstimationTask key.
+        dlc_model_ (dict): Model entry.
+        output_dir (Path): Full path of the task's output dir.
+        pose_estimation_params (dict): Params of the task.
+    """
+
+    def __init__(
+        self, key: dict, dlc_model_: dict, output_dir: Path, pose_estimation_params
+    ):
+        self.key = key
+        self.dlc_model = dlc_model_
+        self.output_dir = output_dir
+        self.pose_estimation_params = pose_estimation_params or {}
+        self.project_path = path_resolver.find_full_path(dlc_model_["project_path"])
+        self.video_relpaths = list((VideoRecording.File & key).fetch("file_path"))
+        self.video_filepaths = [
+            path_resolver.find_full_path(fp).as_posix() for fp in self.video_relpaths
+        ]
+        self.analyze_video_params = _get_analyze_video_params(
+            self.pose_estimation_params
+        )
+        self.parallel_inference = self.pose_estimation_params.get(
+            "parallel_inference", {}
+        )
+        self.inference_settings = {
+            **self.analyze_video_params,
+            "parallel_inference": self.parallel_inference,
+            "project_path": dlc_model_["project_path"],
+            "shuffle": dlc_model_["shuffle"],
+            "trainingsetindex": dlc_model_["trainingsetindex"],
+        }
+        cache_dir = get_dlc_result_cache_dir()
+        self.result_cache = ResultCache(cache_dir) if cache_dir else None
+        self.checkpoints = VideoCheckpoints(output_dir, self.inference_settings)
+        self._video_infos = None
+        self._expected_nframes = None
+
+    @property
+    def video_infos(self) -> dict:
+        if self._video_infos is None:
+            self._video_infos = dict(
+                zip(
+                    self.video_filepaths,
+                    video_probe.probe_many(
+                        self.video_filepaths,
+                        cache_path=RecordingInfo.probe_cache_path(),
+                    ),
+                )
+            )
+        return self._video_infos
+
+    @property
+    def expected_nframes(self) -> dict:
+        if self._expected_nframes is None:
+            self._expected_nframes = _expected_video_nframes(self.key, self.video_infos)
+        return self._expected_nframes
+
+    def pending_videos(self) -> list:
+        """Videos without valid outputs, once the cached results are restored"""
+        pending = [v for v in self.video_filepaths if not self.checkpoints.is_done(v)]
+        if len(pending) < len(self.video_filepaths):
+            logger.info(
+                f"Resuming: {len(self.video_filepaths) - len(pending)} of"
+                + f" {len(self.video_filepaths)} videos already analyzed"
+            )
+        return [video for video in pending if not self._restore_cached(video)]
+
+    def complete(self, video: str):
+        """Validate, checkpoint and cache the new outputs of a video
+
+        Raises:
+            ValueError: If the outputs do not have the RecordingInfo frame count.
+        """
+        nframes = self.checkpoints.validate(video, self.expected_nframes[video])
+        self.checkpoints.mark_done(video, nframes)
+        if self.result_cache is not None:
+            self.result_cache.store(
+                self._cache_key(video), Path(video).stem, self.output_dir
+            )
+
+    def run(self, analyze_videos=None):
+        """Analyze the pending videos one by one, memoized for the task settings
+
+        Args:
+            analyze_videos (callable): Optional. Replacement for DLC's
+                analyze_videos, see `PoseEstimation.populate_batched`.
+        """
+
+        @memoized_result(
+            uniqueness_dict={
+                **self.inference_settings,
+                "video_filepaths": self.video_relpaths,
+            },
+            output_directory=self.output_dir,
+        )
+        def do_analyze_videos():
+            # Each video is analyzed and checkpointed on its own, so that after
+            # a failure only the videos without valid outputs are analyzed again
+            pending = self.pending_videos()
+            if not pending:
+                return
+
+            config_filepath = _save_dlc_config(
+                self.dlc_model,
+                self.project_path,
+                [self.output_dir],
+                self.analyze_video_params,
+            )
+            engine_analyze_videos = analyze_videos or _get_analyze_videos_for(
+                self.dlc_model, self.project_path
+            )
+            for video in pending:
+                if self.parallel_inference.get("n_segments", 1) > 1:
+                    # segments run in local processes, not on the inference worker
+                    segments.analyze_video_segments(
+                        self.dlc_model.get("engine"),
+                        config_filepath,
+                        self.dlc_model,
+                        [video],
+                        self.output_dir,
+                        self.analyze_video_params,
+                        nframes=[self.video_infos[video]["nframes"]],
+                        fps=[self.video_infos[video]["fps"]],
+                        **self.parallel_inference,
+                    )
+                else:
+                    _run_analyze_videos(
+                        engine_analyze_videos,
+                        config_filepath,
+                        self.dlc_model,
+                        [video],
+                        self.output_dir,
+                        self.analyze_video_params,
+                    )
+                self.complete(video)
+
+        do_analyze_videos()
+
+    def _cache_key(self, video: str) -> str:
+        return self.result_cache.key(video, self.dlc_model, self.inference_settings)
+
+    def _restore_cached(self, video: str) -> bool:
+        if self.result_cache is None:
+            return False
+        if not self.result_cache.restore(
+            self._cache_key(video), Path(video).stem, self.output_dir
+        ):
+            return False
+        try:
+            nframes = self.checkpoints.validate(video, self.expected_nframes[video])
+        except ValueError as e:  # analyzed again
+            logger.warning(f"Cached result not used: {e}")
+            return False
+        self.checkpoints.mark_done(video, nframes)
+        return True
+
+
+def _output_owner(filename: str, videos: list) -> Optional[Path]:
+    """Video of a DLC output file, named "{video stem}DLC..." or, for segment
+    outputs, "{video stem}_seg000DLC...", among videos.
+
+    The longest matching stem wins, so that the outputs of "a.mp4" and
+    "aDLC1.mp4" are told apart.
+    """
+    owners = [
+        video
+        for video in videos
+        if re.match(re.escape(video.stem) + r"(_seg\d{3})?DLC", filename)
+    ]
+    return max(owners, key=lambda video: len(video.stem), default=None)
+
+
+def _get_analyze_video_params(pose_estimation_params: dict) -> dict:
+    """analyze_videos params from a task's pose_estimation_params"""
+    # expect a nested dictionary with "analyze_videos" params
+    # if not, assume "pose_estimation_params" as a flat dictionary that include relevant "analyze_videos" params
+    return pose_estimation_params.get("analyze_videos") or pose_estimation_params
+
+
+def _get_analyze_videos_for(dlc_model_: dict, project_path: Path):
+    """analyze_videos for a model: on the inference worker if configured"""
+    worker = get_dlc_inference_worker()
+    if worker is None:
+        return engines.get_engine(dlc_model_.get("engine")).get_analyze_videos()
+
+    from .inference.worker import InferenceClient
+
+    client = InferenceClient(**worker)
+    return client.analyze_videos_func(dlc_model_, project_path)
+
+
+def _save_dlc_config(
+    dlc_model_: dict, project_path: Path, output_dirs: list, analyze_video_params: dict
+) -> str:
+    """Save the model's DLC config to each output dir and to the project dir.
+
+    Returns:
+        Path of the config saved in the project dir, as required by analyze_videos
+    """
+    # ---- Build and save DLC configuration (yaml) file ----
+    dlc_config = dlc_model_["config_template"]
+    dlc_project_path = Path(project_path)
+    dlc_config["project_path"] = dlc_project_path.as_posix()
+
+    # ---- Special handling for "cropping" ----
+    # `analyze_videos` behavior:
+    #   i) if is None, use the "cropping" from the config file
+    #   ii) if defined, use the specified "cropping" values but not updating the config file
+    # new behavior: if defined as "False", overwrite "cropping" to False in config file
+    cropping = analyze_video_params.get("cropping", None)
+    if cropping is not None:
+        if cropping:
+            dlc_config["cropping"] = True
+            (
+                dlc_config["x1"],
+                dlc_config["x2"],
+                dlc_config["y1"],
+                dlc_config["y2"],
+            ) = cropping
+        else:  # cropping is False
+            dlc_config["cropping"] = False
+
+    # ---- Write config files ----
+    config_filename = (
+        f"dj_dlc_config_{datetime.now(tz=timezone.utc).strftime('%Y%m%d_%H%M%S')}.yaml"
+    )
+    # To output dir: Important for loading/parsing output in datajoint
+    for output_dir in output_dirs:
+        _ = dlc_reader.save_yaml(output_dir, dlc_config)
+    # To project dir: Required by DLC to run the analyze_videos
+    return dlc_reader.save_yaml(
+        dlc_project_path,
+        dlc_config,
+        filename=config_filename,
+    )
+
+
+def _run_analyze_videos(
+    analyze_videos,
+    config_filepath: str,
+    dlc_model_: dict,
+    video_filepaths: list,
+    destfolder: str,
+    analyze_video_params: dict,
+):
+    """Call analyze_videos with the model settings and its valid parameters"""
+    # ---- Take valid parameters for analyze_videos ----
+    # (all of them for **kwargs callables, e.g. the inference worker client)
+    parameters = inspect.signature(analyze_videos).parameters
+    any_keyword = any(p.kind == p.VAR_KEYWORD for p in parameters.values())
+    if any_keyword:
+        kwargs = dict(analyze_video_params)
+    else:
+        kwargs = {k: v for k, v in analyze_video_params.items() if k in parameters}
+    if "dlc_scorer" in parameters:  # engines writing outputs without deeplabcut
+        kwargs["dlc_scorer"] = dlc_model_["scorer"]
+    if any_keyword or "modelprefix" in parameters:
+        kwargs["modelprefix"] = dlc_model_["model_prefix"]
+
+    # ---- Trigger DLC prediction job ----
+    analyze_videos(
+        config=config_filepath,
+        videos=video_filepaths,
+        shuffle=dlc_model_["shuffle"],
+        trainingsetindex=dlc_model_["trainingsetindex"],
+        destfolder=destfolder,
+        **kwargs,
+    )
 
 
 def str_to_bool(value) -> bool:
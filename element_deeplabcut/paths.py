@@ -0,0 +1,101 @@
+import time
+import threading
+from pathlib import Path
+from collections import OrderedDict
+from element_interface.utils import find_full_path, find_root_directory
+
+
+class PathResolver:
+    """Memoized resolution of paths against the root data directories.
+
+    Created by `activate()` of the model and train schemas. The list of root
+    directories is requested once from the linking module and kept until
+    `invalidate()` is called. Resolved paths are kept in a bounded LRU. Failed
+    lookups are also cached, for `negative_ttl` seconds, so missing paths do not
+    stat every root directory on each call.
+
+    Args:
+        get_root_dirs (callable): Returns the root data director(y/ies).
+        maxsize (int): Optional. Maximum number of memoized resolutions.
+        negative_ttl (float): Optional. Seconds a failed lookup stays cached.
+    """
+
+    def __init__(self, get_root_dirs, maxsize: int = 4096, negative_ttl: float = 60):
+        self._get_root_dirs = get_root_dirs
+        self.maxsize = maxsize
+        self.negative_ttl = negative_ttl
+        self._root_dirs = None
+        self._cache = OrderedDict()  # {(kind, path): Path or (None, expiry_time)}
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    @property
+    def root_dirs(self) -> list:
+        """Cached list of root data directories"""
+        if self._root_dirs is None:
+            self._root_dirs = list(self._get_root_dirs())
+        return self._root_dirs
+
+    @property
+    def stats(self) -> dict:
+        """Cache hit and miss counters, and number of cached resolutions"""
+        return {"hits": self.hits, "misses": self.misses, "size": len(self._cache)}
+
+    def find_full_path(self, relative_path) -> Path:
+        """Memoized `element_interface.utils.find_full_path` over the root dirs
+
+        Raises:
+            FileNotFoundError: If no root directory contains relative_path.
+        """
+        return self._resolve("full_path", relative_path, find_full_path)
+
+    def find_root_directory(self, full_path) -> Path:
+        """Memoized `element_interface.utils.find_root_directory` over the root dirs
+
+        Raises:
+            FileNotFoundError: If full_path does not exist or is under no root.
+        """
+        return self._resolve("root_directory", full_path, find_root_directory)
+
+    def invalidate(self, path=None):
+        """Drop memoized resolutions of `path`, or everything including root dirs.
+
+        Call after creating or moving files that may have been looked up before.
+        """
+        with self._lock:
+            if path is None:
+                self._root_dirs = None
+                self._cache.clear()
+                return
+            for kind in ("full_path", "root_directory"):
+                self._cache.pop((kind, Path(path).as_posix()), None)
+
+    def _resolve(self, kind: str, path, resolve_func) -> Path:
+        cache_key = (kind, Path(path).as_posix())
+        with self._lock:
+            cached = self._cache.get(cache_key)
+            if isinstance(cached, tuple) and cached[1] < time.monotonic():
+                cached = self._cache.pop(cache_key)[0]  # expired negative result
+            if cached is not None:
+                self._cache.move_to_end(cache_key)
+                self.hits += 1
+                if isinstance(cached, tuple):
+                    raise FileNotFoundError(f"{kind} lookup failed for {path} (cached)")
+                return cached
+            self.misses += 1
+
+        try:
+            resolved = resolve_func(self.root_dirs, path)
+        except FileNotFoundError:
+            self._store(cache_key, (None, time.monotonic() + self.negative_ttl))
+            raise
+        self._store(cache_key, resolved)
+        return resolved
+
+    def _store(self, cache_key: tuple, value):
+        with self._lock:
+            self._cache[cache_key] = value
+            self._cache.move_to_end(cache_key)
+            while len(self._cache) > self.maxsize:
+                self._cache.popitem(last=False)
@@ -15,7 +15,7 @@ def plotting_results(pose_estimation_key: dict):
     output_dir = (model.PoseEstimationTask & pose_estimation_key).fetch1(
         "pose_estimation_output_dir"
     )
-    output_dir = model.find_full_path(model.get_dlc_root_data_dir(), output_dir)
+    output_dir = model.path_resolver.find_full_path(output_dir)
 
     dlc_result = dlc_reader.PoseEstimation(output_dir.as_posix())
 
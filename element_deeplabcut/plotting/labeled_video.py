@@ -0,0 +1,372 @@
+"""
+Labeled videos rendered from stored pose arrays.
+
+Poses come from the database instead of the h5 files. Only the output frames are
+decoded and drawn, and the files of a recording, as well as frame ranges within a
+file, are rendered in a process pool. With ffmpeg available, each frame range is
+encoded by its own process and the segments are concatenated without re-encoding.
+"""
+
+import os
+import shutil
+import logging
+import tempfile
+import subprocess
+import numpy as np
+from pathlib import Path
+from concurrent.futures import ProcessPoolExecutor
+from ..readers.video_probe import open_video_at
+
+logger = logging.getLogger("datajoint")
+
+
+def output_frame_indices(nframes: int, fps: float, outputframerate: float):
+    """Frames kept in a labeled video at outputframerate (DLC's Frames2plot)"""
+    step = max(1, int(fps / outputframerate)) if outputframerate else 1
+    return np.arange(0, nframes, step)
+
+
+def body_part_colors(n_body_parts: int, colormap: str = "rainbow") -> list:
+    """BGR colors of the body parts, sampled from a matplotlib colormap"""
+    try:
+        from matplotlib import colormaps
+
+        rgba = colormaps[colormap](np.linspace(0, 1, n_body_parts))
+        bgr = (rgba[:, 2::-1] * 255).round()
+    except (ImportError, KeyError):
+        import cv2
+
+        hues = np.linspace(0, 179, n_body_parts, endpoint=False).astype(np.uint8)
+        hsv = np.stack([hues, np.full_like(hues, 255), np.full_like(hues, 255)], -1)
+        bgr = cv2.cvtColor(hsv[None], cv2.COLOR_HSV2BGR)[0]
+    return [tuple(int(c) for c in color) for color in bgr]
+
+
+def named_color(color, default=(0, 0, 0)) -> tuple:
+    """BGR tuple of a matplotlib color name or RGB(A) sequence in [0, 1]"""
+    try:
+        from matplotlib.colors import to_rgb
+
+        return tuple(int(round(c * 255)) for c in reversed(to_rgb(color)))
+    except (ImportError, ValueError):
+        return default
+
+
+def draw_poses(frame, points, visible, colors, dotsize, edges, edge_color):
+    """Draw skeleton segments and markers of one frame in place.
+
+    Args:
+        frame (np.ndarray): BGR image.
+        points (np.ndarray): Integer pixel positions (body parts, 2).
+        visible (np.ndarray): Whether each body part is drawn.
+        colors (list): BGR color of each body part.
+        dotsize (int): Marker radius in pixels.
+        edges (np.ndarray): Skeleton index pairs (edges, 2).
+        edge_color (tuple): BGR color of the skeleton.
+    """
+    import cv2
+
+    if len(edges):
+        shown = edges[visible[edges].all(axis=1)]
+        if len(shown):
+            cv2.polylines(frame, points[shown], False, edge_color, 1, cv2.LINE_AA)
+    for bp_idx in np.flatnonzero(visible):
+        cv2.circle(
+            frame, tuple(points[bp_idx]), dotsize, colors[bp_idx], -1, cv2.LINE_AA
+        )
+
+
+DEFAULT_ENCODER = {"codec": "libx264", "crf": 23, "preset": "veryfast", "threads": None}
+
+
+def find_ffmpeg():
+    """Path of the ffmpeg executable, from PATH or imageio-ffmpeg, or None"""
+    ffmpeg = shutil.which("ffmpeg")
+    if ffmpeg is None:
+        try:
+            import imageio_ffmpeg
+
+            ffmpeg = imageio_ffmpeg.get_ffmpeg_exe()
+        except (ImportError, RuntimeError):
+            pass
+    return ffmpeg
+
+
+class FFmpegWriter:
+    """Encode BGR frames by piping them to ffmpeg, like cv2.VideoWriter.
+
+    Args:
+        output_path (str): Path of the encoded video.
+        fps (float): Frame rate.
+        frame_size (tuple): (width, height) of the frames.
+        encoder (dict): codec, crf, preset and threads (None for ffmpeg's default).
+        ffmpeg (str): Path of the ffmpeg executable.
+    """
+
+    def __init__(
+        self, output_path: str, fps: float, frame_size: tuple, encoder: dict, ffmpeg
+    ):
+        encoder = {**DEFAULT_ENCODER, **encoder}
+        command = [
+            ffmpeg,
+            *("-y", "-loglevel", "error"),
+            *("-f", "rawvideo", "-pix_fmt", "bgr24"),
+            *("-s", f"{frame_size[0]}x{frame_size[1]}", "-r", str(fps), "-i", "-"),
+            # yuv420p requires even dimensions: odd ones are padded by a pixel
+            *("-vf", "pad=ceil(iw/2)*2:ceil(ih/2)*2"),
+            *("-c:v", encoder["codec"], "-pix_fmt", "yuv420p"),
+        ]
+        if encoder["crf"] is not None:
+            command += ["-crf", str(encoder["crf"])]
+        if encoder["preset"] is not None:
+            command += ["-preset", encoder["preset"]]
+        if encoder["threads"] is not None:
+            command += ["-threads", str(encoder["threads"])]
+        command.append(Path(output_path).as_posix())
+        self._process = subprocess.Popen(command, stdin=subprocess.PIPE)
+
+    def write(self, frame: np.ndarray):
+        self._process.stdin.write(np.ascontiguousarray(frame).tobytes())
+
+    def release(self):
+        self._process.stdin.close()
+        if self._process.wait():
+            raise RuntimeError(f"ffmpeg exited with code {self._process.returncode}")
+
+
+def render_frames(
+    video_path: str,
+    frame_indices: np.ndarray,
+    positions: np.ndarray,
+    output_path: str,
+    fps: float,
+    style: dict,
+    seek_threshold: int = 64,
+    encoder: dict = None,
+    ffmpeg: str = None,
+) -> str:
+    """Render labeled frames of a video, encoded with ffmpeg or as lossless FFV1.
+
+    Frames between two output frames are skipped with grab(), without color
+    conversion, or by seeking when the gap is larger than seek_threshold, so that
+    sparse output frames do not cost a full pass over the video. Seeks are checked
+    as in `video_probe.open_video_at`: after an inaccurate seek, the video is read
+    from the start and frames are only skipped with grab().
+
+    Args:
+        video_path (str): Full path to the video.
+        frame_indices (np.ndarray): Increasing frame indices to render.
+        positions (np.ndarray): Array (len(frame_indices), body parts, >= 2) of x,
+            y, ..., with likelihood in the last coordinate.
+        output_path (str): Path of the rendered video.
+        fps (float): Frame rate of the rendered video.
+        style (dict): draw_poses arguments: colors, dotsize, edges, edge_color,
+            and pcutoff.
+        seek_threshold (int): Optional. Minimum gap in frames to seek instead of
+            grabbing the frames in between.
+        encoder (dict): Optional. `FFmpegWriter` encoder settings. Without it,
+            frames are written losslessly with FFV1.
+        ffmpeg (str): Optional. Path of ffmpeg, required with encoder.
+    """
+    import cv2
+
+    points = np.rint(np.nan_to_num(positions[..., :2], nan=-1)).astype(np.int32)
+    likelihood = positions[..., -1]
+    visible = np.isfinite(positions[..., :2]).all(axis=-1) & (
+        likelihood >= style["pcutoff"]
+    )
+
+    if not len(frame_indices):
+        raise ValueError(f"No frames of {video_path} to render")
+    cap = open_video_at(video_path, int(frame_indices[0]))
+    writer = None
+    try:
+        position = int(frame_indices[0])  # index of the next frame read
+        for i, frame_index in enumerate(frame_indices):
+            if frame_index - position > seek_threshold:
+                cap.set(cv2.CAP_PROP_POS_FRAMES, int(frame_index))
+                if int(cap.get(cv2.CAP_PROP_POS_FRAMES)) != frame_index:
+                    logger.info(f"Inaccurate seek in {video_path}, reading frames")
+                    cap.release()
+                    cap = open_video_at(video_path, int(frame_index), sequential=True)
+                    seek_threshold = np.inf
+            else:
+                for _ in range(frame_index - position):
+                    cap.grab()
+            ret, frame = cap.read()
+            if not ret:
+                if writer is None:
+                    raise OSError(f"Unable to read frame {frame_index} of {video_path}")
+                logger.warning(
+                    f"{video_path} ended before frame {frame_index}:"
+                    + f" {len(frame_indices) - i} labeled frames not rendered"
+                )
+                break
+            position = frame_index + 1
+            draw_poses(
+                frame,
+                points[i],
+                visible[i],
+                style["colors"],
+                style["dotsize"],
+                style["edges"],
+                style["edge_color"],
+            )
+            if writer is None and encoder is not None:
+                writer = FFmpegWriter(
+                    output_path, fps, (frame.shape[1], frame.shape[0]), encoder, ffmpeg
+                )
+            elif writer is None:
+                writer = cv2.VideoWriter(
+                    Path(output_path).as_posix(),
+                    cv2.VideoWriter_fourcc(*"FFV1"),
+                    fps,
+                    (frame.shape[1], frame.shape[0]),
+                )
+            writer.write(frame)
+    finally:
+        cap.release()
+        if writer is not None:
+            writer.release()
+    return output_path
+
+
+def join_parts(part_paths: list, output_path: str, fps: float) -> str:
+    """Encode rendered parts, in order, into one mp4 video"""
+    import cv2
+
+    writer = None
+    try:
+        for part_path in part_paths:
+            cap = cv2.VideoCapture(Path(part_path).as_posix())
+            while True:
+                ret, frame = cap.read()
+                if not ret:
+                    break
+                if writer is None:
+                    writer = cv2.VideoWriter(
+                        Path(output_path).as_posix(),
+                        cv2.VideoWriter_fourcc(*"mp4v"),
+                        fps,
+                        (frame.shape[1], frame.shape[0]),
+                    )
+                writer.write(frame)
+            cap.release()
+    finally:
+        if writer is not None:
+            writer.release()
+    return output_path
+
+
+def concat_parts(part_paths: list, output_path: str, ffmpeg: str) -> str:
+    """Concatenate encoded parts, in order, without re-encoding (ffmpeg concat)"""
+    if not part_paths:
+        raise ValueError(f"No parts to concatenate into {output_path}")
+    list_path = Path(part_paths[0]).with_name(f"{Path(output_path).stem}_parts.txt")
+    with open(list_path, "w") as f:
+        f.writelines(f"file '{Path(fp).resolve().as_posix()}'\n" for fp in part_paths)
+    subprocess.run(
+        [
+            ffmpeg,
+            *("-y", "-loglevel", "error", "-f", "concat", "-safe", "0"),
+            *("-i", list_path.as_posix(), "-c", "copy", "-movflags", "+faststart"),
+            Path(output_path).as_posix(),
+        ],
+        check=True,
+    )
+    return output_path
+
+
+def render_labeled_videos(
+    videos: list,
+    output_paths: list,
+    outputframerate: float,
+    style: dict,
+    n_workers: int = None,
+    n_segments: int = None,
+    encoder: dict = None,
+):
+    """Render and encode the labeled videos of a recording in a process pool.
+
+    With ffmpeg, each frame range is encoded to the final codec by its process and
+    the segments are concatenated losslessly. Otherwise, ranges are rendered to
+    FFV1 and encoded with cv2 (mp4v) in a single pass per file.
+
+    Args:
+        videos (list): (video path, frame_indices, positions) of each file, with
+            positions given for frame_indices only.
+        output_paths (list): Path of the labeled video of each file.
+        outputframerate (float): Frame rate of the labeled videos.
+        style (dict): See `render_frames`.
+        n_workers (int): Optional. Number of processes. Defaults to the CPU count.
+        n_segments (int): Optional. Frame ranges per file. Defaults to enough
+            ranges to use all processes.
+        encoder (dict): Optional. codec, crf, preset and threads of ffmpeg, see
+            DEFAULT_ENCODER. Threads default to the CPUs per process.
+
+    Returns:
+        Paths of the rendered videos. Files without output frames are skipped.
+    """
+    files = []
+    for video, output_path in zip(videos, output_paths):
+        if len(video[1]):
+            files.append((video, output_path))
+        else:
+            logger.warning(f"No output frames for {output_path}, skipped")
+    if not files:
+        return []
+    videos, output_paths = map(list, zip(*files))
+
+    n_workers = n_workers or os.cpu_count()
+    n_segments = n_segments or -(-n_workers // len(videos))
+
+    ffmpeg = find_ffmpeg()
+    if ffmpeg is None:
+        logger.warning("ffmpeg not found, labeled videos are encoded in one pass")
+        encoder = None
+    else:
+        encoder = {"threads": max(1, os.cpu_count() // n_workers), **(encoder or {})}
+    part_suffix = ".avi" if encoder is None else Path(output_paths[0]).suffix
+
+    output_dir = Path(output_paths[0]).parent
+    with tempfile.TemporaryDirectory(
+        prefix=".dj_dlc_labeled_", dir=output_dir
+    ) as tmp_dir, ProcessPoolExecutor(max_workers=n_workers) as executor:
+        parts = []  # [(output_path, [part futures])]
+        for file_idx, ((video, frame_indices, positions), output_path) in enumerate(
+            zip(videos, output_paths)
+        ):
+            futures = []
+            for seg_idx, seg in enumerate(
+                np.array_split(np.arange(len(frame_indices)), n_segments)
+            ):
+                if not len(seg):
+                    continue
+                futures.append(
+                    executor.submit(
+                        render_frames,
+                        video,
+                        frame_indices[seg],
+                        positions[seg],
+                        Path(tmp_dir)
+                        / f"part{file_idx:03d}_{seg_idx:03d}{part_suffix}",
+                        outputframerate,
+                        style,
+                        encoder=encoder,
+                        ffmpeg=ffmpeg,
+                    )
+                )
+            parts.append((output_path, futures))
+
+        for output_path, futures in parts:
+            part_paths = [future.result() for future in futures]
+            missing = [fp for fp in part_paths if not Path(fp).exists()]
+            if missing:
+                raise FileNotFoundError(
+                    f"Parts of {output_path} were not written: {missing}"
+                )
+            if encoder is None:
+                join_parts(part_paths, output_path, outputframerate)
+            else:
+                concat_parts(part_paths, output_path, ffmpeg)
+    return output_paths
@@ -1,9 +1,14 @@
+import os
 import re
+import time
 import logging
 import numpy as np
 import pandas as pd
 from pathlib import Path
+from collections import OrderedDict
 import pickle
+from concurrent.futures import ThreadPoolExecutor
+from fnmatch import fnmatchcase
 from ruamel.yaml import YAML
 from element_interface.utils import find_root_directory, dict_to_uuid
 from datajoint.errors import DataJointError
@@ -21,6 +26,8 @@ class PoseEstimation:
         h5_path: str = None,
         yml_path: str = None,
         filename_prefix: str = "",
+        dtype=np.float64,
+        n_workers: int = 8,
     ):
         if dlc_dir is None:
             assert pkl_path and h5_path and yml_path, (
@@ -34,8 +41,8 @@ class PoseEstimation:
 
         # meta file: pkl - info about this DLC run (input video, configuration, etc.)
         if pkl_path is None:
-            self.pkl_paths = sorted(
-                self.dlc_dir.rglob(f"{filename_prefix}*meta.pickle")
+            self.pkl_paths = find_files(
+                self.dlc_dir, f"{filename_prefix}*meta.pickle", category="meta"
             )
             if not len(self.pkl_paths) > 0:
                 raise FileNotFoundError(
@@ -49,29 +56,41 @@ class PoseEstimation:
 
         # data file: h5 - body part outputs from the DLC post estimation step
         if h5_path is None:
-            self.h5_paths = sorted(self.dlc_dir.rglob(f"{filename_prefix}*.h5"))
-            if not len(self.h5_paths) > 0:
+            h5_paths = find_files(self.dlc_dir, f"{filename_prefix}*.h5", category="h5")
+            if not len(h5_paths) > 0:
                 raise FileNotFoundError(
                     f"No DLC output file (.h5) found in: {self.dlc_dir}"
                 )
+            # pair each meta file with the h5 file of the same stem (sans "_meta"),
+            # or the tracked h5 file of multi-animal outputs (e.g. "_el.h5")
+            self.h5_paths = [paired_h5_path(fp, h5_paths) for fp in self.pkl_paths]
+            unpaired = [
+                fp.name for fp, h5 in zip(self.pkl_paths, self.h5_paths) if h5 is None
+            ]
+            if unpaired:
+                raise FileNotFoundError(
+                    f"No DLC output file (.h5) matching the meta file(s): {unpaired}"
+                )
         else:
             h5_path = Path(h5_path)
             if not h5_path.exists():
                 raise FileNotFoundError(f"{h5_path} not found")
             self.h5_paths = [h5_path]
 
+            assert (
+                paired_h5_path(self.pkl_paths[0], self.h5_paths) is not None
+            ), f"Mismatching h5 ({self.h5_paths[0].stem}) and pickle {self.pkl_paths[0].stem}"
+
         # validate number of files
         assert len(self.h5_paths) == len(
             self.pkl_paths
         ), f"Unequal number of .h5 files ({len(self.h5_paths)}) and .pickle files ({len(self.pkl_paths)})"
 
-        assert (
-            self.pkl_paths[0].stem == self.h5_paths[0].stem + "_meta"
-        ), f"Mismatching h5 ({self.h5_paths[0].stem}) and pickle {self.pkl_paths[0].stem}"
-
         # config file: yaml - configuration for invoking the DLC post estimation step
         if yml_path is None:
-            yml_paths = list(self.dlc_dir.glob(f"{filename_prefix}*.y*ml"))
+            yml_paths = find_files(
+                self.dlc_dir, f"{filename_prefix}*.y*ml", recursive=False
+            )
             # If multiple, defer to the one we save.
             if len(yml_paths) > 1:
                 yml_paths = [val for val in yml_paths if val.stem == "dj_dlc_config"]
@@ -89,52 +108,80 @@ class PoseEstimation:
         self._rawdata = None
         self._yml = None
         self._data = None
+        self._header = None
+        self._segment_nframes = None
+        self._array = None
+        self._model = None
+        self.dtype = dtype
+        self.n_workers = n_workers
 
-        train_idx = np.where(
-            (np.array(self.yml["TrainingFraction"]) * 100).astype(int)
-            == int(self.pkl["training set fraction"] * 100)
-        )[0][0]
-        train_iter = int(self.pkl["Scorer"].split("_")[-1])
-
-        self.model = {
-            "Scorer": self.pkl["Scorer"],
-            "Task": self.yml["Task"],
-            "date": self.yml["date"],
-            "iteration": self.pkl["iteration (active-learning)"],
-            "shuffle": int(re.search(r"shuffle(\d+)", self.pkl["Scorer"]).groups()[0]),
-            "snapshotindex": self.yml["snapshotindex"],
-            "trainingsetindex": train_idx,
-            "training_iteration": train_iter,
-        }
+    # Only file discovery and pairing happen on construction, so that checking for
+    # existing outputs stays cheap. Metadata below is parsed on first access.
+
+    @property
+    def model(self):
+        """Model information from the pickle and yaml files"""
+        if self._model is None:
+            train_idx = np.where(
+                (np.array(self.yml["TrainingFraction"]) * 100).astype(int)
+                == int(self.pkl["training set fraction"] * 100)
+            )[0][0]
+            train_iter = int(self.pkl["Scorer"].split("_")[-1])
+
+            self._model = {
+                "Scorer": self.pkl["Scorer"],
+                "Task": self.yml["Task"],
+                "date": self.yml["date"],
+                "iteration": self.pkl["iteration (active-learning)"],
+                "shuffle": int(
+                    re.search(r"shuffle(\d+)", self.pkl["Scorer"]).groups()[0]
+                ),
+                "snapshotindex": self.yml["snapshotindex"],
+                "trainingsetindex": train_idx,
+                "training_iteration": train_iter,
+            }
+        return self._model
 
-        self.fps = self.pkl["fps"]
-        self.nframes = self.pkl["nframes"]
-        self.creation_time = self.h5_paths[0].stat().st_mtime
+    @property
+    def fps(self):
+        """Frames per second of the analyzed video(s)"""
+        return self.pkl["fps"]
+
+    @property
+    def nframes(self):
+        """Total number of frames across all output files"""
+        return self.pkl["nframes"]
+
+    @property
+    def creation_time(self):
+        """Modification time of the first h5 file"""
+        return self.h5_paths[0].stat().st_mtime
 
     @property
     def pkl(self):
         """Pickle file contents"""
         if self._pkl is None:
+            if self.n_workers > 1 and len(self.pkl_paths) > 1:
+                with ThreadPoolExecutor(
+                    max_workers=min(self.n_workers, len(self.pkl_paths))
+                ) as executor:
+                    metas = list(executor.map(_load_meta, self.pkl_paths))
+            else:
+                metas = [_load_meta(fp) for fp in self.pkl_paths]
+
             nframes = 0
             meta_hash = None
-            for fp in self.pkl_paths:
-                with open(fp, "rb") as f:
-                    meta = pickle.load(f)
-                nframes += meta["data"].pop("nframes")
-
-                # remove variable fields
-                for k in ("start", "stop", "run_duration"):
-                    meta["data"].pop(k)
-
+            for fp, (meta_nframes, fp_hash, meta) in zip(self.pkl_paths, metas):
+                nframes += meta_nframes
                 # confirm identical setting in all .pickle files
                 if meta_hash is None:
-                    meta_hash = dict_to_uuid(meta)
+                    meta_hash = fp_hash
                 else:
-                    assert meta_hash == dict_to_uuid(
-                        meta
+                    assert (
+                        meta_hash == fp_hash
                     ), f"Inconsistent DLC-model-config file used: {fp}"
 
-            self._pkl = meta["data"]
+            self._pkl = meta
             self._pkl["nframes"] = nframes
         return self._pkl
 
@@ -149,14 +196,45 @@ class PoseEstimation:
 
     @property
     def rawdata(self):
-        """Raw data from h5 file"""
+        """Raw data from h5 files, indexed by frame continuously across the files"""
         if self._rawdata is None:
-            self._rawdata = pd.concat([pd.read_hdf(fp) for fp in self.h5_paths])
+            self._rawdata = pd.concat(
+                [pd.read_hdf(fp) for fp in self.h5_paths], ignore_index=True
+            )
         return self._rawdata
 
+    @property
+    def array(self):
+        """Pose data as one contiguous array of shape (frames, body parts, coords)
+
+        Axes 1 and 2 are ordered as `body_parts` and `coords`. Filled chunk by chunk
+        from the h5 files, without building the concatenated dataframe. Multi-animal
+        outputs have the shape (frames, individuals, body parts, coords), as the
+        chunks of `iter_chunks`, with individuals ordered as `individuals`. Body
+        parts that an individual does not have (e.g. unique body parts) are NaN.
+        """
+        if self._array is None:
+            error_message = (
+                f"Total frames from .h5 file ({sum(self.segment_nframes)}) differs "
+                + f'from .pickle ({self.pkl["nframes"]})'
+            )
+            assert sum(self.segment_nframes) == self.pkl["nframes"], error_message
+
+            nframes = sum(self.segment_nframes)
+            array = np.empty((nframes, *self._frame_shape), dtype=self.dtype)
+            for frame_start, chunk in self.iter_chunks(dtype=self.dtype):
+                array[frame_start : frame_start + len(chunk)] = chunk
+            self._array = array
+        return self._array
+
+    @property
+    def body_part_index(self):
+        """Position of each body part along axis 1 of `array`"""
+        return {body_part: idx for idx, body_part in enumerate(self.body_parts)}
+
     @property
     def data(self):
-        """Data from the h5 file, restructured as a dict"""
+        """Data from the h5 file, restructured as a dict of views into `array`"""
         if self._data is None:
             self._data = self.reformat_rawdata()
         return self._data
@@ -169,25 +247,327 @@ class PoseEstimation:
 
     @property
     def body_parts(self):
-        """Set of body parts present in data file"""
-        return self.df.columns.levels[0]
+        """Set of body parts present in data file, across individuals"""
+        return self.header.columns.levels[-2]
+
+    @property
+    def individuals(self):
+        """Individuals of multi-animal outputs, in file order. Empty otherwise"""
+        if self.header.columns.nlevels < 3:
+            return []
+        return list(pd.unique(self.header.columns.get_level_values(0)))
+
+    @property
+    def individual_body_parts(self):
+        """Body parts of each individual of multi-animal outputs, in `body_parts` order"""
+        columns = self.header.columns.droplevel(-1)
+        return {
+            individual: [bp for bp in self.body_parts if (individual, bp) in columns]
+            for individual in self.individuals
+        }
 
     def reformat_rawdata(self):
-        """Transform raw h5 data into dict"""
-        error_message = (
-            f"Total frames from .h5 file ({len(self.rawdata)}) differs "
-            + f'from .pickle ({self.pkl["nframes"]})'
+        """Transform raw h5 data into dict of {body_part: {coord: array view}}
+
+        Multi-animal data is nested as {individual: {body_part: {coord: view}}},
+        with the body parts of each individual. The per-coordinate arrays are
+        zero-copy views into `array`.
+        """
+        if self.individuals:
+            body_part_index = self.body_part_index
+            return {
+                individual: {
+                    body_part: {
+                        c: self.array[i_idx, :, body_part_index[body_part], c_idx]
+                        for c_idx, c in enumerate(self.coords)
+                    }
+                    for body_part in body_parts
+                }
+                for i_idx, (individual, body_parts) in enumerate(
+                    self.individual_body_parts.items()
+                )
+            }
+        return {
+            body_part: {
+                c: self.array[:, bp_idx, c_idx] for c_idx, c in enumerate(self.coords)
+            }
+            for bp_idx, body_part in enumerate(self.body_parts)
+        }
+
+    @property
+    def header(self):
+        """Empty dataframe with the column layout of the h5 files, scorer level removed
+
+        Only the table metadata is read, so this is cheap for long recordings.
+        """
+        if self._header is None:
+            with pd.HDFStore(self.h5_paths[0], mode="r") as store:
+                columns = store.select(store.keys()[0], start=0, stop=0).columns
+            self._header = pd.DataFrame(columns=columns).get(columns.levels[0][0])
+        return self._header
+
+    @property
+    def coords(self):
+        """Coordinates recorded per body part, in file order (e.g. x, y, likelihood)"""
+        return list(pd.unique(self.header.columns.get_level_values(-1)))
+
+    @property
+    def segment_offsets(self):
+        """First frame of each h5 file in the stitched trajectory"""
+        return np.concatenate([[0], np.cumsum(self.segment_nframes)[:-1]]).astype(int)
+
+    @property
+    def segment_nframes(self):
+        """Number of frames in each h5 file, in the order of `h5_paths`"""
+        if self._segment_nframes is None:
+            self._segment_nframes = []
+            for fp in self.h5_paths:
+                with pd.HDFStore(fp, mode="r") as store:
+                    storer = store.get_storer(store.keys()[0])
+                    self._segment_nframes.append(int(storer.nrows))
+        return self._segment_nframes
+
+    @property
+    def _frame_shape(self) -> tuple:
+        """Shape of the data of one frame, ([individuals,] body parts, coords)"""
+        shape = (len(self.body_parts), len(self.coords))
+        return (len(self.individuals), *shape) if self.individuals else shape
+
+    def _column_positions(self, columns: pd.MultiIndex) -> np.ndarray:
+        """Positions of ([individual,] body part, coord) columns of one h5 file, in
+        array order. -1 for the body parts that an individual does not have."""
+        columns = columns.droplevel(0)
+        levels = [self.body_parts, self.coords]
+        if self.individuals:
+            levels.insert(0, self.individuals)
+        target = pd.MultiIndex.from_product(levels)
+        positions = columns.get_indexer(target)
+        missing = positions < 0
+        if self.individuals:  # except body parts an individual does not have
+            missing &= self.header.columns.get_indexer(target) >= 0
+        if missing.any():
+            raise ValueError(
+                "Body parts or coordinates differ across the h5 files of this result"
+            )
+        return positions
+
+    def iter_chunks(self, chunk_size: int = 100000, dtype=np.float64):
+        """Stream pose data, one h5 file after another, in bounded chunks.
+
+        Each chunk is read with HDF5 start/stop selection and never spans two files.
+        Peak memory is determined by `chunk_size`, not the recording length.
+
+        Args:
+            chunk_size (int): Optional. Maximum number of frames per chunk.
+            dtype (np.dtype): Optional. Data type of the yielded arrays.
+
+        Yields:
+            Tuple of (a) index of the first frame of the chunk in the recording and
+                (b) array of shape (frames, body parts, coords), ordered as
+                `body_parts` and `coords`, or (frames, individuals, body parts,
+                coords) for multi-animal outputs
+        """
+        for fp, nframes, frame_offset in zip(
+            self.h5_paths, self.segment_nframes, self.segment_offsets
+        ):
+            with pd.HDFStore(fp, mode="r") as store:
+                h5_key = store.keys()[0]
+                positions = None
+                for start in range(0, nframes, chunk_size):
+                    stop = min(start + chunk_size, nframes)
+                    chunk = store.select(h5_key, start=start, stop=stop)
+                    if positions is None:
+                        positions = self._column_positions(chunk.columns)
+                    values = chunk.to_numpy(dtype=dtype)
+                    if (positions < 0).any():  # -1 selects an appended NaN column
+                        values = np.hstack([values, np.full((len(values), 1), np.nan)])
+                    values = values[:, positions]
+                    yield frame_offset + start, values.reshape(
+                        len(values), *self._frame_shape
+                    )
+
+    def iter_frames(self, window: int = 10000, dtype=np.float64):
+        """Stream pose data in fixed-size windows of frames across all h5 files.
+
+        Windows may span the boundary between two consecutive h5 files. Only the
+        final window can be shorter than `window`.
+
+        Args:
+            window (int): Optional. Number of frames per window.
+            dtype (np.dtype): Optional. Data type of the yielded arrays.
+
+        Yields:
+            Tuple of (a) index of the first frame of the window in the recording and
+                (b) array of shape (window, body parts, coords), or (window,
+                individuals, body parts, coords) for multi-animal outputs
+        """
+        buffer = np.empty((window, *self._frame_shape), dtype=dtype)
+        filled, window_start = 0, 0
+        for frame_start, chunk in self.iter_chunks(chunk_size=window, dtype=dtype):
+            if filled == 0:
+                window_start = frame_start
+            taken = 0
+            while taken < len(chunk):
+                n = min(window - filled, len(chunk) - taken)
+                buffer[filled : filled + n] = chunk[taken : taken + n]
+                filled += n
+                taken += n
+                if filled == window:
+                    yield window_start, buffer.copy()
+                    window_start += window
+                    filled = 0
+        if filled:
+            yield window_start, buffer[:filled].copy()
+
+
+# h5 suffixes of the tracked multi-animal outputs: ellipse, box and skeleton trackers
+_TRACKER_SUFFIXES = ("_el", "_bx", "_sk")
+
+
+def paired_h5_path(meta_path: Path, h5_paths: list):
+    """h5 path among h5_paths with the stem of a meta file, None if not found.
+
+    Multi-animal outputs have no h5 file of the same stem as the meta file, but a
+    tracked one, e.g. "{stem}_el.h5".
+    """
+    stem = Path(meta_path).stem.removesuffix("_meta")
+    h5_paths = {Path(fp).name: Path(fp) for fp in h5_paths}
+    for suffix in ("", *_TRACKER_SUFFIXES):
+        if f"{stem}{suffix}.h5" in h5_paths:
+            return h5_paths[f"{stem}{suffix}.h5"]
+    return None
+
+
+def config_body_parts(dlc_config: dict) -> list:
+    """Body parts of a DLC config, with the unique body parts of multi-animal ones"""
+    if dlc_config.get("multianimalproject"):
+        return list(dlc_config["multianimalbodyparts"]) + list(
+            dlc_config.get("uniquebodyparts") or []
         )
-        assert len(self.rawdata) == self.pkl["nframes"], error_message
+    return list(dlc_config["bodyparts"])
+
+
+def _load_meta(fp: str) -> tuple:
+    """Load one meta pickle and fingerprint its run-independent content
+
+    Returns:
+        Tuple of (a) number of frames, (b) hash of the meta content without the
+            frame count and run-specific fields and (c) the meta "data" dict
+    """
+    with open(fp, "rb") as f:
+        meta = pickle.load(f)
+    nframes = meta["data"].pop("nframes")
+
+    # remove variable fields
+    for k in ("start", "stop", "run_duration"):
+        meta["data"].pop(k)
+
+    return nframes, dict_to_uuid(meta), meta["data"]
+
+
+_VIDEO_EXTENSIONS = (".avi", ".mp4", ".mov", ".mpeg", ".mkv")
+_scan_cache = OrderedDict()  # {(directory, recursive): (dir_mtimes, scanned)}
+_SCAN_CACHE_SIZE = 256  # directories, least recently used dropped beyond it
+# coarsest directory mtime resolution expected (FAT, NFS, some FUSE mounts)
+_MTIME_GRANULARITY_NS = 2_000_000_000
+
+
+def _classify(filename: str) -> str:
+    """Category of a file in a DLC output or project directory"""
+    suffix = Path(filename).suffix.lower()
+    if filename.endswith("meta.pickle"):
+        return "meta"
+    elif suffix == ".pickle":
+        return "pickle"
+    elif suffix == ".h5":
+        return "h5"
+    elif suffix in (".yaml", ".yml"):
+        return "yaml"
+    elif suffix in _VIDEO_EXTENSIONS:
+        return "video"
+    return "other"
+
+
+def scan_dir(directory: str, recursive: bool = True) -> dict:
+    """Classify every file in a directory in a single os.scandir walk.
+
+    Results are cached per directory and reused for as long as the modification
+    times of the directory and of all its scanned subdirectories are unchanged, so
+    repeated lookups in the same directory cost one stat per directory. Scans of
+    directories modified within the mtime granularity of the scan are not cached,
+    as a file created in the same timestamp tick would not change their mtime.
+
+    Args:
+        directory (str): Directory to scan.
+        recursive (bool): Optional, default True. Also scan subdirectories,
+            except the ".dj_dlc_*" working directories of the pipeline.
+
+    Returns:
+        dict of {category: sorted tuple of paths}, where category is one of "meta"
+            (*meta.pickle), "pickle", "h5", "yaml", "video" or "other"
+    """
+    directory = Path(directory)
+    cache_key = (directory, recursive)
+    if cache_key in _scan_cache:
+        dir_mtimes, scanned = _scan_cache[cache_key]
+        try:
+            if all(os.stat(d).st_mtime_ns == m for d, m in dir_mtimes.items()):
+                _scan_cache.move_to_end(cache_key)
+                return scanned
+        except FileNotFoundError:
+            pass
+        del _scan_cache[cache_key]
+
+    scan_time = time.time_ns()
+    dir_mtimes, files = {}, {}
+    pending = [directory]
+    while pending:
+        current = pending.pop()
+        dir_mtimes[current] = os.stat(current).st_mtime_ns
+        with os.scandir(current) as entries:
+            for entry in entries:
+                if entry.is_dir():
+                    # skip staging and quarantine directories of the pipeline
+                    if recursive and not entry.name.startswith(".dj_dlc_"):
+                        pending.append(Path(entry.path))
+                elif entry.is_file():
+                    files.setdefault(_classify(entry.name), []).append(Path(entry.path))
+
+    scanned = {category: tuple(sorted(paths)) for category, paths in files.items()}
+    if max(dir_mtimes.values()) < scan_time - _MTIME_GRANULARITY_NS:
+        _scan_cache[cache_key] = (dir_mtimes, scanned)
+        while len(_scan_cache) > _SCAN_CACHE_SIZE:
+            _scan_cache.popitem(last=False)
+    return scanned
+
+
+def find_files(
+    directory: str, pattern: str, category: str = None, recursive: bool = True
+) -> list:
+    """Return sorted paths in directory whose filename matches a glob pattern.
+
+    Backed by the cached `scan_dir`, as a replacement for `Path.glob`/`Path.rglob`.
+
+    Args:
+        directory (str): Directory to search.
+        pattern (str): Glob pattern matched against the filename, e.g. "*.h5".
+        category (str): Optional. Only consider files of this `scan_dir` category.
+        recursive (bool): Optional, default True. Also search subdirectories.
+
+    Returns:
+        Sorted list of matching paths
+    """
+    scanned = scan_dir(directory, recursive=recursive)
+    if category is None:
+        candidates = [fp for paths in scanned.values() for fp in paths]
+    else:
+        candidates = scanned.get(category, ())
+    return sorted(fp for fp in candidates if fnmatchcase(fp.name, pattern))
 
-        body_parts_position = {}
-        for body_part in self.body_parts:
-            body_parts_position[body_part] = {
-                c: self.df.get(body_part).get(c).values
-                for c in self.df.get(body_part).columns
-            }
 
-        return body_parts_position
+def clear_scan_cache():
+    """Drop all cached `scan_dir` results"""
+    _scan_cache.clear()
 
 
 def read_yaml(fullpath: str, filename: str = "*") -> tuple:
@@ -203,8 +583,8 @@ def read_yaml(fullpath: str, filename: str = "*") -> tuple:
     from deeplabcut.utils.auxiliaryfunctions import read_config
 
     # Take the DJ-saved if there. If not, return list of available
-    yml_paths = list(Path(fullpath).glob("dj_dlc_config.yaml")) or sorted(
-        list(Path(fullpath).glob(f"{filename}.y*ml"))
+    yml_paths = find_files(fullpath, "dj_dlc_config.yaml", recursive=False) or (
+        find_files(fullpath, f"{filename}.y*ml", recursive=False)
     )
 
     assert (  # If more than 1 and not DJ-saved,
@@ -0,0 +1,127 @@
+import math
+import time
+import logging
+import threading
+from pathlib import Path
+
+logger = logging.getLogger("datajoint")
+
+
+def parse_header(fields: list) -> dict:
+    """Column positions of iteration, loss and learning rate in a csv header
+
+    Used for PyTorch-engine learning stats. TensorFlow-engine files have no header
+    and the columns iteration, loss, learning rate.
+    """
+    names = [field.strip().lower() for field in fields]
+
+    def find(*candidates):
+        return next(
+            (i for i, name in enumerate(names) if any(c in name for c in candidates)),
+            None,
+        )
+
+    return {
+        "iteration": find("step", "iteration", "epoch"),
+        "loss": find("total_loss", "loss"),
+        "learning_rate": find("learning_rate", "lr"),
+    }
+
+
+class LearningStatsTailer(threading.Thread):
+    """Follow DLC's learning_stats.csv while training writes it.
+
+    New complete lines are read every `interval` seconds and passed, as a batch of
+    dicts with iteration, loss, learning_rate, iterations_per_second and eta (s),
+    to `on_rows`. The rate is measured between polls, from the iterations logged
+    and the wall-clock time in between.
+
+    Args:
+        stats_path (str): Path of learning_stats.csv, which may not exist yet.
+        on_rows (callable): Called with each non-empty batch of parsed rows.
+        maxiters (int): Optional. Final iteration, to estimate the ETA.
+        interval (float): Optional. Seconds between polls.
+    """
+
+    def __init__(self, stats_path, on_rows, maxiters: int = None, interval: float = 30):
+        super().__init__(daemon=True)
+        self.stats_path = Path(stats_path)
+        self.on_rows = on_rows
+        self.maxiters = maxiters
+        self.interval = interval
+        self._stop_event = threading.Event()
+        self._offset = 0
+        self._partial = ""
+        self._columns = {"iteration": 0, "loss": 1, "learning_rate": 2}
+        self._last_poll = None  # (time, iteration)
+
+    def run(self):
+        while not self._stop_event.wait(self.interval):
+            self._poll_safely()
+
+    def stop(self):
+        """Stop following, after reading the lines written so far"""
+        self._stop_event.set()
+        if self.is_alive():
+            self.join()
+        self._poll_safely()
+
+    def _poll_safely(self):
+        try:
+            self.poll()
+        except Exception as e:  # telemetry must never interrupt training
+            logger.warning(f"Unable to record training progress: {e}")
+
+    def poll(self) -> list:
+        """Read and report the lines appended since the last poll"""
+        try:
+            size = self.stats_path.stat().st_size
+        except FileNotFoundError:
+            return []
+        if size < self._offset:  # rewritten by a new training run
+            self._offset, self._partial, self._last_poll = 0, "", None
+        with open(self.stats_path, "r") as f:
+            f.seek(self._offset)
+            text = self._partial + f.read()
+            self._offset = f.tell()
+        *lines, self._partial = text.split("\n")
+
+        rows = []
+        for line in lines:
+            if not line.strip():
+                continue
+            fields = line.strip().split(",")
+            try:
+                values = {
+                    name: float(fields[idx]) if idx is not None else None
+                    for name, idx in self._columns.items()
+                }
+            except ValueError:
+                self._columns = parse_header(fields)
+                continue
+            values["iteration"] = int(values["iteration"])
+            rows.append(values)
+        if not rows:
+            return []
+
+        now = time.time()
+        rate = None
+        if self._last_poll is not None and now > self._last_poll[0]:
+            rate = (rows[-1]["iteration"] - self._last_poll[1]) / (
+                now - self._last_poll[0]
+            )
+        self._last_poll = (now, rows[-1]["iteration"])
+        for row in rows:
+            row["iterations_per_second"] = rate
+            row["eta"] = (
+                max(0, self.maxiters - row["iteration"]) / rate
+                if rate and self.maxiters
+                else None
+            )
+        if any(
+            row["loss"] is not None and not math.isfinite(row["loss"]) for row in rows
+        ):
+            logger.warning(f"Training loss diverged (non-finite) in {self.stats_path}")
+
+        self.on_rows(rows)
+        return rows
@@ -0,0 +1,182 @@
+import os
+import json
+import sqlite3
+import logging
+from pathlib import Path
+from contextlib import closing
+from concurrent.futures import ProcessPoolExecutor
+
+logger = logging.getLogger("datajoint")
+
+
+def probe_video(file_path: str) -> dict:
+    """Read container metadata of one video file with CV2.
+
+    Args:
+        file_path (str): Full path to the video file.
+
+    Returns:
+        dict with px_height, px_width, fps and nframes
+    """
+    import cv2
+
+    cap = cv2.VideoCapture(Path(file_path).as_posix())
+    try:
+        if not cap.isOpened():
+            raise OSError(f"Unable to open video file: {file_path}")
+        return {
+            "px_height": int(cap.get(cv2.CAP_PROP_FRAME_HEIGHT)),
+            "px_width": int(cap.get(cv2.CAP_PROP_FRAME_WIDTH)),
+            "fps": cap.get(cv2.CAP_PROP_FPS),
+            "nframes": int(cap.get(cv2.CAP_PROP_FRAME_COUNT)),
+        }
+    finally:
+        cap.release()
+
+
+def open_video_at(file_path: str, start: int = 0, sequential: bool = False):
+    """Open a video with CV2, positioned to read frame `start` next.
+
+    Seeking (CAP_PROP_POS_FRAMES) is fast but lands on the wrong frame with some
+    codecs and containers. A seek that does not report the requested position,
+    or sequential=True, decodes from the first frame with grab() instead.
+
+    Returns:
+        cv2.VideoCapture, to be released by the caller
+    """
+    import cv2
+
+    cap = cv2.VideoCapture(Path(file_path).as_posix())
+    if not cap.isOpened():
+        raise OSError(f"Unable to open video file: {file_path}")
+    if not start:
+        return cap
+    if not sequential:
+        cap.set(cv2.CAP_PROP_POS_FRAMES, start)
+        if int(cap.get(cv2.CAP_PROP_POS_FRAMES)) == start:
+            return cap
+        logger.info(f"Inaccurate seek in {file_path}, reading from the start")
+        cap.release()
+        cap = cv2.VideoCapture(Path(file_path).as_posix())
+    for _ in range(start):
+        if not cap.grab():
+            break
+    return cap
+
+
+class ProbeCache:
+    """Persistent cache of video metadata, stored as an SQLite file next to the data.
+
+    Entries are keyed by the full path of the video and are only reused while the
+    size and modification time of the file are unchanged, so probing unchanged files
+    again (e.g. after dropping the schema, or from another worker) needs a stat call
+    but never opens the video container. Lookups and inserts touch only the rows of
+    the videos concerned, and concurrent workers are serialized by SQLite.
+
+    Args:
+        cache_path (str): Path of the SQLite cache file. Created on first use.
+    """
+
+    _MAX_PARAMS = 500  # SQLite host parameters per lookup query
+
+    def __init__(self, cache_path: str):
+        self.cache_path = Path(cache_path)
+
+    def _connect(self) -> sqlite3.Connection:
+        self.cache_path.parent.mkdir(parents=True, exist_ok=True)
+        connection = sqlite3.connect(self.cache_path, timeout=60)
+        connection.execute(
+            "CREATE TABLE IF NOT EXISTS probe (path TEXT PRIMARY KEY,"
+            + " size INTEGER, mtime INTEGER, info TEXT)"
+        )
+        return connection
+
+    def _lookup(self, file_paths: list) -> dict:
+        """Valid cached metadata of file_paths, as {path: info}"""
+        paths = [Path(fp).as_posix() for fp in file_paths]
+        rows = []
+        try:
+            with closing(self._connect()) as connection:
+                for i in range(0, len(paths), self._MAX_PARAMS):
+                    chunk = paths[i : i + self._MAX_PARAMS]
+                    rows += connection.execute(
+                        "SELECT path, size, mtime, info FROM probe WHERE path IN"
+                        + f" ({','.join('?' * len(chunk))})",
+                        chunk,
+                    ).fetchall()
+        except sqlite3.Error as e:
+            logger.warning(
+                f"Ignoring unreadable video probe cache {self.cache_path}: {e}"
+            )
+        cached = {}
+        for path, size, mtime, info in rows:
+            stat = Path(path).stat()
+            if (size, mtime) == (stat.st_size, stat.st_mtime_ns):
+                cached[path] = json.loads(info)
+        return cached
+
+    def get(self, file_path: str):
+        """Cached metadata of file_path, or None if missing or outdated"""
+        return self._lookup([file_path]).get(Path(file_path).as_posix())
+
+    def put(self, probed: dict):
+        """Insert or replace the metadata of probed videos, given as {path: info}"""
+        rows = []
+        for fp, info in probed.items():
+            stat = Path(fp).stat()
+            rows.append(
+                (Path(fp).as_posix(), stat.st_size, stat.st_mtime_ns, json.dumps(info))
+            )
+        try:
+            with closing(self._connect()) as connection, connection:
+                connection.executemany(
+                    "INSERT OR REPLACE INTO probe VALUES (?, ?, ?, ?)", rows
+                )
+        except sqlite3.Error as e:
+            logger.warning(f"Unable to write video probe cache {self.cache_path}: {e}")
+
+    def probe_many(self, file_paths: list, n_workers: int = None) -> list:
+        """Return metadata for many videos, probing cache misses in a process pool.
+
+        Args:
+            file_paths (list): Full paths to video files.
+            n_workers (int): Optional. Maximum number of probing processes.
+                Defaults to the number of CPUs.
+
+        Returns:
+            List of dicts with px_height, px_width, fps and nframes, in input order
+        """
+        file_paths = [Path(fp) for fp in file_paths]
+        cached = self._lookup(file_paths)
+        misses = [fp for fp in file_paths if fp.as_posix() not in cached]
+        if misses:
+            probed = dict(zip(misses, _probe(misses, n_workers)))
+            self.put(probed)
+            cached.update({fp.as_posix(): info for fp, info in probed.items()})
+        return [cached[fp.as_posix()] for fp in file_paths]
+
+
+def probe_many(file_paths: list, cache_path: str = None, n_workers: int = None) -> list:
+    """Return metadata for many videos, see `ProbeCache.probe_many`.
+
+    Args:
+        file_paths (list): Full paths to video files.
+        cache_path (str): Optional. SQLite cache file. If None, no cache is used.
+        n_workers (int): Optional. Maximum number of probing processes.
+
+    Returns:
+        List of dicts with px_height, px_width, fps and nframes, in input order
+    """
+    if cache_path is None:
+        return _probe([Path(fp) for fp in file_paths], n_workers)
+    return ProbeCache(cache_path).probe_many(file_paths, n_workers=n_workers)
+
+
+def _probe(file_paths: list, n_workers: int = None) -> list:
+    """Probe videos, in a process pool if there are several"""
+    if len(file_paths) > 1 and n_workers != 1:
+        with ProcessPoolExecutor(
+            max_workers=min(n_workers or os.cpu_count(), len(file_paths))
+        ) as executor:
+            return list(executor.map(probe_video, file_paths))
+    return [probe_video(fp) for fp in file_paths]
@@ -8,14 +8,18 @@ import datajoint as dj
 import inspect
 import importlib
 import re
+import math
 from pathlib import Path
 import yaml
 
-from element_interface.utils import find_full_path, dict_to_uuid
+from element_interface.utils import dict_to_uuid
+from .paths import PathResolver
 from .readers import dlc_reader
+from .readers.learning_stats import LearningStatsTailer
 
 schema = dj.schema()
 _linking_module = None
+path_resolver = None  # PathResolver, created by activate()
 
 
 def activate(
@@ -41,6 +45,10 @@ def activate(
                                  with all behavioral recordings, as (list of) string(s).
         get_dlc_processed_data_dir(): Optional. Returns absolute path for processed
                                       data. Defaults to session video subfolder.
+
+    Root directories are requested once and paths resolved against them are
+    memoized by `path_resolver`. Call `path_resolver.invalidate()` after changing
+    the root directories or moving data.
     """
 
     if isinstance(linking_module, str):
@@ -52,8 +60,9 @@ def activate(
         linking_module, "get_dlc_root_data_dir"
     ), "The linking module must specify a lookup function for a root data directory"
 
-    global _linking_module
+    global _linking_module, path_resolver
     _linking_module = linking_module
+    path_resolver = PathResolver(get_dlc_root_data_dir)
 
     # activate
     schema.activate(
@@ -78,6 +87,7 @@ def get_dlc_root_data_dir() -> list:
     root_directories = _linking_module.get_dlc_root_data_dir()
     if isinstance(root_directories, (str, Path)):
         root_directories = [root_directories]
+    root_directories = list(root_directories)  # never extend the caller's list
 
     if (
         hasattr(_linking_module, "get_dlc_processed_data_dir")
@@ -239,6 +249,8 @@ class ModelTraining(dj.Computed):
     config_template: longblob     # stored full config file
     """
 
+    progress_interval = 30  # seconds between reads of learning_stats.csv
+
     # To continue from previous training snapshot, devs suggest editing pose_cfg.yml
     # https://github.com/DeepLabCut/DeepLabCut/issues/70
 
@@ -260,7 +272,7 @@ class ModelTraining(dj.Computed):
             "project_path", "model_prefix"
         )
 
-        project_path = find_full_path(get_dlc_root_data_dir(), project_path)
+        project_path = path_resolver.find_full_path(project_path)
 
         # ---- Build and save DLC configuration (yaml) file ----
         _, dlc_config = dlc_reader.read_yaml(project_path)  # load existing
@@ -273,7 +285,7 @@ class ModelTraining(dj.Computed):
                     int(dlc_config["trainingsetindex"])
                 ],
                 "training_filelist_datajoint": [  # don't overwrite origin video_sets
-                    find_full_path(get_dlc_root_data_dir(), fp).as_posix()
+                    path_resolver.find_full_path(fp).as_posix()
                     for fp in (VideoSet.File & key).fetch("file_path")
                 ],
             }
@@ -331,10 +343,21 @@ class ModelTraining(dj.Computed):
         for k in ["shuffle", "trainingsetindex", "maxiters"]:
             train_network_kwargs[k] = int(train_network_kwargs[k])
 
+        progress_writer = _ProgressWriter(key)
+        tailer = LearningStatsTailer(
+            model_train_folder / "learning_stats.csv",
+            on_rows=progress_writer,
+            maxiters=train_network_kwargs.get("maxiters"),
+            interval=self.progress_interval,
+        )
+        tailer.start()
         try:
             deeplabcut.train_network(dlc_cfg_filepath, **train_network_kwargs)
         except KeyboardInterrupt:  # Instructions indicate to train until interrupt
             print("DLC training stopped via Keyboard Interrupt")
+        finally:
+            tailer.stop()
+            progress_writer.close()
 
         # DLC goes by snapshot magnitude when judging 'latest' for evaluation
         # Here, we mean most recently generated
@@ -361,3 +384,70 @@ class ModelTraining(dj.Computed):
         self.insert1(
             {**key, "latest_snapshot": latest_snapshot, "config_template": dlc_config}
         )
+
+
+@schema
+class TrainingProgress(dj.Manual):
+    """Training progress, recorded from learning_stats.csv while training runs.
+
+    Rows are inserted by `ModelTraining.make` on a separate connection, so they are
+    visible during training, before the ModelTraining row exists.
+
+    Attributes:
+        TrainingTask (foreign key): TrainingTask key.
+        iteration (int unsigned): Training iteration.
+        loss (float): Optional. Training loss.
+        learning_rate (float): Optional. Learning rate.
+        iterations_per_second (float): Optional. Rate since the previous read.
+        eta (float): Optional. Estimated seconds until maxiters."""
+
+    definition = """
+    -> TrainingTask
+    iteration                  : int unsigned
+    ---
+    loss=null                  : float
+    learning_rate=null         : float
+    iterations_per_second=null : float
+    eta=null                   : float  # (s) estimated time until maxiters
+    """
+
+
+class _ProgressWriter:
+    """Insert learning_stats rows of a TrainingTask into TrainingProgress.
+
+    populate() runs make in a transaction, so the rows are inserted on a connection
+    of their own, opened with the first rows. Errors are logged as warnings by
+    `LearningStatsTailer` and retried with the next rows.
+    """
+
+    def __init__(self, key: dict):
+        self.key = {k: key[k] for k in TrainingTask.primary_key}
+        self._table = None
+
+    def __call__(self, rows: list):
+        if self._table is None:
+            connection = dj.Connection(
+                dj.config["database.host"],
+                dj.config["database.user"],
+                dj.config["database.password"],
+                port=dj.config.get("database.port"),
+            )
+            self._table = dj.FreeTable(connection, TrainingProgress.full_table_name)
+        self._table.insert(
+            (
+                {
+                    **self.key,
+                    **{
+                        k: None if isinstance(v, float) and not math.isfinite(v) else v
+                        for k, v in row.items()
+                    },
+                }
+                for row in rows
+            ),
+            replace=True,
+        )
+
+    def close(self):
+        if self._table is not None:
+            self._table.connection.close()
+            self._table = None
@@ -24,7 +24,7 @@ def test_generate_pipeline(pipeline):
         in model.PoseEstimation.BodyPartPosition.heading.secondary_attributes
     )
 
-    assert len(train.schema.list_tables()) == 5
+    assert len(train.schema.list_tables()) == 6
 
 
 def test_recording_info(pipeline, recording_info):
@@ -63,3 +63,547 @@ def test_pose_estimation(pipeline, pose_estimation):
     assert len(head_x) == len(tail_y)
     assert (round(head_x.std())) == 129
     assert (round(tail_y.std())) == 133
+
+
+def test_reader_iter_frames(pipeline, pose_estimation):
+    import numpy as np
+    from element_deeplabcut.readers import dlc_reader
+
+    model = pipeline["model"]
+
+    output_dir = model.PoseEstimationTask.fetch1("pose_estimation_output_dir")
+    output_dir = model.path_resolver.find_full_path(output_dir)
+    dlc_result = dlc_reader.PoseEstimation(output_dir)
+
+    windows = list(dlc_result.iter_frames(window=7000))
+
+    assert [start for start, _ in windows] == list(range(0, dlc_result.nframes, 7000))
+    streamed = np.concatenate([frames for _, frames in windows])
+    assert streamed.shape == (
+        dlc_result.nframes,
+        len(dlc_result.body_parts),
+        len(dlc_result.coords),
+    )
+    head_x = streamed[:, list(dlc_result.body_parts).index("head"), 0]
+    assert np.array_equal(head_x, dlc_result.data["head"]["x"])
+
+
+def test_get_trajectory(pipeline, pose_estimation):
+    model = pipeline["model"]
+
+    key = model.PoseEstimation.fetch1("KEY")
+    df = model.PoseEstimation.get_trajectory(key)
+    positions = model.PoseEstimation.get_trajectory(key, format="numpy")
+
+    assert df.shape == (positions.shape[0], positions.shape[1] * 4)
+    assert list(df.columns.get_level_values("bodyparts").unique()) == [
+        "head",
+        "tailbase",
+    ]
+    assert (df[key["model_name"], "head", "x"].values == positions[:, 0, 0]).all()
+    assert round(df[key["model_name"], "tailbase", "y"].std()) == 133
+
+
+def test_fetch_trajectories(pipeline, pose_estimation):
+    import numpy as np
+
+    model = pipeline["model"]
+
+    key = model.PoseEstimation.fetch1("KEY")
+    positions = model.PoseEstimation.get_trajectory(key, format="numpy")
+    trajectories = model.PoseEstimation.fetch_trajectories(
+        key, format="numpy", batch_size=1
+    )
+    assert list(trajectories) == [
+        tuple(key[k] for k in model.PoseEstimation.primary_key)
+    ]
+    assert np.allclose(next(iter(trajectories.values())), positions)
+
+    df = model.PoseEstimation.fetch_trajectories(key, body_parts=["tailbase"])
+    assert list(df.columns.get_level_values("bodyparts").unique()) == ["tailbase"]
+    assert np.allclose(df["tailbase", "y"].values, positions[:, 1, 1])
+
+
+def test_kinematics_table(pipeline, pose_estimation):
+    import numpy as np
+    from element_deeplabcut.readers import dlc_reader
+
+    model = pipeline["model"]
+    model.Kinematics.populate()
+
+    output_dir = model.PoseEstimationTask.fetch1("pose_estimation_output_dir")
+    dlc_result = dlc_reader.PoseEstimation(
+        model.path_resolver.find_full_path(output_dir)
+    )
+    kinematics = model.Kinematics.fetch1()
+    assert np.isclose(kinematics["fps"], dlc_result.fps)
+    assert kinematics["nframes"] == len(dlc_result.array)
+
+    motion = (model.Kinematics.BodyPart & {"body_part": "head"}).fetch1("motion")
+    assert motion.shape == (kinematics["nframes"], 4)
+    # head and tailbase: a single pair, no joint
+    assert len(model.Kinematics.Distance) == 1
+    assert not model.Kinematics.JointAngle
+
+
+def test_engine_output_layout(pipeline, tmp_path):
+    import numpy as np
+    from ruamel.yaml import YAML
+    from element_deeplabcut.inference import engines
+    from element_deeplabcut.readers import dlc_reader
+
+    scorer = "DLC_resnet50_topviewmouseshuffle1_1030000"
+    poses = np.random.default_rng(0).random((50, 2, 3), dtype=np.float32)
+    metadata = {
+        "start": 0.0,
+        "stop": 1.0,
+        "run_duration": 1.0,
+        "Scorer": scorer,
+        "fps": 60.0,
+        "nframes": len(poses),
+        "iteration (active-learning)": 0,
+        "training set fraction": 0.95,
+    }
+    engines.save_dlc_output(
+        tmp_path, "video", scorer, ["head", "tailbase"], poses, metadata
+    )
+    with open(tmp_path / "dj_dlc_config.yaml", "w") as f:
+        YAML(typ="safe", pure=True).dump(
+            {
+                "Task": "topviewmouse",
+                "date": "Jan1",
+                "TrainingFraction": [0.95],
+                "snapshotindex": -1,
+            },
+            f,
+        )
+
+    dlc_result = dlc_reader.PoseEstimation(tmp_path)
+
+    assert list(dlc_result.body_parts) == ["head", "tailbase"]
+    assert np.array_equal(dlc_result.array, poses)
+    assert dlc_result.model["training_iteration"] == 1030000
+    assert "onnx" in engines.list_engines()
+
+
+def test_video_checkpoints_resume(pipeline, tmp_path):
+    import numpy as np
+    import pytest
+    from element_deeplabcut.inference import engines
+    from element_deeplabcut.inference.checkpoints import (
+        VideoCheckpoints,
+        find_outputs,
+        output_nframes,
+    )
+
+    scorer = "DLC_resnet50_topviewmouseshuffle1_1030000"
+
+    def analyze(video_stem, nframes):
+        poses = np.zeros((nframes, 1, 3), dtype=np.float32)
+        return engines.save_dlc_output(
+            tmp_path, video_stem, scorer, ["head"], poses, {"nframes": nframes}
+        )
+
+    settings = {"model_name": "test", "pose_estimation_params": {}}
+    videos = [tmp_path / "video.mp4", tmp_path / "video_2.mp4"]
+    expected_nframes = {videos[0]: 30, videos[1]: 20}
+
+    # first run: video analyzed, video_2 interrupted while writing its h5
+    checkpoints = VideoCheckpoints(tmp_path, settings)
+    analyze("video", 30)
+    checkpoints.mark_done(videos[0], checkpoints.validate(videos[0], 30))
+    analyze("video_2", 20).write_bytes(b"truncated")
+    assert [len(find_outputs(tmp_path, v.stem)) for v in videos] == [1, 1]
+    assert output_nframes(tmp_path, "video_2") is None
+
+    # resumed run: only video_2 is analyzed again
+    checkpoints = VideoCheckpoints(tmp_path, settings)
+    pending = [v for v in videos if not checkpoints.is_done(v)]
+    assert pending == [videos[1]]
+    for video in pending:
+        analyze(video.stem, expected_nframes[video])
+        checkpoints.mark_done(video, checkpoints.validate(video, 20))
+    assert all(checkpoints.is_done(v) for v in videos)
+    assert not VideoCheckpoints(tmp_path, {**settings, "model_name": "other"}).is_done(
+        videos[0]
+    )
+
+    # outputs with other frame counts are quarantined, without marker
+    analyze("video", 25)
+    assert not checkpoints.is_done(videos[0])
+    with pytest.raises(ValueError):
+        checkpoints.validate(videos[0], 30)
+    assert not find_outputs(tmp_path, "video")
+    assert not checkpoints.marker_path(videos[0]).exists()
+    assert len(list((tmp_path / ".dj_dlc_quarantine").glob("video_*/*.h5"))) == 1
+    assert checkpoints.is_done(videos[1])
+
+
+def test_result_cache_restore(pipeline, tmp_path):
+    import os
+    import numpy as np
+    from element_deeplabcut.inference import engines
+    from element_deeplabcut.inference.checkpoints import find_outputs, output_nframes
+    from element_deeplabcut.inference.result_cache import ResultCache
+
+    scorer = "DLC_resnet50_topviewmouseshuffle1_1030000"
+    dlc_model = {"project_path": "project", "scorer": scorer, "shuffle": 1}
+    settings = {"pose_estimation_params": {}}
+    video_bytes = os.urandom(3 * 2**20)
+    for name in ("video.mp4", "moved_video.mp4"):
+        (tmp_path / name).write_bytes(video_bytes)
+
+    output_dir = tmp_path / "outputs"
+    poses = np.random.default_rng(0).random((40, 1, 3))
+    engines.save_dlc_output(
+        output_dir, "video", scorer, ["head"], poses, {"nframes": len(poses)}
+    )
+    cache = ResultCache(tmp_path / "cache")
+    key = cache.key(tmp_path / "video.mp4", dlc_model, settings)
+    cache.store(key, "video", output_dir)
+
+    # the same video under another path and stem has the same key
+    moved_key = cache.key(tmp_path / "moved_video.mp4", dlc_model, settings)
+    assert moved_key == key
+    assert cache.key(tmp_path / "video.mp4", dlc_model, {"other": 1}) != key
+    restored_dir = tmp_path / "restored"
+    restored_dir.mkdir()
+    assert cache.restore(moved_key, "moved_video", restored_dir)
+    restored = [fp for pair in find_outputs(restored_dir, "moved_video") for fp in pair]
+    assert [fp.name for fp in restored] == [
+        f"moved_video{scorer}_meta.pickle",
+        f"moved_video{scorer}.h5",
+    ]
+    assert output_nframes(restored_dir, "moved_video") == len(poses)
+    with open(restored[1], "ab") as f:  # writable, independent of the entry
+        f.write(b"0")
+    assert cache.restore(moved_key, "moved_video", restored_dir)
+    assert output_nframes(restored_dir, "moved_video") == len(poses)
+    assert not cache.restore("0" * 32, "moved_video", restored_dir)
+
+
+def test_probe_cache(pipeline, tmp_path):
+    import os
+    import cv2
+    import numpy as np
+    from element_deeplabcut.readers import video_probe
+
+    videos = []
+    for name, nframes in (("a.avi", 5), ("b.avi", 8)):
+        videos.append(tmp_path / name)
+        writer = cv2.VideoWriter(
+            str(videos[-1]), cv2.VideoWriter_fourcc(*"MJPG"), 30, (32, 24)
+        )
+        for _ in range(nframes):
+            writer.write(np.zeros((24, 32, 3), dtype=np.uint8))
+        writer.release()
+
+    cache = video_probe.ProbeCache(tmp_path / "probe_cache.sqlite")
+    assert cache.get(videos[0]) is None
+    infos = cache.probe_many(videos, n_workers=1)
+    assert [info["nframes"] for info in infos] == [5, 8]
+    assert cache.get(videos[1]) == infos[1]
+
+    # cached entries are used without opening the videos
+    cache.put({videos[0]: {**infos[0], "nframes": 99}})
+    reopened = video_probe.ProbeCache(cache.cache_path)
+    assert [info["nframes"] for info in reopened.probe_many(videos)] == [99, 8]
+    # and dropped once the file changes
+    stat = videos[0].stat()
+    os.utime(videos[0], ns=(stat.st_atime_ns, stat.st_mtime_ns + 10**9))
+    assert cache.get(videos[0]) is None
+    assert cache.probe_many(videos, n_workers=1) == infos
+
+
+def test_learning_stats_tailer(pipeline, tmp_path):
+    import time
+    from element_deeplabcut.readers.learning_stats import LearningStatsTailer
+
+    stats_path = tmp_path / "learning_stats.csv"
+    batches = []
+    tailer = LearningStatsTailer(stats_path, batches.append, maxiters=1000)
+    assert tailer.poll() == []  # not written yet
+
+    # TensorFlow engine: no header, iteration, loss, learning rate
+    stats_path.write_text("100,0.5,0.001\n200,0.4,0.001\n300,0.3")
+    rows = tailer.poll()
+    assert [row["iteration"] for row in rows] == [100, 200]
+    assert rows[0]["iterations_per_second"] is None
+    time.sleep(0.01)
+    with open(stats_path, "a") as f:
+        f.write(",0.001\n")
+    rows = tailer.poll()  # the partial line, once complete
+    assert rows == batches[-1]
+    assert [(row["iteration"], row["loss"]) for row in rows] == [(300, 0.3)]
+    assert rows[0]["iterations_per_second"] > 0 and rows[0]["eta"] > 0
+
+    # rewritten by a PyTorch engine run, with a header
+    stats_path.write_text("step,lr,total_loss\n10,0.01,2.0\n")
+    rows = tailer.poll()
+    assert [(r["iteration"], r["loss"], r["learning_rate"]) for r in rows] == [
+        (10, 2.0, 0.01)
+    ]
+    assert len(batches) == 3
+
+
+def test_pose_quality_metrics(pipeline):
+    import numpy as np
+    from element_deeplabcut.analysis import quality
+
+    positions = np.zeros((100, 2, 3))
+    positions[..., 0] = np.arange(100)[:, None]  # 1 px per frame
+    positions[..., 2] = 0.9
+    positions[40:50, 0, 2] = 0.1  # low likelihood run
+    positions[70, 1, 0] = 150  # jump out of the 120 px wide frame
+
+    metrics = quality.pose_quality(positions, 120, 120, pcutoff=0.6)
+    assert np.allclose(metrics["fraction_above_pcutoff"], [0.9, 1.0])
+    assert list(metrics["longest_low_likelihood_run"]) == [10, 0]
+    assert list(metrics["jump_outliers"]) == [0, 2]
+    assert list(metrics["out_of_frame"]) == [0, 1]
+
+
+def test_filter_chunks_match_whole_array(pipeline):
+    import numpy as np
+    from element_deeplabcut.analysis import filters
+
+    rng = np.random.default_rng(0)
+    positions = rng.normal(100, 2, (1000, 3, 3))
+    positions[..., 2] = 0.9
+    positions[200:205, 0, 2] = 0.1  # interpolated gap
+    positions[600:700, 1, 2] = 0.1  # gap longer than max_gap
+
+    params = {
+        "pcutoff": 0.6,
+        "max_gap": 10,
+        "filters": [
+            {"type": "median", "window": 5},
+            {"type": "savgol", "window": 7, "polyorder": 2},
+        ],
+    }
+    whole = filters.filter_positions(positions, params)
+    assert np.isfinite(whole[200:205, 0, :2]).all()
+    assert np.isnan(whole[610:690, 1, :2]).all()
+
+    chunks = [(start, positions[start : start + 300]) for start in (0, 300, 600, 900)]
+    chunked = np.concatenate(
+        [chunk for _, chunk in filters.filter_chunks(chunks, params)]
+    )
+    assert np.allclose(chunked, whole, equal_nan=True)
+
+
+def test_triangulation(pipeline):
+    import numpy as np
+    from element_deeplabcut.analysis import triangulation
+
+    intrinsics = np.array([[800, 0, 320], [0, 800, 240], [0, 0, 1.0]])
+    projections = []
+    for angle in (-0.5, 0, 0.5):
+        c, s = np.cos(angle), np.sin(angle)
+        rotation = np.array([[c, 0, s], [0, 1, 0], [-s, 0, c]])
+        projections.append(
+            triangulation.projection_matrix(intrinsics, rotation, [0, 0, 1000])
+        )
+    projections = np.stack(projections)
+
+    xyz = np.random.default_rng(0).uniform(-100, 100, (50, 2, 3))
+    points = triangulation.reproject(xyz, projections)
+    weights = np.full(points.shape[:-1], 0.9)
+    weights[1:, :10] = 0  # single view: not triangulated
+
+    chunks = list(triangulation.triangulate_chunks(points, weights, projections, 20))
+    result = np.concatenate([chunk_xyz for _, chunk_xyz, _ in chunks])
+    errors = np.concatenate([chunk_errors for _, _, chunk_errors in chunks])
+    assert np.isnan(result[:10]).all()
+    assert np.allclose(result[10:], xyz[10:])
+    assert np.allclose(errors[10:], 0, atol=1e-6)
+
+
+def test_kinematics(pipeline):
+    import numpy as np
+    from element_deeplabcut.analysis import kinematics
+
+    fps = 29.97
+    xy = np.zeros((20, 3, 2))
+    xy[:, 0, 0] = np.arange(20) * 2.0  # 2 px per frame along x
+    xy[:, 1] = [3.0, 4.0]
+    xy[:, 2] = [3.0, 0.0]
+    xy[5, 2] = np.nan
+
+    motion = kinematics.motion(xy, fps)
+    assert np.allclose(motion[:, 0, 0], 2 * fps)
+    assert np.allclose(motion[:, 0, 2], 2 * fps)
+    assert np.allclose(motion[:, 0, 3], 0)
+    assert np.isnan(motion[[4, 6], 2, :3]).all()
+
+    edges = kinematics.skeleton_edges(
+        [["a", "b"], ["a", "c"], ["a", "missing"]], ["a", "b", "c"]
+    )
+    assert edges.tolist() == [[0, 1], [0, 2]]
+    assert kinematics.skeleton_edges(None, ["a"]).shape == (0, 2)
+    assert kinematics.pairwise_edges(3).tolist() == [[0, 1], [0, 2], [1, 2]]
+
+    xy[:, 0] = 0
+    distances = kinematics.distances(xy, edges)
+    assert np.allclose(distances[0], [5, 3])
+    triplets = kinematics.joint_triplets(edges)
+    assert triplets.tolist() == [[0, 1, 2]]
+    angles = kinematics.joint_angles(xy, triplets)
+    assert np.allclose(angles[0], np.degrees(np.arctan2(4, 3)))
+    assert np.isnan(angles[5]).all()
+
+
+def test_scan_dir_cache(pipeline, tmp_path):
+    import os
+    import time
+    from element_deeplabcut.readers import dlc_reader
+
+    dlc_reader.clear_scan_cache()
+    (tmp_path / "a.h5").touch()
+    assert len(dlc_reader.scan_dir(tmp_path)["h5"]) == 1
+    # modified within the mtime granularity: rescanned, not cached
+    assert (tmp_path, True) not in dlc_reader._scan_cache
+    (tmp_path / "b.h5").touch()
+    assert len(dlc_reader.scan_dir(tmp_path)["h5"]) == 2
+
+    past = time.time() - 60
+    os.utime(tmp_path, (past, past))
+    dlc_reader.scan_dir(tmp_path)
+    assert (tmp_path, True) in dlc_reader._scan_cache
+    (tmp_path / "c.h5").touch()  # updates the mtime
+    assert len(dlc_reader.scan_dir(tmp_path)["h5"]) == 3
+    dlc_reader.clear_scan_cache()
+
+
+def test_reader_multi_animal(pipeline, tmp_path):
+    import pickle
+    import numpy as np
+    import pandas as pd
+    from element_deeplabcut.readers import dlc_reader
+
+    scorer = "DLC_resnet50_maJan1shuffle1_1000"
+    columns = pd.MultiIndex.from_tuples(
+        [
+            (scorer, individual, body_part, coord)
+            for individual, body_parts in (
+                ("mouse1", ["snout", "tail"]),
+                ("mouse2", ["snout", "tail"]),
+                ("single", ["corner"]),
+            )
+            for body_part in body_parts
+            for coord in ("x", "y", "likelihood")
+        ],
+        names=["scorer", "individuals", "bodyparts", "coords"],
+    )
+    values = np.arange(10 * len(columns), dtype=float).reshape(10, -1)
+    # maDLC writes the tracked h5 with a tracker suffix, not the meta file stem
+    pd.DataFrame(values, columns=columns).to_hdf(
+        tmp_path / f"video{scorer}_el.h5", key="df_with_missing", format="table"
+    )
+    meta = {"nframes": 10, "start": 0, "stop": 1, "run_duration": 1}
+    with open(tmp_path / f"video{scorer}_meta.pickle", "wb") as f:
+        pickle.dump({"data": meta}, f)
+    (tmp_path / "dj_dlc_config.yaml").write_text("Task: ma\n")
+
+    dlc_result = dlc_reader.PoseEstimation(tmp_path)
+    assert dlc_result.individuals == ["mouse1", "mouse2", "single"]
+    assert dlc_result.individual_body_parts["single"] == ["corner"]
+    assert dlc_result.array.shape == (10, 3, 3, 3)  # frame, individual, bp, coord
+    tail = dlc_result.body_part_index["tail"]
+    assert np.array_equal(
+        dlc_result.array[:, 1, tail, 0],
+        values[:, columns.get_loc((scorer, "mouse2", "tail", "x"))],
+    )
+    assert np.isnan(dlc_result.array[:, 2, tail]).all()
+    _, chunk = next(dlc_result.iter_chunks())
+    assert np.array_equal(chunk, dlc_result.array, equal_nan=True)
+
+
+def test_multi_animal_dependents(pipeline, pose_estimation):
+    import numpy as np
+
+    model = pipeline["model"]
+    key = model.PoseEstimation.fetch1("KEY")
+    assert model.PoseEstimation._fetch_individuals(key) == [None]
+
+    model.PoseEstimation.IndividualPosition.insert1(
+        {
+            **key,
+            "individual": "mouse1",
+            "body_part": "head",
+            "position": np.zeros((10, 3), dtype=np.float32),
+        },
+        allow_direct_insert=True,
+    )
+    try:
+        assert model.PoseEstimation._fetch_individuals(key) == ["mouse1"]
+        # tables keyed by body part only leave multi-animal entries out
+        for table in (model.PoseQuality, model.Kinematics):
+            assert not (table.key_source & key)
+        assert not (model.FilteredPoseEstimation.key_source & key)
+        assert model.LabeledVideo.key_source & key
+    finally:
+        (model.PoseEstimation.IndividualPosition & key).delete_quick()
+    assert model.Kinematics.key_source & key
+
+
+def test_populate_batched_stub_engine(pipeline, pose_estimation):
+    import shutil
+    from pathlib import Path
+
+    model = pipeline["model"]
+
+    load_task = model.PoseEstimationTask.fetch1()
+    example_dir = model.path_resolver.find_full_path(
+        load_task["pose_estimation_output_dir"]
+    )
+    recording_key = {
+        "subject": "subject6",
+        "session_datetime": "2021-06-03 14:43:10",
+        "recording_id": 2,
+    }
+    task_key = {**recording_key, "model_name": load_task["model_name"]}
+    model.VideoRecording.insert1({**recording_key, "device": "Camera1"})
+    model.VideoRecording.File.insert1(
+        {
+            **recording_key,
+            "file_id": 0,
+            "file_path": (model.VideoRecording.File & load_task).fetch1("file_path"),
+        }
+    )
+    model.RecordingInfo.populate(recording_key)
+    model.PoseEstimationTask.insert1({**task_key, "task_mode": "trigger"})
+
+    calls = []
+
+    def analyze_videos(config, videos, shuffle, trainingsetindex, destfolder):
+        """Stub engine: copies the example outputs of the videos"""
+        calls.append(list(videos))
+        for video in videos:
+            for fp in example_dir.glob(f"{Path(video).stem}DLC*"):
+                if fp.suffix in (".h5", ".pickle"):
+                    shutil.copy(fp, Path(destfolder) / fp.name)
+
+    output_dir = None
+    try:
+        inserted = model.PoseEstimation.populate_batched(
+            task_key, analyze_videos=analyze_videos
+        )
+        assert inserted == [task_key]
+        assert len(calls) == 1
+
+        output_dir = model.path_resolver.find_full_path(
+            (model.PoseEstimationTask & task_key).fetch1("pose_estimation_output_dir")
+        )
+        assert list(output_dir.glob(".*.dj_dlc_done.json"))  # checkpointed
+        assert len(model.PoseEstimation.get_trajectory(task_key)) == (
+            model.RecordingInfo & recording_key
+        ).fetch1("nframes")
+
+        # done tasks are not analyzed again
+        assert model.PoseEstimation.populate_batched(task_key) == []
+        assert len(calls) == 1
+    finally:
+        (model.VideoRecording & recording_key).delete()
+        if output_dir is not None:
+            shutil.rmtree(output_dir, ignore_errors=True)